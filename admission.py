@@ -0,0 +1,200 @@
+"""Admission control of extraction requests by their estimated cost.
+
+The cost of a request is estimated from the uploaded files before anything is
+parsed: the number of sentences is guessed by counting sentence-ending
+punctuation (or sentences of CoNLL-U input) and the memory needed grows
+linearly with sentences plus quadratically for the sentence distance matrix
+of clustering.
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple
+
+SCAN_CHUNK_SIZE = 1024 * 1024
+SENTENCE_ENDS = (b".", b"!", b"?")
+# first token line of a CoNLL-U sentence
+CONLLU_SENTENCE_START = b"\n1\t"
+# parsed sentence, its relations and vectors, measured on news texts
+MEMORY_PER_SENTENCE = 64 * 1024
+# float64 cosine distances of clustering plus silhouette scoring
+MEMORY_PER_SENTENCE_PAIR = 2 * 8
+# how often a waiting request checks if other processes released budget
+SHARED_POLL_INTERVAL = 0.2
+
+
+class AdmissionError(Exception):
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Cost(NamedTuple):
+    bytes: int
+    sentences: int
+    memory: int
+
+    def to_dict(self):
+        return self._asdict()
+
+
+def estimate_cost(paths, is_conllu=False):
+    """Estimate the cost of extracting relations from the files at `paths`."""
+    total_bytes = 0
+    sentences = 0
+    for path in paths:
+        # a sentence starting the file counts too, as do the ones starting
+        # right at a chunk border
+        tail = b"\n"
+        with open(path, mode="rb") as file:
+            for chunk in iter(lambda: file.read(SCAN_CHUNK_SIZE), b""):
+                total_bytes += len(chunk)
+                if is_conllu:
+                    sentences += (tail + chunk).count(CONLLU_SENTENCE_START)
+                    tail = (tail + chunk)[-2:]
+                else:
+                    sentences += sum(chunk.count(end) for end in SENTENCE_ENDS)
+    memory = sentences * MEMORY_PER_SENTENCE + sentences ** 2 * MEMORY_PER_SENTENCE_PAIR
+    return Cost(bytes=total_bytes, sentences=sentences, memory=memory)
+
+
+class AdmissionController:
+    """Keep the running requests within the concurrency and memory budgets.
+
+    A request costing more than the whole `memory_budget` is rejected right
+    away. Others wait in `acquire` until there is budget for them. Small
+    requests (no more than `fast_lane_bytes` of input) are admitted past the
+    concurrency limit, so they aren't stuck behind large ones, but they still
+    count against the memory budget.
+
+    The budgets are per process unless `state_path` is given. Then the
+    processes sharing the file, e.g. workers of a pre-fork server, keep their
+    requests within the budgets together: every process writes there what it
+    runs, under a lock on a file next to it.
+    """
+
+    def __init__(
+        self, max_concurrent=1, memory_budget=None, fast_lane_bytes=0, state_path=None
+    ):
+        self.max_concurrent = max_concurrent
+        self.memory_budget = memory_budget
+        self.fast_lane_bytes = fast_lane_bytes
+        self.state_path = Path(state_path) if state_path is not None else None
+        if self.state_path is not None:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self._running = 0
+        self._memory = 0
+        self._condition = threading.Condition()
+
+    def is_fast(self, cost):
+        return cost.bytes <= self.fast_lane_bytes
+
+    def check(self, cost):
+        """Raise AdmissionError if the request could never be admitted."""
+        if self.memory_budget is not None and cost.memory > self.memory_budget:
+            raise AdmissionError(
+                "Request needs about {} MB of memory, the limit is {} MB".format(
+                    cost.memory // 2 ** 20, self.memory_budget // 2 ** 20
+                ),
+                413,
+            )
+
+    def acquire(self, cost):
+        self.check(cost)
+        fast = self.is_fast(cost)
+        with self._condition:
+            while True:
+                with self._shared_state() as (other_running, other_memory):
+                    running = self._running + other_running
+                    memory = self._memory + other_memory
+                    if self._fits(cost, fast, running, memory):
+                        self._memory += cost.memory
+                        if not fast:
+                            self._running += 1
+                        return
+                # other processes don't notify this one
+                self._condition.wait(
+                    None if self.state_path is None else SHARED_POLL_INTERVAL
+                )
+
+    def release(self, cost):
+        with self._condition:
+            with self._shared_state():
+                self._memory -= cost.memory
+                if not self.is_fast(cost):
+                    self._running -= 1
+            self._condition.notify_all()
+
+    def status(self):
+        with self._condition:
+            with self._shared_state() as (other_running, other_memory):
+                return {
+                    "running": self._running + other_running,
+                    "max_concurrent": self.max_concurrent,
+                    "memory": self._memory + other_memory,
+                    "memory_budget": self.memory_budget,
+                }
+
+    def _fits(self, cost, fast, running, memory):
+        if not fast and running >= self.max_concurrent:
+            return False
+        if self.memory_budget is None or memory == 0:
+            # a request within the budget is always let in alone
+            return True
+        return memory + cost.memory <= self.memory_budget
+
+    @contextmanager
+    def _shared_state(self):
+        """Yield the running requests and memory of the other processes.
+
+        What this process runs is saved when the block is left.
+        """
+        if self.state_path is None:
+            yield 0, 0
+            return
+        lock_path = self.state_path.with_name(self.state_path.name + ".lock")
+        with lock_path.open("a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                pid = str(os.getpid())
+                others = {
+                    other_pid: usage
+                    for other_pid, usage in self._read_state().items()
+                    if other_pid != pid and _is_running(int(other_pid))
+                }
+                yield (
+                    sum(usage["running"] for usage in others.values()),
+                    sum(usage["memory"] for usage in others.values()),
+                )
+                state = dict(others)
+                if self._running or self._memory:
+                    state[pid] = {"running": self._running, "memory": self._memory}
+                tmp_path = self.state_path.with_name(
+                    "{}.{}.tmp".format(self.state_path.name, pid)
+                )
+                with tmp_path.open("w", encoding="utf-8") as file:
+                    json.dump(state, file)
+                os.replace(tmp_path, self.state_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            with self.state_path.open("r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,24 +1,69 @@
 import json
 import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-import chardet
 import gensim.downloader
 from flask import (
     Flask,
+    Response,
+    abort,
+    g,
+    jsonify,
     redirect,
     render_template,
     request,
+    safe_join,
+    send_file,
     send_from_directory,
+    stream_with_context,
     url_for,
 )
 from flask_wtf import FlaskForm
-from wtforms import BooleanField, IntegerField, MultipleFileField, SubmitField
+from gensim.models import KeyedVectors
+from wtforms import (
+    BooleanField,
+    IntegerField,
+    MultipleFileField,
+    SelectField,
+    SelectMultipleField,
+    SubmitField,
+)
 
-from relations import TextReltuples
-from syntax import parse_text
-from udpipe_model import UDPipeModel
+import metrics
+import profiling
+import tracing
+from admission import AdmissionController, AdmissionError, estimate_cost
+from artifacts import ArtifactStore
+from checkpoint import hash_file, hash_inputs
+from graph_index import EntityIndex, iter_gexf, iter_json
+from jobs import DONE, FAILED, JobQueue
+from near_duplicates import WEIGHT, NearDuplicateFilter, conllu_text
+from near_duplicates import sentence_weights as documents_sentence_weights
+from relations import (
+    DEFAULT_EXPORT_FORMATS,
+    EXPORT_FORMATS,
+    GEXF_VECTORS,
+    TextReltuples,
+)
+from relations_store import dump_relations, is_line_start, iter_lines, read_page
+from result_cache import ResultCache
+from syntax import (
+    clean_text_file,
+    document_conllu,
+    get_conllu,
+    parse_documents,
+    parse_text,
+)
+from text_encoding import detect_encoding, open_text
+from udpipe_service import load_udpipe
 
 logging.basicConfig(
     handlers=[logging.FileHandler("logs/server.log", "a", "utf-8")],
@@ -28,18 +73,138 @@ logging.basicConfig(
 
 app = Flask(__name__)
 app.config.from_json("instance/config.json")
-UDPIPE_MODEL = UDPipeModel(app.config["UDPIPE_MODEL"])
-W2V_MODEL = gensim.downloader.load("word2vec-ruscorpora-300")
+tracing.configure(
+    levels=app.config.get("TRACE_LEVELS"),
+    sample_rates=app.config.get("TRACE_SAMPLE_RATES"),
+    merge_trace_path=app.config.get("MERGE_TRACE_PATH"),
+)
+W2V_MODEL_NAME = "word2vec-ruscorpora-300"
+WARM_UP_TEXT = "Мама мыла раму."
+
+
+def load_w2v_model(mmap_path=None):
+    """Load the word2vec model, memory-mapping its vectors if `mmap_path` is set.
+
+    Memory-mapped vectors are shared between all the processes serving the app
+    through the page cache. The model is converted to the mmap-able format and
+    saved to `mmap_path` on the first run.
+    """
+    if mmap_path is None:
+        return gensim.downloader.load(W2V_MODEL_NAME)
+    if not Path(mmap_path).exists():
+        model = gensim.downloader.load(W2V_MODEL_NAME)
+        Path(mmap_path).parent.mkdir(parents=True, exist_ok=True)
+        model.save(mmap_path)
+    return KeyedVectors.load(mmap_path, mmap="r")
+
+
+METRICS = metrics.Registry(app.config.get("METRICS_MULTIPROCESS_DIR"))
+REQUESTS = METRICS.counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+REQUEST_DURATION = METRICS.histogram(
+    "http_request_duration_seconds",
+    "Time to process an HTTP request till the response is returned",
+    ["method", "route"],
+)
+STAGE_DURATION = METRICS.histogram(
+    "extraction_stage_duration_seconds",
+    "Duration of the extraction pipeline stages",
+    ["stage"],
+)
+INPUT_BYTES = METRICS.histogram(
+    "extraction_input_bytes", "Size of extraction inputs", buckets=metrics.SIZE_BUCKETS
+)
+INPUT_SENTENCES = METRICS.histogram(
+    "extraction_input_sentences",
+    "Sentences in extraction inputs",
+    buckets=metrics.SIZE_BUCKETS,
+)
+OUTPUT_NODES = METRICS.histogram(
+    "extraction_output_nodes",
+    "Nodes of the extracted graphs",
+    buckets=metrics.SIZE_BUCKETS,
+)
+OUTPUT_EDGES = METRICS.histogram(
+    "extraction_output_edges",
+    "Edges of the extracted graphs",
+    buckets=metrics.SIZE_BUCKETS,
+)
+JOBS = METRICS.counter("extraction_jobs_total", "Finished extraction jobs", ["status"])
+QUEUE_DEPTH = METRICS.gauge(
+    "extraction_queue_depth",
+    "Extraction jobs waiting in the queue",
+    function=lambda: JOB_QUEUE.depth + FAST_JOB_QUEUE.depth,
+)
+ADMITTED_MEMORY = METRICS.gauge(
+    "extraction_admitted_memory_bytes",
+    "Estimated memory of the extraction jobs being run",
+    function=lambda: ADMISSION.status()["memory"],
+)
+MODEL_LOAD_SECONDS = METRICS.gauge(
+    "model_load_seconds", "Time it took to load the model", ["model"]
+)
+
+MODEL_LOAD_TIMES = {}
+load_start = time.perf_counter()
+UDPIPE_MODEL = load_udpipe(
+    app.config["UDPIPE_MODEL"], app.config.get("UDPIPE_SERVICE_SOCKET")
+)
+MODEL_LOAD_TIMES["udpipe"] = time.perf_counter() - load_start
+load_start = time.perf_counter()
+W2V_MODEL = load_w2v_model(app.config.get("W2V_MMAP_PATH"))
+MODEL_LOAD_TIMES["word2vec"] = time.perf_counter() - load_start
+for model_name, load_time in MODEL_LOAD_TIMES.items():
+    MODEL_LOAD_SECONDS.set(load_time, model=model_name)
+WARM = threading.Event()
 with open("stopwords.txt", mode="r", encoding="utf-8") as file:
     STOPWORDS = list(file.read().split())
 
 
-def guess_encoding(content):
-    encoding = chardet.detect(content)["encoding"]
-    if encoding == "utf-8":
-        return "utf-8"
-    else:
-        return "cp1251"
+PARSER_POOL = ThreadPoolExecutor(
+    max_workers=app.config.get("PARSER_THREADS", 2), thread_name_prefix="parser"
+)
+ARTIFACT_STORE = ArtifactStore(
+    {
+        "graph": app.config["GRAPH_DIR"],
+        "json": app.config["JSON_DIR"],
+        "relations": app.config["JSON_DIR"],
+        "conllu": app.config["CONLLU_DIR"],
+        "tables": app.config["GRAPH_DIR"],
+    },
+    compression=app.config.get("ARTIFACT_COMPRESSION"),
+    # read by byte offsets or compressed already
+    uncompressed=["relations", "tables"],
+    max_age=app.config.get("ARTIFACT_MAX_AGE"),
+    max_bytes=app.config.get("ARTIFACT_MAX_BYTES"),
+)
+if app.config.get("ARTIFACT_MAX_AGE") or app.config.get("ARTIFACT_MAX_BYTES"):
+    ARTIFACT_STORE.start_cleanup(app.config.get("ARTIFACT_CLEANUP_INTERVAL", 3600))
+RESULT_CACHE = ResultCache(
+    app.config.get("RESULT_CACHE_INDEX", "cache/results.json"),
+    max_entries=app.config.get("RESULT_CACHE_MAX_ENTRIES", 100),
+    max_bytes=app.config.get("RESULT_CACHE_MAX_BYTES"),
+)
+MAX_RELATIONS_PAGE_SIZE = 1000
+MAX_ENTITIES_PAGE_SIZE = 100
+MAX_EGO_NODES = app.config.get("MAX_EGO_NODES", 5000)
+GRAPH_INDEX_CACHE_SIZE = app.config.get("GRAPH_INDEX_CACHE_SIZE", 4)
+GRAPH_INDICES = OrderedDict()
+GRAPH_INDICES_LOCK = threading.Lock()
+NEAR_DUPLICATES = app.config.get("NEAR_DUPLICATES")
+ENTITY_PREFILTER = app.config.get("ENTITY_PREFILTER")
+EXPORT_FORMATS_DEFAULT = app.config.get("EXPORT_FORMATS", DEFAULT_EXPORT_FORMATS)
+GEXF_VECTORS_DEFAULT = app.config.get("GEXF_VECTORS", "full")
+EXTRACTION_STAGES = [
+    "admission",
+    "parse",
+    "extract",
+    "cluster",
+    "graph",
+    "merge",
+    "filter",
+    "save",
+]
 
 
 class TextForm(FlaskForm):
@@ -51,9 +216,55 @@ class TextForm(FlaskForm):
     is_conllu = BooleanField(
         "Содержимое является синтаксически разобранным текстом в формате CoNLL-U"
     )
+    export_formats = SelectMultipleField(
+        "Форматы результата",
+        choices=[
+            ("gexf", "Граф в формате GEXF"),
+            ("json", "Отношения в формате JSON"),
+            ("tables", "Таблицы вершин и ребер графа (CSV) и векторы (NumPy)"),
+        ],
+        default=[
+            format_ for format_ in EXPORT_FORMATS_DEFAULT if format_ != "jsonl"
+        ],
+    )
+    gexf_vectors = SelectField(
+        "Векторы вершин в GEXF",
+        choices=[
+            ("full", "Полностью"),
+            ("quantized", "Округленные"),
+            ("none", "Без векторов"),
+        ],
+        default=GEXF_VECTORS_DEFAULT,
+    )
     submit = SubmitField("Отправить")
 
 
+@app.before_request
+def start_request_timer():
+    METRICS.start_flushing()
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    if "request_start" in g:
+        REQUEST_DURATION.observe(
+            time.perf_counter() - g.request_start, method=request.method, route=route
+        )
+    return response
+
+
+@app.errorhandler(AdmissionError)
+def admission_error(error):
+    response = jsonify({"error": str(error), "admission": ADMISSION.status()})
+    response.status_code = error.status_code
+    if error.retry_after is not None:
+        response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
 @app.route("/", methods=["GET", "POST"])
 def index(title=None):
     form = TextForm()
@@ -68,64 +279,637 @@ def parse():
     return parse_text(text, UDPIPE_MODEL)
 
 
-@app.route("/extract-relations", methods=["POST"])
-def extract():
-    tz_moscow = timezone(timedelta(hours=3))
-    timestamp = datetime.now(tz=tz_moscow).strftime("d%Y-%m-%dt%H-%M-%S.%f")
+@app.route("/parse/batch", methods=["POST"])
+def parse_batch():
+    """Parse many documents and stream CoNLL-U of each one as soon as it's ready.
+
+    Documents are either a JSON array of strings or of objects with "text" and
+    optional "id" and "format" fields, or files of a multipart form. Every
+    document starts with a "# newdoc id = <id>" comment, a document that failed
+    to be parsed has an "# error = <message>" comment instead of sentences.
+    """
+    if request.is_json:
+        documents = []
+        for i, document in enumerate(request.get_json()):
+            if isinstance(document, str):
+                document = {"text": document}
+            documents.append(
+                (str(document.get("id", i)), document["text"], document.get("format"))
+            )
+    else:
+        documents = []
+        for _, text_file in request.files.items(multi=True):
+            encoding = detect_encoding(text_file.stream)
+            documents.append(
+                (
+                    text_file.filename,
+                    text_file.read().decode(encoding, errors="replace"),
+                    Path(text_file.filename).suffix[1:],
+                )
+            )
+
+    def generate():
+        for doc_id, conllu, error in parse_documents(
+            documents, UDPIPE_MODEL, PARSER_POOL
+        ):
+            if error is not None:
+                logging.error("Failed to parse document {}: {}".format(doc_id, error))
+                yield "# newdoc id = {}\n# error = {}\n\n".format(
+                    doc_id, str(error).replace("\n", " ")
+                )
+            else:
+                yield document_conllu(doc_id, conllu)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/plain",
+        headers={"X-Documents-Count": str(len(documents))},
+    )
+
+
+def run_extraction(job):
+    stage_timer = metrics.StageTimer(STAGE_DURATION)
+
+    def progress(stage, done=None, total=None):
+        stage_timer(stage)
+        job.set_progress(stage, done, total)
+
+    cost = job.payload["cost"]
+    progress("admission")
+    try:
+        ADMISSION.acquire(cost)
+    except AdmissionError:
+        remove_uploads(job.payload["files"])
+        JOBS.inc(status=FAILED)
+        raise
+    try:
+        result = _run_extraction(job, progress)
+    except Exception:
+        JOBS.inc(status=FAILED)
+        raise
+    finally:
+        ADMISSION.release(cost)
+    stage_timer.finish()
+    JOBS.inc(status=DONE)
+    return result
+
+
+def _run_extraction(job, progress):
+    payload = job.payload
+    profiler = profiling.Profiler()
     conllu = ""
-    for text_file in request.files.getlist("text_files"):
-        file_content = text_file.read()
-        encoding = guess_encoding(file_content)
-        text = file_content.decode(encoding)
-        text_format = Path(text_file.filename).suffix[1:]
-        if request.form.get("is_conllu") == "y":
-            conllu = text
-        else:
-            new_conllu = parse_text(text, UDPIPE_MODEL, format_=text_format)
-            conllu = "{}\n{}".format(conllu, new_conllu)
+    progress("parse", 0, len(payload["files"]))
+    INPUT_BYTES.observe(
+        sum(os.path.getsize(upload_path) for _, upload_path in payload["files"])
+    )
+    duplicates_filter = None
+    if NEAR_DUPLICATES is not None:
+        duplicates_filter = NearDuplicateFilter(
+            threshold=NEAR_DUPLICATES.get("threshold", 0.8),
+            num_perm=NEAR_DUPLICATES.get("num_perm", 128),
+            shingle_size=NEAR_DUPLICATES.get("shingle_size", 5),
+        )
+    documents = []
+    try:
+        with profiler.activate():
+            for i, (filename, upload_path) in enumerate(payload["files"], start=1):
+                text_format = Path(filename).suffix[1:]
+                with open_text(upload_path) as text_file:
+                    if payload["is_conllu"]:
+                        new_conllu = text_file.read()
+                    else:
+                        text = clean_text_file(text_file, format_=text_format)
+                original = None
+                if duplicates_filter is not None:
+                    original = duplicates_filter.add(
+                        i, conllu_text(new_conllu) if payload["is_conllu"] else text
+                    )
+                if original is None:
+                    if not payload["is_conllu"]:
+                        with profiling.stage("parse_text"):
+                            new_conllu = get_conllu(UDPIPE_MODEL, text)
+                    documents.append((i, new_conllu))
+                    conllu = "{}\n{}".format(conllu, new_conllu)
+                else:
+                    logging.info(
+                        "Document {} of job {} is a near-duplicate of {}, "
+                        "skipping it".format(i, job.id, original)
+                    )
+                progress("parse", i)
+    finally:
+        remove_uploads(payload["files"])
+    sentence_weights = None
+    if duplicates_filter is not None and NEAR_DUPLICATES.get("policy") == WEIGHT:
+        sentence_weights = documents_sentence_weights(
+            documents, duplicates_filter.multiplicity
+        )
 
-    additional_relations = True
-    entities_limit = int(request.form["entities_limit"])
+    timestamp = payload["timestamp"]
+    conllu_filename = "{}.conllu".format(timestamp)
+    # written while the relations are extracted
+    conllu_written = ARTIFACT_STORE.write(
+        "conllu", conllu_filename, lambda file: file.write(conllu)
+    )
 
+    additional_relations = True
     text_reltuples = TextReltuples(
-        conllu, UDPIPE_MODEL, W2V_MODEL, STOPWORDS, additional_relations, entities_limit
+        conllu,
+        UDPIPE_MODEL,
+        W2V_MODEL,
+        STOPWORDS,
+        additional_relations,
+        payload["entities_limit"],
+        profiler=profiler,
+        progress=progress,
+        sentence_weights=sentence_weights,
+        entity_prefilter=ENTITY_PREFILTER,
     )
-    graph_filename = "{}.gexf".format(timestamp)
-    text_reltuples.graph.save(Path(app.config["GRAPH_DIR"], graph_filename))
+    INPUT_SENTENCES.observe(_profile_count(profiler, "extract", "sentences"))
+    OUTPUT_NODES.observe(text_reltuples.graph.nodes_number)
+    OUTPUT_EDGES.observe(text_reltuples.graph.edges_number)
 
-    json_filename = "{}.json".format(timestamp)
-    with Path(app.config["JSON_DIR"], json_filename).open(
-        mode="w", encoding="utf-8"
-    ) as json_file:
-        json.dump(text_reltuples.dictionary, json_file, ensure_ascii=False, indent=4)
+    progress("save")
+    export_formats = payload.get("export_formats", DEFAULT_EXPORT_FORMATS)
+    result = {"conllu_filename": conllu_filename}
+    written = [conllu_written]
+    if "tables" in export_formats:
+        result["tables_filename"] = "{}.zip".format(timestamp)
+
+        def save_tables(file):
+            with profiler.activate():
+                text_reltuples.graph.save_tables(file)
+
+        written.append(
+            ARTIFACT_STORE.write(
+                "tables", result["tables_filename"], save_tables, binary=True
+            )
+        )
+    if "gexf" in export_formats:
+        result["graph_filename"] = "{}.gexf".format(timestamp)
+        tables_written = written[-1] if "tables" in export_formats else None
+
+        def save_graph(file):
+            # saving GEXF changes the graph the tables are written from, the
+            # writers take the tables first, so waiting for them can't block
+            if tables_written is not None:
+                tables_written.result()
+            with profiler.activate():
+                text_reltuples.graph.save(
+                    file, vectors=payload.get("gexf_vectors", "full")
+                )
+
+        written.append(
+            ARTIFACT_STORE.write(
+                "graph", result["graph_filename"], save_graph, binary=True
+            )
+        )
+    if "json" in export_formats:
+        result["json_filename"] = "{}.json".format(timestamp)
+        written.append(
+            ARTIFACT_STORE.write(
+                "json",
+                result["json_filename"],
+                lambda file: json.dump(
+                    text_reltuples.dictionary, file, ensure_ascii=False
+                ),
+            )
+        )
+    result["relations_filename"] = "{}.jsonl".format(timestamp)
+    written.append(
+        ARTIFACT_STORE.write(
+            "relations",
+            result["relations_filename"],
+            lambda file: dump_relations(text_reltuples.sentences_relations(), file),
+        )
+    )
+    paths = [future.result() for future in written]
+    logging.info(
+        "Pipeline profile of job {}: {}".format(job.id, json.dumps(profiler.report()))
+    )
+
+    RESULT_CACHE.put(payload["cache_key"], result, paths)
+    return result
+
+
+def _profile_count(profiler, stage, name):
+    for stats in profiler.report():
+        if stats["stage"] == stage:
+            return stats["counts"].get(name, 0)
+    return 0
 
-    conllu_filename = "{}.conllu".format(timestamp)
-    with Path(app.config["CONLLU_DIR"], conllu_filename).open(
-        mode="w", encoding="utf-8"
-    ) as conllu_file:
-        conllu_file.write(conllu)
 
+ADMISSION = AdmissionController(
+    max_concurrent=app.config.get("ADMISSION_MAX_CONCURRENT", 1),
+    memory_budget=app.config.get("ADMISSION_MEMORY_BUDGET"),
+    fast_lane_bytes=app.config.get("ADMISSION_FAST_LANE_BYTES", 0),
+    state_path=app.config.get("ADMISSION_STATE_PATH"),
+)
+MAX_QUEUED_JOBS = app.config.get("ADMISSION_MAX_QUEUED_JOBS", 100)
+JOB_QUEUE = JobQueue(
+    run_extraction,
+    EXTRACTION_STAGES,
+    n_workers=app.config.get("JOB_WORKERS", 1),
+    order=app.config.get("JOB_ORDER", "fifo"),
+    history_limit=app.config.get("JOB_HISTORY_LIMIT", 1000),
+    state_dir=app.config.get("JOBS_DIR"),
+)
+# small requests are run by their own workers, so they don't wait for large ones
+FAST_JOB_QUEUE = JobQueue(
+    run_extraction,
+    EXTRACTION_STAGES,
+    n_workers=app.config.get("FAST_LANE_WORKERS", 1),
+    history_limit=app.config.get("JOB_HISTORY_LIMIT", 1000),
+    state_dir=app.config.get("JOBS_DIR"),
+)
+
+
+def stop_jobs(timeout=None):
+    """Let the job queues finish their jobs for up to `timeout` seconds.
+
+    The jobs failed because they didn't finish in time leave no uploads
+    behind.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for job_queue in (FAST_JOB_QUEUE, JOB_QUEUE):
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        for job in job_queue.stop(remaining):
+            logging.warning("Job {} was stopped before it finished".format(job.id))
+            if job.payload is not None:
+                remove_uploads(job.payload["files"])
+
+
+def warm_up():
+    """Run the models once, so that the first request isn't slow.
+
+    With memory-mapped vectors this also pages them in before the workers
+    are forked.
+    """
+    if WARM.is_set():
+        return
+    start = time.perf_counter()
+    parse_text(WARM_UP_TEXT, UDPIPE_MODEL)
+    W2V_MODEL.vectors.sum()
+    logging.info(
+        "Models are warmed up in {:.2f} s".format(time.perf_counter() - start)
+    )
+    WARM.set()
+
+
+def submit_extraction():
+    tz_moscow = timezone(timedelta(hours=3))
+    timestamp = datetime.now(tz=tz_moscow).strftime("d%Y-%m-%dt%H-%M-%S.%f")
+    try:
+        entities_limit = int(
+            request.form.get("entities_limit", app.config["ENTITIES_LIMIT"])
+        )
+        priority = int(request.form.get("priority", 0))
+    except ValueError:
+        abort(400)
+    # the relations of the sentences are always written for the relations page
+    export_formats = sorted(
+        set(request.form.getlist("export_formats") or EXPORT_FORMATS_DEFAULT)
+        | {"jsonl"}
+    )
+    gexf_vectors = request.form.get("gexf_vectors", GEXF_VECTORS_DEFAULT)
+    if not set(export_formats) <= set(EXPORT_FORMATS) or (
+        gexf_vectors not in GEXF_VECTORS
+    ):
+        abort(400)
+    payload = {
+        "files": [
+            (text_file.filename, save_upload(text_file))
+            for text_file in request.files.getlist("text_files")
+        ],
+        "is_conllu": request.form.get("is_conllu") == "y",
+        "entities_limit": entities_limit,
+        "timestamp": timestamp,
+        "export_formats": export_formats,
+        "gexf_vectors": gexf_vectors,
+    }
+    payload["cache_key"] = request_cache_key(payload)
+    cached_result = RESULT_CACHE.get(payload["cache_key"])
+    if cached_result is not None and "relations_filename" in cached_result:
+        logging.info("Returning cached result {}".format(payload["cache_key"]))
+        remove_uploads(payload["files"])
+        return JOB_QUEUE.add_done(cached_result)
+
+    payload["cost"] = estimate_cost(
+        [upload_path for _, upload_path in payload["files"]], payload["is_conllu"]
+    )
+    job_queue = FAST_JOB_QUEUE if ADMISSION.is_fast(payload["cost"]) else JOB_QUEUE
+    try:
+        ADMISSION.check(payload["cost"])
+        if job_queue.depth >= MAX_QUEUED_JOBS:
+            raise AdmissionError(
+                "Too many requests are waiting, try again later", 503, retry_after=60
+            )
+    except AdmissionError:
+        remove_uploads(payload["files"])
+        raise
+    logging.info(
+        "Admitted request {} estimated as {}".format(
+            payload["timestamp"], payload["cost"].to_dict()
+        )
+    )
+    return job_queue.submit(payload, priority=priority)
+
+
+def get_job(job_id):
+    return JOB_QUEUE.get(job_id) or FAST_JOB_QUEUE.get(job_id)
+
+
+def save_upload(text_file):
+    """Spool the uploaded file to disk, so that it isn't kept in memory."""
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=app.config.get("UPLOAD_DIR"))
+    with os.fdopen(fd, mode="wb") as file:
+        text_file.save(file)
+    return path
+
+
+def remove_uploads(files):
+    for _, upload_path in files:
+        try:
+            os.remove(upload_path)
+        except FileNotFoundError:
+            continue
+
+
+def request_cache_key(payload):
+    udpipe_model_stat = Path(app.config["UDPIPE_MODEL"]).stat()
+    return hash_inputs(
+        *(
+            part
+            for filename, upload_path in payload["files"]
+            for part in (Path(filename).suffix, hash_file(upload_path))
+        ),
+        payload["is_conllu"],
+        payload["entities_limit"],
+        payload["export_formats"],
+        payload["gexf_vectors"],
+        app.config["UDPIPE_MODEL"],
+        udpipe_model_stat.st_size,
+        udpipe_model_stat.st_mtime,
+        W2V_MODEL_NAME,
+        NEAR_DUPLICATES,
+        ENTITY_PREFILTER,
+    )
+
+
+def job_status(job):
+    status = job.to_dict()
+    status["status_url"] = url_for("job", job_id=job.id)
+    if job.status == DONE:
+        status["downloads"] = {
+            type_: url_for("download", type_=type_, filename=job.result[key])
+            for type_, key in (
+                ("graph", "graph_filename"),
+                ("json", "json_filename"),
+                ("tables", "tables_filename"),
+                ("conllu", "conllu_filename"),
+            )
+            if key in job.result
+        }
+        status["relations_url"] = url_for("job_relations", job_id=job.id)
+        status["relations_api_url"] = url_for(
+            "relations_api", filename=job.result["relations_filename"]
+        )
+    return status
+
+
+@app.route("/extract-relations", methods=["POST"])
+def extract():
+    job = submit_extraction()
+    return redirect(url_for("job_page", job_id=job.id), code=303)
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    job = submit_extraction()
+    return jsonify(job_status(job)), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job(job_id):
+    job_ = get_job(job_id)
+    if job_ is None:
+        abort(404)
+    return jsonify(job_status(job_))
+
+
+@app.route("/jobs/<job_id>/view", methods=["GET"])
+def job_page(job_id):
+    job_ = get_job(job_id)
+    if job_ is None:
+        abort(404)
+    return render_template("job.html", job=job_status(job_))
+
+
+@app.route("/jobs/<job_id>/relations", methods=["GET"])
+def job_relations(job_id):
+    job_ = get_job(job_id)
+    if job_ is None:
+        abort(404)
+    if job_.status != DONE:
+        return redirect(url_for("job_page", job_id=job_id))
     return render_template(
         "relations.html",
-        relations_dict=text_reltuples.dictionary,
-        graph_filename=graph_filename,
-        json_filename=json_filename,
-        conllu_filename=conllu_filename,
+        relations_api_url=url_for(
+            "relations_api", filename=job_.result["relations_filename"]
+        ),
+        **job_.result,
+    )
+
+
+@app.route("/relations/<filename>", methods=["GET"])
+def relations_api(filename):
+    """Relations of the sentences from the `cursor` on.
+
+    Only the sentences having an argument with the `lemma` are returned if it
+    is given. With format=jsonl all of them are streamed as JSON lines,
+    otherwise a page of at most `limit` sentences is returned together with
+    the cursor of the next page.
+    """
+    path = safe_join(app.config["JSON_DIR"], filename)
+    if path is None or not filename.endswith(".jsonl") or not Path(path).exists():
+        abort(404)
+    try:
+        cursor = int(request.args.get("cursor", 0))
+        limit = min(int(request.args.get("limit", 100)), MAX_RELATIONS_PAGE_SIZE)
+    except ValueError:
+        abort(400)
+    # a cursor in the middle of a line would be read as a broken record
+    if limit < 1 or not is_line_start(path, cursor):
+        abort(400)
+    lemma = request.args.get("lemma") or None
+
+    if request.args.get("format") == "jsonl":
+        return Response(
+            stream_with_context(
+                line for line, _ in iter_lines(path, cursor=cursor, lemma=lemma)
+            ),
+            mimetype="application/x-ndjson",
+        )
+
+    sentences, next_cursor = read_page(path, cursor=cursor, limit=limit, lemma=lemma)
+    next_url = None
+    if next_cursor is not None:
+        next_url = url_for(
+            "relations_api",
+            filename=filename,
+            cursor=next_cursor,
+            limit=limit,
+            lemma=lemma,
+        )
+    return jsonify(
+        {
+            "sentences": sentences,
+            "next_cursor": next_cursor,
+            "next_url": next_url,
+        }
     )
 
 
+def graph_index(filename):
+    """EntityIndex of the saved graph, the last used ones are kept in memory."""
+    with GRAPH_INDICES_LOCK:
+        if filename in GRAPH_INDICES:
+            GRAPH_INDICES.move_to_end(filename)
+            return GRAPH_INDICES[filename]
+    with ARTIFACT_STORE.open("graph", filename) as graph_file:
+        index_ = EntityIndex.from_gexf(graph_file)
+    logging.info(
+        "Indexed {} entities and {} relations of {}".format(
+            index_.entities_number, index_.relations_number, filename
+        )
+    )
+    with GRAPH_INDICES_LOCK:
+        GRAPH_INDICES[filename] = index_
+        while len(GRAPH_INDICES) > GRAPH_INDEX_CACHE_SIZE:
+            GRAPH_INDICES.popitem(last=False)
+    return index_
+
+
+@app.route("/graphs/<filename>/entities", methods=["GET"])
+def graph_entities(filename):
+    """Heaviest entities of the graph having all the words of `q` and their
+    heaviest relations.
+
+    With prefix=1 the last word of `q` matches the words starting with it.
+    """
+    if not filename.endswith(".gexf"):
+        abort(404)
+    if not ARTIFACT_STORE.path("graph", filename).exists():
+        abort(404)
+    try:
+        limit = min(int(request.args.get("limit", 10)), MAX_ENTITIES_PAGE_SIZE)
+        relations_limit = min(
+            int(request.args.get("relations_limit", 10)), MAX_RELATIONS_PAGE_SIZE
+        )
+    except ValueError:
+        abort(400)
+    if limit < 1 or relations_limit < 0:
+        abort(400)
+    query = request.args.get("q", "")
+    prefix = request.args.get("prefix") in ("1", "true")
+    entities = graph_index(filename).search(
+        query, prefix=prefix, limit=limit, relations_limit=relations_limit
+    )
+    return jsonify({"query": query, "prefix": prefix, "entities": entities})
+
+
+@app.route("/graphs/<filename>/ego", methods=["GET"])
+def graph_ego(filename):
+    """Subgraph of the entities at most `radius` relations away from the
+    `node` ones, following only the relations of at least `min_weight`.
+
+    The subgraph of at most `max_nodes` entities is streamed as GEXF or, with
+    format=json, as JSON. It's taken from the cached index of the graph, so
+    the graph is read once and not per request.
+    """
+    if not filename.endswith(".gexf"):
+        abort(404)
+    if not ARTIFACT_STORE.path("graph", filename).exists():
+        abort(404)
+    try:
+        radius = int(request.args.get("radius", 1))
+        min_weight = float(request.args.get("min_weight", 0))
+        max_nodes = min(int(request.args.get("max_nodes", 500)), MAX_EGO_NODES)
+    except ValueError:
+        abort(400)
+    nodes = request.args.getlist("node")
+    if not nodes or radius < 0 or max_nodes < 1:
+        abort(400)
+    index_ = graph_index(filename)
+    if any(node not in index_ for node in nodes):
+        abort(404)
+    entities, relations = index_.ego(
+        nodes, radius=radius, min_weight=min_weight, max_nodes=max_nodes
+    )
+    if request.args.get("format") == "json":
+        return Response(iter_json(entities, relations), mimetype="application/json")
+    return Response(
+        iter_gexf(entities, relations),
+        mimetype="application/xml",
+        headers={
+            "Content-Disposition": "attachment; filename=ego_{}".format(filename)
+        },
+    )
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    status = {
+        "ready": WARM.is_set(),
+        "pid": os.getpid(),
+        "models": {
+            "udpipe": app.config["UDPIPE_MODEL"],
+            "udpipe_service": app.config.get("UDPIPE_SERVICE_SOCKET"),
+            "word2vec": W2V_MODEL_NAME,
+            "word2vec_mmap": app.config.get("W2V_MMAP_PATH") is not None,
+        },
+        "load_time": MODEL_LOAD_TIMES,
+    }
+    return jsonify(status), 200 if WARM.is_set() else 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(METRICS.render(), mimetype=metrics.CONTENT_TYPE)
+
+
 @app.route("/download/<type_>/<filename>", methods=["GET"])
 def download(type_, filename):
-    if type_ == "graph":
-        directory = app.config["GRAPH_DIR"]
-    elif type_ == "json":
-        directory = app.config["JSON_DIR"]
-    elif type_ == "conllu":
-        directory = app.config["CONLLU_DIR"]
+    """Send the artifact, compressed if it's stored compressed and the client
+    accepts the compression, decompressed otherwise."""
+    if type_ not in ("graph", "json", "tables", "conllu"):
+        abort(404)
+    encoding = ARTIFACT_STORE.encoding(type_)
+    path = ARTIFACT_STORE.path(type_, filename)
+    if encoding is None:
+        return send_from_directory(path.parent, path.name, as_attachment=True)
+    if not path.exists():
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if encoding in request.accept_encodings:
+        response = send_file(
+            str(path),
+            mimetype=mimetype,
+            as_attachment=True,
+            attachment_filename=filename,
+        )
+        response.headers["Content-Encoding"] = encoding
     else:
-        raise ValueError("Unknown download type")
-    return send_from_directory(directory, filename, as_attachment=True)
+        response = Response(
+            stream_with_context(ARTIFACT_STORE.iter_decompressed(type_, filename)),
+            mimetype=mimetype,
+            headers={
+                "Content-Disposition": "attachment; filename={}".format(filename)
+            },
+        )
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 if __name__ == "__main__":
+    warm_up()
     app.run(debug=True, host=app.config["HOST"], port=app.config["PORT"])
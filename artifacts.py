@@ -0,0 +1,171 @@
+"""Storage of the generated artifacts (graphs, JSONs, CoNLL-U) on disk.
+
+Artifacts are written in background threads, optionally compressed with gzip
+or zstd, and removed when they get older than `max_age` seconds or when all
+of them take more than `max_bytes`.
+"""
+import gzip
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+TMP_SUFFIX = ".tmp"
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class ArtifactStore:
+    """Artifacts of every type are kept in the directory `directories[type_]`.
+
+    Artifacts of the `uncompressed` types are never compressed, e.g. the ones
+    that are read by byte offsets.
+    """
+
+    def __init__(
+        self,
+        directories,
+        compression=None,
+        uncompressed=(),
+        max_age=None,
+        max_bytes=None,
+        n_writers=2,
+    ):
+        if compression is not None and compression not in EXTENSIONS:
+            raise ValueError("Unknown compression: {}".format(compression))
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self.directories = {
+            type_: Path(directory) for type_, directory in directories.items()
+        }
+        self.compression = compression
+        self.uncompressed = set(uncompressed)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._writers = ThreadPoolExecutor(
+            max_workers=n_writers, thread_name_prefix="artifact-writer"
+        )
+        for directory in self.directories.values():
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def encoding(self, type_):
+        """Compression of the artifacts of the type, None if not compressed."""
+        if type_ in self.uncompressed:
+            return None
+        return self.compression
+
+    def path(self, type_, filename):
+        if type_ not in self.directories:
+            raise KeyError("Unknown artifact type: {}".format(type_))
+        encoding = self.encoding(type_)
+        if encoding is not None:
+            filename += EXTENSIONS[encoding]
+        return self.directories[type_] / filename
+
+    def write(self, type_, filename, write, binary=False):
+        """Call `write(file)` to write the artifact in background.
+
+        The file is opened in binary mode if `binary` is set or as utf-8 text
+        otherwise. Return the future of the written artifact path. The
+        artifact appears at the path only after it is written completely.
+        """
+        path = self.path(type_, filename)
+        return self._writers.submit(
+            self._write, path, self.encoding(type_), write, binary
+        )
+
+    def open(self, type_, filename):
+        """Open the artifact for reading decompressed bytes."""
+        return self._open(self.path(type_, filename), self.encoding(type_), "rb")
+
+    def iter_decompressed(self, type_, filename):
+        """Yield the content of the artifact decompressed in chunks."""
+        with self.open(type_, filename) as file:
+            for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), b""):
+                yield chunk
+
+    def cleanup(self):
+        """Remove the artifacts past the age limit, then the oldest ones until
+        the rest fit in the size limit."""
+        files = []
+        for directory in set(self.directories.values()):
+            for path in directory.iterdir():
+                if not path.is_file() or path.name.endswith(TMP_SUFFIX):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        now = time.time()
+        total_size = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            too_large = self.max_bytes is not None and total_size > self.max_bytes
+            if not expired and not too_large:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            removed += 1
+        if removed:
+            logging.info("Removed {} old artifacts".format(removed))
+        return removed
+
+    def start_cleanup(self, interval):
+        """Run `cleanup` every `interval` seconds in a background thread."""
+
+        def clean_periodically():
+            while True:
+                try:
+                    self.cleanup()
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Failed to clean up artifacts")
+                time.sleep(interval)
+
+        thread = threading.Thread(
+            target=clean_periodically, name="artifact-cleanup", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _write(self, path, encoding, write, binary):
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+        try:
+            with self._open(tmp_path, encoding, "wb") as binary_file:
+                if binary:
+                    write(binary_file)
+                else:
+                    text_file = io.TextIOWrapper(binary_file, encoding="utf-8")
+                    write(text_file)
+                    text_file.flush()
+                    text_file.detach()
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+            raise
+        return path
+
+    @staticmethod
+    def _open(path, encoding, mode):
+        if encoding == "gzip":
+            return gzip.open(path, mode)
+        if encoding == "zstd":
+            return zstandard.open(path, mode)
+        return open(path, mode)
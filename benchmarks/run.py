@@ -0,0 +1,325 @@
+"""Benchmarks of the extraction pipeline on synthetic corpora.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.run --sizes 1000 10000 --output bench.json
+    python -m benchmarks.run --sizes 1000 10000 --baseline bench.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from itertools import repeat
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+
+from benchmarks.stubs import ConlluReader, StubKeyedVectors
+from benchmarks.synthetic import SyntheticConfig, SyntheticCorpus
+from relations import MIN_CLUSTER_SIZE, RelGraph, SentenceReltuples, TextReltuples
+
+
+class Measurement:
+    """Accumulate time and memory of several runs of the same scenario.
+
+    Peak memory delta is counted from the first run start, so for scenarios
+    that keep their results (like extraction) it includes the retained memory.
+    """
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.memory_start = None
+        self.memory_peak = 0
+        self.counts = {}
+
+    def __enter__(self):
+        if self.trace_memory:
+            current, _ = tracemalloc.get_traced_memory()
+            if self.memory_start is None:
+                self.memory_start = current
+                self.memory_peak = current
+            if hasattr(tracemalloc, "reset_peak"):  # python 3.9+
+                tracemalloc.reset_peak()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time += time.perf_counter() - self._wall_start
+        self.cpu_time += time.process_time() - self._cpu_start
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self.memory_peak = max(self.memory_peak, peak)
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self, scenario, n_sentences):
+        return {
+            "scenario": scenario,
+            "sentences": n_sentences,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_memory_delta": (
+                self.memory_peak - self.memory_start if self.trace_memory else None
+            ),
+            "counts": self.counts,
+        }
+
+
+def run_size(n_sentences, args, stopwords):
+    results = []
+    corpus = SyntheticCorpus(_synthetic_config(args))
+    reader = ConlluReader()
+    w2v_model = StubKeyedVectors(oov_rate=args.oov_rate, seed=args.seed)
+
+    reltuples = []
+    measurement = Measurement(args.trace_memory)
+    for chunk in corpus.chunks(n_sentences, chunk_size=args.chunk_size):
+        with measurement:
+            for sentence in reader.read(chunk, "conllu"):
+                reltuples.append(
+                    SentenceReltuples(
+                        sentence,
+                        w2v_model,
+                        additional_relations=args.additional_relations,
+                        stopwords=stopwords,
+                    )
+                )
+        del chunk
+    measurement.count("reltuples", sum(len(r) for r in reltuples))
+    results.append(measurement.to_dict("extraction", n_sentences))
+
+    text_reltuples = TextReltuples.__new__(TextReltuples)
+    text_reltuples._reltuples = reltuples
+    if n_sentences <= args.max_cluster_sentences:
+        measurement = Measurement(args.trace_memory)
+        with measurement:
+            cluster_labels = text_reltuples._cluster(
+                min_cluster_size=MIN_CLUSTER_SIZE,
+                max_cluster_size=MIN_CLUSTER_SIZE + 50,
+            )
+        measurement.count("clusters", len(set(cluster_labels)))
+        results.append(measurement.to_dict("cluster", n_sentences))
+    else:
+        # stand-in clustering of the size the real one would produce
+        cluster_labels = [i // (MIN_CLUSTER_SIZE * 2) for i in range(n_sentences)]
+        results.append(_skipped("cluster", n_sentences))
+
+    graph = RelGraph()
+    measurement = Measurement(args.trace_memory)
+    with measurement:
+        graph.add_sentences_reltuples(zip(reltuples, cluster_labels, repeat(1)))
+    measurement.count("nodes", graph.nodes_number)
+    measurement.count("edges", graph.edges_number)
+    results.append(measurement.to_dict("graph", n_sentences))
+
+    if n_sentences <= args.max_merge_sentences:
+        measurement = Measurement(args.trace_memory)
+        with measurement:
+            graph.merge_relations()
+        measurement.count("nodes", graph.nodes_number)
+        measurement.count("edges", graph.edges_number)
+        results.append(measurement.to_dict("merge", n_sentences))
+    else:
+        results.append(_skipped("merge", n_sentences))
+
+    measurement = Measurement(args.trace_memory)
+    with measurement:
+        graph.filter_nodes(args.entities_limit)
+    measurement.count("nodes", graph.nodes_number)
+    measurement.count("edges", graph.edges_number)
+    results.append(measurement.to_dict("filter", n_sentences))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir, "graph.gexf")
+        measurement = Measurement(args.trace_memory)
+        with measurement:
+            graph.save(path)
+        measurement.count("bytes", path.stat().st_size)
+        results.append(measurement.to_dict("save", n_sentences))
+
+    return results
+
+
+def _skipped(scenario, n_sentences):
+    return {"scenario": scenario, "sentences": n_sentences, "skipped": True}
+
+
+def compare(results, baseline):
+    baseline_by_key = {
+        (result["scenario"], result["sentences"]): result
+        for result in baseline["results"]
+        if not result.get("skipped")
+    }
+    lines = [
+        "{:<12} {:>10} {:>12} {:>12} {:>8} {:>12}".format(
+            "scenario", "sentences", "wall, s", "base wall, s", "ratio", "mem ratio"
+        )
+    ]
+    for result in results:
+        key = (result["scenario"], result["sentences"])
+        if result.get("skipped") or key not in baseline_by_key:
+            continue
+        base = baseline_by_key[key]
+        mem_ratio = "-"
+        if result["peak_memory_delta"] and base["peak_memory_delta"]:
+            mem_ratio = "{:.2f}".format(
+                result["peak_memory_delta"] / base["peak_memory_delta"]
+            )
+        lines.append(
+            "{:<12} {:>10} {:>12.3f} {:>12.3f} {:>8.2f} {:>12}".format(
+                result["scenario"],
+                result["sentences"],
+                result["wall_time"],
+                base["wall_time"],
+                result["wall_time"] / base["wall_time"] if base["wall_time"] else 0,
+                mem_ratio,
+            )
+        )
+    return "\n".join(lines)
+
+
+def format_results(results):
+    lines = [
+        "{:<12} {:>10} {:>12} {:>12} {:>14}  {}".format(
+            "scenario", "sentences", "wall, s", "cpu, s", "peak mem, MB", "counts"
+        )
+    ]
+    for result in results:
+        if result.get("skipped"):
+            lines.append(
+                "{:<12} {:>10} {:>12}".format(
+                    result["scenario"], result["sentences"], "skipped"
+                )
+            )
+            continue
+        memory = result["peak_memory_delta"]
+        lines.append(
+            "{:<12} {:>10} {:>12.3f} {:>12.3f} {:>14}  {}".format(
+                result["scenario"],
+                result["sentences"],
+                result["wall_time"],
+                result["cpu_time"],
+                "-" if memory is None else "{:.1f}".format(memory / 2 ** 20),
+                ", ".join(
+                    "{}={}".format(key, value)
+                    for key, value in result["counts"].items()
+                ),
+            )
+        )
+    return "\n".join(lines)
+
+
+def _synthetic_config(args):
+    return SyntheticConfig(
+        mean_length=args.mean_length,
+        max_depth=args.max_depth,
+        coordination_rate=args.coordination_rate,
+        copula_rate=args.copula_rate,
+        vocabulary_size=args.vocabulary_size,
+        seed=args.seed,
+    )
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _meta(args):
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "networkx": nx.__version__,
+        "synthetic": _synthetic_config(args)._asdict(),
+        "oov_rate": args.oov_rate,
+        "additional_relations": args.additional_relations,
+        "entities_limit": args.entities_limit,
+        "trace_memory": args.trace_memory,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the extraction pipeline on synthetic CoNLL-U"
+    )
+    parser.add_argument(
+        "--sizes",
+        help="Corpus sizes in sentences (default: 1000 10000)",
+        nargs="+",
+        type=int,
+        default=[1000, 10000],
+    )
+    parser.add_argument("--output", help="Save results to this JSON file")
+    parser.add_argument("--baseline", help="Compare results with this JSON file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mean-length", type=int, default=14)
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--coordination-rate", type=float, default=0.15)
+    parser.add_argument("--copula-rate", type=float, default=0.1)
+    parser.add_argument("--vocabulary-size", type=int, default=5000)
+    parser.add_argument("--oov-rate", type=float, default=0.1)
+    parser.add_argument("--entities-limit", type=int, default=10000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument(
+        "--no-add",
+        help="Don't extract additional relations",
+        dest="additional_relations",
+        action="store_false",
+    )
+    parser.add_argument(
+        "--max-cluster-sentences",
+        help="Skip clustering for larger corpora (KMedoids is quadratic)",
+        type=int,
+        default=20000,
+    )
+    parser.add_argument(
+        "--max-merge-sentences",
+        help="Skip merging for larger corpora",
+        type=int,
+        default=100000,
+    )
+    parser.add_argument(
+        "--no-memory",
+        help="Don't trace memory, it slows everything down",
+        dest="trace_memory",
+        action="store_false",
+    )
+    args = parser.parse_args()
+
+    with open("stopwords.txt", mode="r", encoding="utf-8") as file:
+        stopwords = list(file.read().split())
+    if args.trace_memory:
+        tracemalloc.start()
+
+    results = []
+    for n_sentences in args.sizes:
+        size_results = run_size(n_sentences, args, stopwords)
+        print(format_results(size_results))
+        results.extend(size_results)
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as file:
+            json.dump({"meta": _meta(args), "results": results}, file, indent=4)
+    if args.baseline:
+        with open(args.baseline, mode="r", encoding="utf-8") as file:
+            print(compare(results, json.load(file)))
@@ -0,0 +1,60 @@
+"""Offline stand-ins for the models used by the extraction pipeline."""
+import zlib
+
+import numpy as np
+import ufal.udpipe
+
+# ufal.udpipe.InputFormat etc. are SWIG-magic and cannot be detected by pylint
+# pylint: disable=no-member
+
+
+class StubKeyedVectors:
+    """Deterministic replacement of gensim KeyedVectors.
+
+    The vector of a key depends only on the key and `seed`. A stable share
+    `oov_rate` of keys is reported as out of vocabulary with KeyError, as the
+    real model does.
+    """
+
+    def __init__(self, vector_size=300, oov_rate=0.1, seed=0):
+        self.vector_size = vector_size
+        self.oov_rate = oov_rate
+        self.seed = seed
+        self._cache = {}
+
+    def __contains__(self, key):
+        return self._key_hash(key) % 1000 >= self.oov_rate * 1000
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        if key not in self:
+            raise KeyError("word '{}' not in vocabulary".format(key))
+        rng = np.random.RandomState(self._key_hash(key))
+        vector = rng.standard_normal(self.vector_size).astype(np.float32)
+        self._cache[key] = vector
+        return vector
+
+    def _key_hash(self, key):
+        return zlib.crc32("{}\t{}".format(self.seed, key).encode("utf-8"))
+
+
+class ConlluReader:
+    """The part of UDPipeModel interface that doesn't need a model file."""
+
+    def read(self, text, in_format):
+        input_format = ufal.udpipe.InputFormat.newInputFormat(in_format)
+        if not input_format:
+            raise Exception("Cannot create input format '%s'" % in_format)
+        input_format.setText(text)
+        error = ufal.udpipe.ProcessingError()
+        sentences = []
+        sentence = ufal.udpipe.Sentence()
+        while input_format.nextSentence(sentence, error):
+            sentences.append(sentence)
+            sentence = ufal.udpipe.Sentence()
+        if error.occurred():
+            raise Exception(error.message)
+        return sentences
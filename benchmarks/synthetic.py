@@ -0,0 +1,226 @@
+"""Synthetic Russian-like CoNLL-U for benchmarking the extraction pipeline."""
+import random
+from itertools import accumulate
+from typing import NamedTuple
+
+# fmt: off
+SYLLABLES = [
+    "ба", "ва", "го", "да", "же", "за", "ки", "ло", "ми", "но",
+    "па", "ро", "си", "та", "ус", "фе", "хо", "це", "чи", "ша",
+    "ще", "ю", "я", "ре", "ко", "ле", "ни", "ст", "пр", "гр",
+]
+# fmt: on
+NOUN_ENDINGS = ["а", "ость", "ие", "ок", "ец", "ство"]
+NOUN_FORM_ENDINGS = ["", "а", "у", "ом", "е", "ы", "ов"]
+VERB_ENDINGS = ["ать", "ить", "еть", "овать"]
+VERB_FORM_ENDINGS = ["ает", "ил", "ила", "или", "ает", "ут"]
+ADJ_ENDINGS = ["ный", "ский", "овый", "ий"]
+ADJ_FORM_ENDINGS = ["ный", "ная", "ного", "ном", "ные"]
+PREPOSITIONS = ["в", "на", "с", "по", "для", "о", "от", "при"]
+COPULAS = ["быть"]
+COPULA_FORMS = ["был", "была", "будет", "—"]
+
+
+class SyntheticConfig(NamedTuple):
+    mean_length: int = 14  # tokens per sentence, including punctuation
+    max_depth: int = 3  # nesting depth of nmod chains
+    coordination_rate: float = 0.15
+    copula_rate: float = 0.1
+    adjective_rate: float = 0.4
+    nmod_rate: float = 0.35
+    appos_rate: float = 0.05
+    vocabulary_size: int = 5000
+    seed: int = 0
+
+
+class _Token:
+    def __init__(self, form, lemma, upostag, deprel):
+        self.form = form
+        self.lemma = lemma
+        self.upostag = upostag
+        self.deprel = deprel
+        self.left = []
+        self.right = []
+        self.id = 0
+        self.head = 0
+
+    def size(self):
+        return 1 + sum(child.size() for child in self.left + self.right)
+
+
+class _Lexicon:
+    def __init__(self, rng, size):
+        self._rng = rng
+        self.nouns = self._make_lemmas(size, NOUN_ENDINGS)
+        self.verbs = self._make_lemmas(max(size // 5, 1), VERB_ENDINGS)
+        self.adjectives = self._make_lemmas(max(size // 3, 1), ADJ_ENDINGS)
+        self.names = [
+            lemma.capitalize() for lemma in self._make_lemmas(max(size // 10, 1), [""])
+        ]
+        # Zipf-like distribution, so that frequent entities repeat across the corpus
+        self._noun_weights = list(
+            accumulate(1 / rank for rank in range(1, len(self.nouns) + 1))
+        )
+
+    def _make_lemmas(self, n, endings):
+        lemmas = set()
+        while len(lemmas) < n:
+            stem = "".join(
+                self._rng.choice(SYLLABLES) for _ in range(self._rng.randint(1, 3))
+            )
+            lemmas.add(stem + self._rng.choice(endings))
+        return sorted(lemmas)
+
+    def noun(self):
+        return self._rng.choices(self.nouns, cum_weights=self._noun_weights)[0]
+
+
+class SyntheticCorpus:
+    """Generator of CoNLL-U sentences with a russian-like dependency structure.
+
+    Sentences are built from verb clauses with subjects, objects and obliques,
+    copula clauses, nested nmod chains, coordination and appositions, i.e. the
+    constructions SentenceReltuples extracts relations from.
+    """
+
+    def __init__(self, config: SyntheticConfig = SyntheticConfig()):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._lexicon = _Lexicon(self._rng, config.vocabulary_size)
+        self._n_generated = 0
+
+    def sentences(self, n_sentences):
+        """Yield `n_sentences` CoNLL-U sentences as strings."""
+        for _ in range(n_sentences):
+            yield self._sentence_conllu()
+
+    def chunks(self, n_sentences, chunk_size=10000):
+        """Yield CoNLL-U documents of at most `chunk_size` sentences each."""
+        while n_sentences > 0:
+            size = min(chunk_size, n_sentences)
+            yield "".join(self.sentences(size))
+            n_sentences -= size
+
+    def _sentence_conllu(self):
+        self._n_generated += 1
+        root = self._clause("root")
+        target_length = max(4, int(self._rng.gauss(self.config.mean_length, 3)))
+        while root.size() < target_length - 1:
+            root.right.append(self._oblique(1))
+        root.right.append(_Token(".", ".", "PUNCT", "punct"))
+        tokens = []
+        self._linearize(root, tokens)
+        lines = [
+            "# sent_id = {}".format(self._n_generated),
+            "# text = {}".format(self._text(tokens)),
+        ]
+        for i, token in enumerate(tokens):
+            space_after = i + 1 < len(tokens) and tokens[i + 1].upostag == "PUNCT"
+            lines.append(
+                "\t".join(
+                    [
+                        str(token.id),
+                        token.form,
+                        token.lemma,
+                        token.upostag,
+                        "_",
+                        "_",
+                        str(token.head),
+                        token.deprel,
+                        "_",
+                        "SpaceAfter=No" if space_after else "_",
+                    ]
+                )
+            )
+        return "\n".join(lines) + "\n\n"
+
+    def _linearize(self, token, tokens):
+        for child in token.left:
+            self._linearize(child, tokens)
+        token.id = len(tokens) + 1
+        tokens.append(token)
+        for child in token.right:
+            self._linearize(child, tokens)
+        for child in token.left + token.right:
+            child.head = token.id
+
+    @staticmethod
+    def _text(tokens):
+        text = ""
+        for token in tokens:
+            if text and token.upostag != "PUNCT":
+                text += " "
+            text += token.form
+        return text
+
+    def _clause(self, deprel):
+        if self._rng.random() < self.config.copula_rate:
+            return self._copula_clause(deprel)
+        return self._verb_clause(deprel)
+
+    def _verb_clause(self, deprel):
+        lemma = self._rng.choice(self._lexicon.verbs)
+        verb = _Token(
+            lemma[:-3] + self._rng.choice(VERB_FORM_ENDINGS), lemma, "VERB", deprel
+        )
+        verb.left.append(self._noun_phrase("nsubj", 1))
+        verb.right.append(self._noun_phrase("obj", 1))
+        if self._rng.random() < 0.5:
+            verb.right.append(self._oblique(1))
+        if deprel == "root" and self._rng.random() < self.config.coordination_rate:
+            conj = self._verb_clause("conj")
+            conj.left = [_Token("и", "и", "CCONJ", "cc")] + conj.left[1:]
+            verb.right.append(conj)
+        return verb
+
+    def _copula_clause(self, deprel):
+        predicate = self._noun_phrase(deprel, 1)
+        predicate.left = [
+            self._noun_phrase("nsubj", 1),
+            _Token(
+                self._rng.choice(COPULA_FORMS),
+                self._rng.choice(COPULAS),
+                "AUX",
+                "cop",
+            ),
+        ] + predicate.left
+        return predicate
+
+    def _oblique(self, depth):
+        phrase = self._noun_phrase("obl", depth)
+        preposition = self._rng.choice(PREPOSITIONS)
+        phrase.left.insert(0, _Token(preposition, preposition, "ADP", "case"))
+        return phrase
+
+    def _noun_phrase(self, deprel, depth):
+        lemma = self._lexicon.noun()
+        noun = _Token(
+            lemma + self._rng.choice(NOUN_FORM_ENDINGS), lemma, "NOUN", deprel
+        )
+        if self._rng.random() < self.config.adjective_rate:
+            adj_lemma = self._rng.choice(self._lexicon.adjectives)
+            noun.left.append(
+                _Token(
+                    adj_lemma[:-2] + self._rng.choice(ADJ_FORM_ENDINGS)[-2:],
+                    adj_lemma,
+                    "ADJ",
+                    "amod",
+                )
+            )
+        if depth < self.config.max_depth and self._rng.random() < self.config.nmod_rate:
+            noun.right.append(self._noun_phrase("nmod", depth + 1))
+        if self._rng.random() < self.config.appos_rate:
+            name = self._rng.choice(self._lexicon.names)
+            noun.right.append(_Token(name, name, "PROPN", "appos"))
+        if (
+            depth < self.config.max_depth
+            and self._rng.random() < self.config.coordination_rate
+        ):
+            conj = self._noun_phrase("conj", depth + 1)
+            conj.left.insert(0, _Token("и", "и", "CCONJ", "cc"))
+            noun.right.append(conj)
+        return noun
+
+
+def generate_conllu(n_sentences, config: SyntheticConfig = SyntheticConfig()):
+    return "".join(SyntheticCorpus(config).sentences(n_sentences))
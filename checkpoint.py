@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+
+MANIFEST_FILENAME = "manifest.json"
+# bump when the pickled objects change so old checkpoints aren't loaded
+FORMAT_VERSION = 2
+
+STAGE_RELTUPLES = "reltuples"
+STAGE_CLUSTERS = "clusters"
+STAGE_GRAPH_PREMERGE = "graph_premerge"
+STAGE_GRAPH_MERGED = "graph_merged"
+
+
+def hash_inputs(*parts):
+    """Return a hex digest identifying the given strings/bytes/other values."""
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, bytes):
+            part = repr(part).encode("utf-8")
+        hasher.update(len(part).to_bytes(8, "little"))
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return a hex digest of the file contents, reading it chunk by chunk."""
+    hasher = hashlib.sha256()
+    with open(path, mode="rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class Checkpointer:
+    """Persist results of the pipeline stages to a work directory.
+
+    Checkpoints are only reused when `resume` is set and the manifest in the
+    work directory was written for the same input hash and FORMAT_VERSION.
+    """
+
+    def __init__(self, work_dir, input_hash, resume=False):
+        self.work_dir = Path(work_dir)
+        self.input_hash = input_hash
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self._manifest = self._read_manifest()
+        if not resume or self._manifest.get("input_hash") != input_hash:
+            if resume and self._manifest:
+                logging.warning(
+                    "Checkpoints in {} were made for other input, "
+                    "starting from scratch".format(self.work_dir)
+                )
+            self._reset()
+        elif self._manifest.get("format_version") != FORMAT_VERSION:
+            logging.warning(
+                "Checkpoints in {} have an old format, "
+                "starting from scratch".format(self.work_dir)
+            )
+            self._reset()
+
+    def has(self, stage):
+        return stage in self._manifest["stages"] and self._path(stage).exists()
+
+    def load(self, stage):
+        with self._path(stage).open("rb") as file:
+            obj = pickle.load(file)
+        logging.info("Loaded checkpoint of stage '{}'".format(stage))
+        return obj
+
+    def save(self, stage, obj):
+        path = self._path(stage)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("wb") as file:
+            pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        if stage not in self._manifest["stages"]:
+            self._manifest["stages"].append(stage)
+            self._write_manifest()
+        logging.info("Saved checkpoint of stage '{}'".format(stage))
+
+    def _path(self, stage):
+        return self.work_dir / "{}.pickle".format(stage)
+
+    def _reset(self):
+        for stage in self._manifest.get("stages", []):
+            try:
+                self._path(stage).unlink()
+            except FileNotFoundError:
+                continue
+        self._manifest = {
+            "input_hash": self.input_hash,
+            "format_version": FORMAT_VERSION,
+            "stages": [],
+        }
+        self._write_manifest()
+
+    def _read_manifest(self):
+        try:
+            with (self.work_dir / MANIFEST_FILENAME).open(
+                "r", encoding="utf-8"
+            ) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_manifest(self):
+        path = self.work_dir / MANIFEST_FILENAME
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as file:
+            json.dump(self._manifest, file)
+        os.replace(tmp_path, path)
+
+
+class NullCheckpointer:
+    """Checkpointer that keeps nothing, used when checkpointing is off."""
+
+    def has(self, stage):
+        return False
+
+    def load(self, stage):
+        raise KeyError(stage)
+
+    def save(self, stage, obj):
+        pass
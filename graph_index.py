@@ -0,0 +1,417 @@
+"""Search of the entities of a relation graph by their words.
+
+Entities are numbered by descending weight and every word of their lemmas
+and labels points to the sorted numbers of the entities having it, so the
+heaviest matches of a query are the first numbers of the merged lists and
+are found without looking at the rest. Relations of every entity are sorted
+by weight in advance too.
+"""
+import argparse
+import bisect
+import heapq
+import json
+import re
+import xml.etree.ElementTree as ET
+from itertools import islice, takewhile
+from xml.sax.saxutils import quoteattr
+
+GEXF_NAMESPACE = "{http://www.gexf.net/1.1draft}"
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokens(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+class EntityIndex:
+    """Index of the entities and their relations.
+
+    `entities` are dicts with "id", "label", "lemmas" and "weight" and
+    `relations` are (source id, label, target id, weight) tuples.
+    """
+
+    def __init__(self, entities, relations):
+        self._entities = sorted(
+            entities, key=lambda entity: (-entity["weight"], entity["id"])
+        )
+        numbers = {entity["id"]: i for i, entity in enumerate(self._entities)}
+        self._numbers = numbers
+        self._relations = []
+        self._incident = [[] for _ in self._entities]
+        for source, label, target, weight in sorted(
+            relations, key=lambda relation: -relation[3]
+        ):
+            if source not in numbers or target not in numbers:
+                continue
+            self._incident[numbers[source]].append(len(self._relations))
+            if target != source:
+                self._incident[numbers[target]].append(len(self._relations))
+            self._relations.append((numbers[source], label, numbers[target], weight))
+
+        self._entity_tokens = []
+        postings = {}
+        for i, entity in enumerate(self._entities):
+            entity_tokens = frozenset(
+                tokens(entity["lemmas"]) + tokens(entity["label"])
+            )
+            self._entity_tokens.append(entity_tokens)
+            for token in entity_tokens:
+                postings.setdefault(token, []).append(i)
+        self._tokens = sorted(postings)
+        self._postings = [postings[token] for token in self._tokens]
+
+    @classmethod
+    def from_graph(cls, graph):
+        """Index of the nodes and edges of a RelGraph's networkx graph."""
+        return cls(
+            (
+                {
+                    "id": node,
+                    "label": attr["label"],
+                    "lemmas": attr["lemmas"],
+                    "weight": attr["weight"],
+                }
+                for node, attr in graph.nodes(data=True)
+            ),
+            (
+                (source, attr["label"], target, attr["weight"])
+                for source, target, attr in graph.edges(data=True)
+            ),
+        )
+
+    @classmethod
+    def from_gexf(cls, file):
+        """Index of a graph RelGraph.save wrote.
+
+        Relations are nodes there. Their weights are read from the
+        relation_weight attribute, graphs written before it was added have
+        only the smaller weights of the arguments of the relations there.
+        """
+        nodes = {}
+        edges = []
+        for _, element in ET.iterparse(file):
+            if element.tag == GEXF_NAMESPACE + "node":
+                attr = {
+                    attvalue.get("for"): attvalue.get("value")
+                    for attvalue in element.iter(GEXF_NAMESPACE + "attvalue")
+                }
+                nodes[element.get("id")] = {
+                    "id": element.get("id"),
+                    "label": element.get("label", ""),
+                    "lemmas": attr.get("lemmas", ""),
+                    "weight": float(
+                        attr.get("relation_weight", attr.get("weight", 0))
+                    ),
+                    "node_type": attr.get("node_type"),
+                }
+                element.clear()
+            elif element.tag == GEXF_NAMESPACE + "edge":
+                edges.append((element.get("source"), element.get("target")))
+                element.clear()
+
+        ends = {}
+        for source, target in edges:
+            if nodes.get(target, {}).get("node_type") == "relation":
+                ends.setdefault(target, [None, None])[0] = source
+            elif nodes.get(source, {}).get("node_type") == "relation":
+                ends.setdefault(source, [None, None])[1] = target
+        relations = [
+            (source, nodes[relation]["label"], target, nodes[relation]["weight"])
+            for relation, (source, target) in ends.items()
+            if source is not None and target is not None
+        ]
+        return cls(
+            (node for node in nodes.values() if node["node_type"] != "relation"),
+            relations,
+        )
+
+    @property
+    def entities_number(self):
+        return len(self._entities)
+
+    @property
+    def relations_number(self):
+        return len(self._relations)
+
+    def search(self, query, prefix=False, limit=10, relations_limit=10):
+        """Heaviest entities having all the words of the query.
+
+        With `prefix` the last word of the query matches the words starting
+        with it. Every entity comes with its heaviest relations.
+        """
+        words = tokens(query)
+        if not words:
+            return []
+        exact = words[:-1] if prefix else words
+        if exact:
+            # the rarest word gives the candidates, the rest are checked
+            matches = (
+                i
+                for i in min((self._exact(word) for word in exact), key=len)
+                if self._matches(i, exact, words[-1] if prefix else None)
+            )
+        else:
+            matches = self._prefixed(words[-1])
+        return [self._entity(i, relations_limit) for i in islice(matches, limit)]
+
+    def __contains__(self, entity_id):
+        return entity_id in self._numbers
+
+    def ego(self, entity_ids, radius=1, min_weight=0, max_nodes=None):
+        """Entities at most `radius` relations away from the given ones and
+        the relations between them, see `ego_nodes`.
+
+        Return the lists of entity dicts and of relation dicts with the ids
+        of their arguments.
+        """
+
+        def neighbours(i):
+            for j in takewhile(
+                lambda j: self._relations[j][3] >= min_weight, self._incident[i]
+            ):
+                source, _, target, weight = self._relations[j]
+                yield weight, target if source == i else source
+
+        kept = ego_nodes(
+            [self._numbers[entity_id] for entity_id in entity_ids],
+            radius,
+            neighbours,
+            max_nodes=max_nodes,
+        )
+        kept_set = set(kept)
+        relations = sorted(
+            {
+                j
+                for i in kept
+                for j in takewhile(
+                    lambda j: self._relations[j][3] >= min_weight, self._incident[i]
+                )
+                if self._relations[j][0] in kept_set
+                and self._relations[j][2] in kept_set
+            }
+        )
+        return (
+            [
+                {
+                    key: self._entities[i][key]
+                    for key in ("id", "label", "lemmas", "weight")
+                }
+                for i in kept
+            ],
+            [
+                {
+                    "source": self._entities[self._relations[j][0]]["id"],
+                    "relation": self._relations[j][1],
+                    "target": self._entities[self._relations[j][2]]["id"],
+                    "weight": self._relations[j][3],
+                }
+                for j in relations
+            ],
+        )
+
+    def _exact(self, word):
+        i = bisect.bisect_left(self._tokens, word)
+        if i < len(self._tokens) and self._tokens[i] == word:
+            return self._postings[i]
+        return []
+
+    def _prefixed(self, word):
+        """Lazily merged numbers of the entities having words with the prefix."""
+        start = bisect.bisect_left(self._tokens, word)
+        end = bisect.bisect_left(self._tokens, word + "\U0010ffff", lo=start)
+        return _unique(heapq.merge(*self._postings[start:end]))
+
+    def _matches(self, i, words, prefix):
+        entity_tokens = self._entity_tokens[i]
+        return all(word in entity_tokens for word in words) and (
+            prefix is None or any(token.startswith(prefix) for token in entity_tokens)
+        )
+
+    def _entity(self, i, relations_limit):
+        entity = self._entities[i]
+        relations = []
+        for j in self._incident[i][:relations_limit]:
+            source, label, target, weight = self._relations[j]
+            relations.append(
+                {
+                    "source": self._entities[source]["label"],
+                    "relation": label,
+                    "target": self._entities[target]["label"],
+                    "weight": weight,
+                    "direction": "out" if source == i else "in",
+                }
+            )
+        return {
+            "id": entity["id"],
+            "label": entity["label"],
+            "lemmas": entity["lemmas"],
+            "weight": entity["weight"],
+            "relations_number": len(self._incident[i]),
+            "relations": relations,
+        }
+
+
+def ego_nodes(seeds, radius, neighbours, max_nodes=None, key=None):
+    """Nodes at most `radius` hops away from the seeds.
+
+    `neighbours(node)` gives the (weight, neighbour) pairs of the relations of
+    the node to follow. Every hop adds the neighbours with the heaviest
+    relations first, until there are `max_nodes` nodes. Neighbours with
+    relations of the same weight are ordered by `key(node)`, by the nodes
+    themselves by default. The seeds come first, then the nodes of every next
+    hop.
+    """
+    kept = dict.fromkeys(seeds)
+    frontier = list(kept)
+    for _ in range(radius):
+        if max_nodes is not None and len(kept) >= max_nodes:
+            break
+        candidates = {}
+        for node in frontier:
+            for weight, neighbour in neighbours(node):
+                if neighbour not in kept and weight > candidates.get(
+                    neighbour, float("-inf")
+                ):
+                    candidates[neighbour] = weight
+        frontier = sorted(
+            candidates,
+            key=lambda node: (-candidates[node], node if key is None else key(node)),
+        )
+        if max_nodes is not None:
+            frontier = frontier[: max_nodes - len(kept)]
+        if not frontier:
+            break
+        kept.update(dict.fromkeys(frontier))
+    return list(kept)
+
+
+def iter_json(entities, relations):
+    """Yield the JSON of the entities and relations `EntityIndex.ego` gives
+    in chunks."""
+    yield '{"entities": ['
+    for i, entity in enumerate(entities):
+        yield ("," if i else "") + json.dumps(entity, ensure_ascii=False)
+    yield '], "relations": ['
+    for i, relation in enumerate(relations):
+        yield ("," if i else "") + json.dumps(relation, ensure_ascii=False)
+    yield "]}\n"
+
+
+def iter_gexf(entities, relations):
+    """Yield the GEXF of the entities and relations `EntityIndex.ego` gives
+    in chunks.
+
+    Relations are nodes there like in the graphs RelGraph.save writes, so the
+    result can be indexed again.
+    """
+    yield (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<gexf xmlns="http://www.gexf.net/1.1draft" version="1.1">\n'
+        '<graph defaultedgetype="directed" mode="static">\n'
+        '<attributes class="node" mode="static">\n'
+        '<attribute id="lemmas" title="lemmas" type="string" />\n'
+        '<attribute id="weight" title="weight" type="double" />\n'
+        '<attribute id="node_type" title="node_type" type="string" />\n'
+        '<attribute id="relation_weight" title="relation_weight" type="double" />\n'
+        "</attributes>\n<nodes>\n"
+    )
+    for entity in entities:
+        yield _gexf_node(
+            entity["id"],
+            entity["label"],
+            entity["lemmas"],
+            entity["weight"],
+            "argument",
+        )
+    for relation in relations:
+        yield _gexf_node(
+            _relation_node(relation),
+            relation["relation"],
+            "",
+            relation["weight"],
+            "relation",
+            relation_weight=relation["weight"],
+        )
+    yield "</nodes>\n<edges>\n"
+    for i, relation in enumerate(relations):
+        node = _relation_node(relation)
+        yield '<edge id="{}" source={} target={} />\n'.format(
+            2 * i, quoteattr(relation["source"]), quoteattr(node)
+        )
+        yield '<edge id="{}" source={} target={} />\n'.format(
+            2 * i + 1, quoteattr(node), quoteattr(relation["target"])
+        )
+    yield "</edges>\n</graph>\n</gexf>\n"
+
+
+def _relation_node(relation):
+    return "{}({}; {})".format(
+        relation["relation"], relation["source"], relation["target"]
+    )
+
+
+def _gexf_node(node_id, label, lemmas, weight, node_type, relation_weight=None):
+    relation_attvalue = ""
+    if relation_weight is not None:
+        relation_attvalue = '<attvalue for="relation_weight" value="{}" />'.format(
+            relation_weight
+        )
+    return (
+        "<node id={} label={}><attvalues>"
+        '<attvalue for="lemmas" value={} />'
+        '<attvalue for="weight" value="{}" />'
+        '<attvalue for="node_type" value="{}" />'
+        "{}</attvalues></node>\n"
+    ).format(
+        quoteattr(node_id),
+        quoteattr(label),
+        quoteattr(lemmas),
+        weight,
+        node_type,
+        relation_attvalue,
+    )
+
+
+def _unique(sorted_numbers):
+    previous = None
+    for number in sorted_numbers:
+        if number != previous:
+            yield number
+            previous = number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find the entities of a saved graph and their relations"
+    )
+    parser.add_argument("graph_path", help="Path to the GEXF graph")
+    parser.add_argument("query", help="Words the entities should have")
+    parser.add_argument(
+        "--prefix",
+        help="Match the words starting with the last word of the query",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--limit", help="Number of entities (default: 10)", type=int, default=10
+    )
+    parser.add_argument(
+        "--relations-limit",
+        help="Number of relations of every entity (default: 10)",
+        type=int,
+        default=10,
+    )
+    args = parser.parse_args()
+    with open(args.graph_path, mode="rb") as graph_file:
+        index = EntityIndex.from_gexf(graph_file)
+    print(
+        json.dumps(
+            index.search(
+                args.query,
+                prefix=args.prefix,
+                limit=args.limit,
+                relations_limit=args.relations_limit,
+            ),
+            ensure_ascii=False,
+            indent=4,
+        )
+    )
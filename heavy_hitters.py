@@ -0,0 +1,88 @@
+"""Streaming estimation of the most frequent entities in bounded memory.
+
+The Space-Saving sketch monitors at most `capacity` items. An item that isn't
+monitored replaces the one with the smallest count and inherits that count as
+its possible overestimation, so every count is at most `error_bound` above
+the true one, and `error_bound` never exceeds total / capacity.
+"""
+import heapq
+
+# the sketch monitors this many times more items than there are candidates
+CAPACITY_FACTOR = 2
+
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Capacity must be positive, got {}".format(capacity))
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        # (count, item) pairs, the ones with outdated counts are skipped
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, item):
+        return item in self._counts
+
+    def add(self, item, weight=1):
+        self.total += weight
+        if item in self._counts:
+            self._counts[item] += weight
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = weight
+            self._errors[item] = 0
+        else:
+            min_count, min_item = self._pop_min()
+            del self._counts[min_item]
+            del self._errors[min_item]
+            self._counts[item] = min_count + weight
+            self._errors[item] = min_count
+        heapq.heappush(self._heap, (self._counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    @property
+    def error_bound(self):
+        """The most any count can exceed the true one by."""
+        if len(self._counts) < self.capacity:
+            return 0
+        return self._min()[0]
+
+    def estimate(self, item):
+        """Upper and lower bounds of the count of the item."""
+        if item not in self._counts:
+            return self.error_bound, 0
+        count = self._counts[item]
+        return count, count - self._errors[item]
+
+    def threshold(self, n):
+        """The `n`-th largest count the monitored items are guaranteed to have."""
+        if n >= len(self._counts):
+            return 0
+        return heapq.nlargest(
+            n, (count - self._errors[item] for item, count in self._counts.items())
+        )[-1]
+
+    def candidates(self, n):
+        """Monitored items that can still be among the `n` most frequent ones.
+
+        Items that aren't monitored can be among them too only if
+        `error_bound` is not below `threshold(n)`.
+        """
+        threshold = self.threshold(n)
+        return {item for item, count in self._counts.items() if count >= threshold}
+
+    def _min(self):
+        while self._heap[0][0] != self._counts.get(self._heap[0][1]):
+            heapq.heappop(self._heap)
+        return self._heap[0]
+
+    def _pop_min(self):
+        min_count, min_item = self._min()
+        heapq.heappop(self._heap)
+        return min_count, min_item
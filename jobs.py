@@ -0,0 +1,309 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+PENDING = "pending"
+
+STATE_SAVE_INTERVAL = 1.0
+STOPPED_ERROR = "The server stopped before the job finished"
+
+
+class Job:
+    def __init__(self, payload, stages, priority=0, state_dir=None):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.priority = priority
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.stages = OrderedDict(
+            (stage, {"status": PENDING, "done": 0, "total": None}) for stage in stages
+        )
+        self._lock = threading.Lock()
+        self._state_path = None
+        if state_dir is not None:
+            self._state_path = Path(state_dir, "{}.json".format(self.id))
+        self._state_saved = 0.0
+
+    @classmethod
+    def from_state(cls, path):
+        """Load a read-only snapshot of the job saved by another process."""
+        with open(path, mode="r", encoding="utf-8") as file:
+            state = json.load(file)
+        job = cls.__new__(cls)
+        job.id = state["id"]
+        job.payload = None
+        job.priority = state["priority"]
+        job.status = state["status"]
+        job.created = state["created"]
+        job.started = state["started"]
+        job.finished = state["finished"]
+        job.result = state["result"]
+        job.error = state["error"]
+        job.stages = OrderedDict(
+            (
+                info["stage"],
+                {key: value for key, value in info.items() if key != "stage"},
+            )
+            for info in state["stages"]
+        )
+        job._lock = threading.Lock()
+        job._state_path = None
+        job._state_saved = 0.0
+        return job
+
+    def set_progress(self, stage, done=None, total=None):
+        """Mark `stage` as running with `done` of `total` items processed.
+
+        All the previous stages are marked as done.
+        """
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = {"status": PENDING, "done": 0, "total": None}
+            for name, info in self.stages.items():
+                if name == stage:
+                    break
+                if info["status"] != DONE:
+                    info["status"] = DONE
+                    if info["total"] is not None:
+                        info["done"] = info["total"]
+            info = self.stages[stage]
+            info["status"] = RUNNING
+            if done is not None:
+                info["done"] = done
+            if total is not None:
+                info["total"] = total
+            self._save_state()
+
+    def to_dict(self):
+        with self._lock:
+            return self._as_dict()
+
+    def _as_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "stages": [dict(info, stage=name) for name, info in self.stages.items()],
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def _save_state(self, force=False):
+        if self._state_path is None:
+            return
+        now = time.time()
+        if not force and now - self._state_saved < STATE_SAVE_INTERVAL:
+            return
+        self._state_saved = now
+        tmp_path = self._state_path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as file:
+            json.dump(self._as_dict(), file, ensure_ascii=False)
+        os.replace(tmp_path, self._state_path)
+
+    def _remove_state(self):
+        if self._state_path is not None:
+            try:
+                self._state_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _start(self):
+        with self._lock:
+            self.status = RUNNING
+            self.started = time.time()
+            self._save_state(force=True)
+
+    def _finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+            if status == DONE:
+                for info in self.stages.values():
+                    info["status"] = DONE
+                    if info["total"] is not None:
+                        info["done"] = info["total"]
+            self._save_state(force=True)
+
+
+class JobQueue:
+    """In-process queue of jobs processed by a pool of worker threads.
+
+    With `order="priority"` jobs are taken by priority (lower value first) and
+    in submission order among jobs of the same priority, with `order="fifo"`
+    priorities are ignored. `handler(job)` does the work, reports progress with
+    `job.set_progress` and returns the job result. Workers are started on the
+    first submit.
+
+    If `state_dir` is given, jobs' status is saved there too, so that the jobs
+    can be looked up from other processes sharing the directory, e.g. other
+    workers of a pre-fork server. A process stopping should `stop` its queue,
+    and the jobs of the ones that were killed are failed by `fail_abandoned`.
+    """
+
+    def __init__(
+        self,
+        handler,
+        stages,
+        n_workers=1,
+        order="fifo",
+        history_limit=1000,
+        state_dir=None,
+    ):
+        if order not in ("fifo", "priority"):
+            raise ValueError("Unknown job order: {}".format(order))
+        self._order = order
+        self._state_dir = state_dir
+        if state_dir is not None:
+            Path(state_dir).mkdir(parents=True, exist_ok=True)
+        self._handler = handler
+        self._stages = stages
+        self._n_workers = n_workers
+        self._history_limit = history_limit
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._stopped = False
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, payload, priority=0):
+        job = Job(payload, self._stages, priority=priority, state_dir=self._state_dir)
+        job._save_state(force=True)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+            self._start_workers()
+        queue_priority = priority if self._order == "priority" else 0
+        self._queue.put((queue_priority, next(self._counter), job))
+        return job
+
+    def add_done(self, result):
+        """Register a job whose result is already known without running it."""
+        job = Job(None, self._stages, state_dir=self._state_dir)
+        job._start()
+        job._finish(DONE, result=result)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self._state_dir is None:
+            return job
+        state_path = Path(self._state_dir, "{}.json".format(job_id))
+        if state_path.parent != Path(self._state_dir) or not state_path.exists():
+            return None
+        return Job.from_state(state_path)
+
+    def stop(self, timeout=None):
+        """Let the workers finish the submitted jobs for up to `timeout` seconds.
+
+        The jobs that aren't finished by then are marked failed and returned,
+        e.g. to clean up after them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            workers = list(self._workers)
+        for _ in workers:
+            # after all the jobs, whatever their priority
+            self._queue.put((float("inf"), next(self._counter), None))
+        for worker in workers:
+            worker.join(
+                None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+        with self._lock:
+            self._stopped = True
+            unfinished = [
+                job for job in self._jobs.values() if job.status in (QUEUED, RUNNING)
+            ]
+        for job in unfinished:
+            job._finish(FAILED, error=STOPPED_ERROR)
+        return unfinished
+
+    def fail_abandoned(self):
+        """Mark failed the unfinished jobs in `state_dir` this queue doesn't have.
+
+        Call it before starting the processes sharing the directory, the jobs
+        of the processes killed before they stopped their queues stay queued
+        or running there otherwise.
+        """
+        if self._state_dir is None:
+            return
+        for state_path in Path(self._state_dir).glob("*.json"):
+            try:
+                job = Job.from_state(state_path)
+            except (OSError, ValueError, KeyError):
+                continue
+            if job.status not in (QUEUED, RUNNING) or job.id in self._jobs:
+                continue
+            logging.warning("Job {} was abandoned, marking it failed".format(job.id))
+            job._state_path = state_path
+            job._finish(FAILED, error=STOPPED_ERROR)
+
+    def _start_workers(self):
+        while len(self._workers) < self._n_workers:
+            worker = threading.Thread(
+                target=self._work,
+                name="job-worker-{}".format(len(self._workers)),
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _forget_old_jobs(self):
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in (DONE, FAILED)
+        ]
+        for job_id in finished[: max(0, len(self._jobs) - self._history_limit)]:
+            self._jobs.pop(job_id)._remove_state()
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            if self._stopped:
+                # failed by stop
+                self._queue.task_done()
+                continue
+            job._start()
+            try:
+                result = self._handler(job)
+            except Exception as e:  # pylint: disable=broad-except
+                logging.exception("Job {} failed".format(job.id))
+                job._finish(FAILED, error=str(e))
+            else:
+                job._finish(DONE, result=result)
+            finally:
+                job.payload = None
+                self._queue.task_done()
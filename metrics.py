@@ -0,0 +1,350 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Metrics are plain counters guarded by a lock, so updating them costs about as
+much as a dict lookup. Each process keeps its own metrics. With several server
+workers the registry is given a directory shared by them: every worker writes
+its metrics there every `flush_interval` seconds and a scrape answered by any
+worker adds up the counters and histograms of all of them, including the ones
+that have exited, so the totals never go back. Gauges of the running workers
+are shown with their "worker" label.
+"""
+import copy
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+)
+SIZE_BUCKETS = tuple(10 ** power for power in range(1, 10))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric:
+    type_ = None
+
+    def __init__(self, name, help_, labelnames=()):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "Metric {} has labels {}, got {}".format(
+                    self.name, self.labelnames, sorted(labels)
+                )
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._values)
+
+    def with_values(self, values, labelnames=None):
+        """Copy of the metric having the values, to render merged ones."""
+        metric = copy.copy(self)
+        metric._values = values
+        metric._lock = threading.Lock()
+        if labelnames is not None:
+            metric.labelnames = tuple(labelnames)
+        return metric
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, _escape(self.help, quotes=False)),
+            "# TYPE {} {}".format(self.name, self.type_),
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return ["{}{} {}".format(self.name, self._labels(key), _number(value))]
+
+    def _labels(self, key, **extra):
+        pairs = list(zip(self.labelnames, key)) + list(extra.items())
+        if not pairs:
+            return ""
+        return "{{{}}}".format(
+            ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs)
+        )
+
+
+class Counter(_Metric):
+    type_ = "counter"
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    """Gauge set explicitly or computed by `function` on every scrape."""
+
+    type_ = "gauge"
+
+    def __init__(self, name, help_, labelnames=(), function=None):
+        super().__init__(name, help_, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def snapshot(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().snapshot()
+
+    def with_values(self, values, labelnames=None):
+        metric = super().with_values(values, labelnames)
+        metric.function = None
+        return metric
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    type_ = "histogram"
+
+    def __init__(self, name, help_, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _render_value(self, key, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value):
+            cumulative += count
+            lines.append(
+                "{}_bucket{} {}".format(
+                    self.name,
+                    self._labels(key, le="+Inf" if bound == math.inf else bound),
+                    cumulative,
+                )
+            )
+        lines.append("{}_sum{} {}".format(self.name, self._labels(key), value[-1]))
+        lines.append("{}_count{} {}".format(self.name, self._labels(key), cumulative))
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+
+
+class StageTimer:
+    """Observe how long every stage of a pipeline reporting its progress took.
+
+    Call it with the stage name (and anything else the progress callback
+    gets) whenever there is progress. A stage is over when the next one
+    starts or `finish` is called.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._stage = None
+        self._start = None
+
+    def __call__(self, stage, *args, **kwargs):
+        if stage == self._stage:
+            return
+        self.finish()
+        self._stage = stage
+        self._start = time.perf_counter()
+
+    def finish(self):
+        if self._stage is not None:
+            elapsed = time.perf_counter() - self._start
+            self.histogram.observe(elapsed, stage=self._stage)
+            self._stage = None
+
+
+class Registry:
+    """Metrics of the app, of all its workers if `multiprocess_dir` is set."""
+
+    def __init__(self, multiprocess_dir=None, flush_interval=5):
+        self._metrics = []
+        self.multiprocess_dir = (
+            Path(multiprocess_dir) if multiprocess_dir is not None else None
+        )
+        self.flush_interval = flush_interval
+        self._flushing_pid = None
+        self._flushing_lock = threading.Lock()
+        # scrapes flush too, the snapshot written last has to be the newest
+        self._flush_lock = threading.Lock()
+
+    def counter(self, name, help_, labelnames=()):
+        return self._register(Counter(name, help_, labelnames))
+
+    def gauge(self, name, help_, labelnames=(), function=None):
+        return self._register(Gauge(name, help_, labelnames, function=function))
+
+    def histogram(self, name, help_, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, help_, labelnames, buckets=buckets))
+
+    def render(self):
+        if self.multiprocess_dir is None:
+            metrics = self._metrics
+        else:
+            self.flush()
+            metrics = self._merged_metrics()
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear_multiprocess_dir(self):
+        """Remove the metrics of the previous run, call it before forking."""
+        if self.multiprocess_dir is None:
+            return
+        self.multiprocess_dir.mkdir(parents=True, exist_ok=True)
+        for path in self.multiprocess_dir.glob("*.json"):
+            path.unlink()
+
+    def start_flushing(self):
+        """Start writing the metrics of this process to the shared directory.
+
+        Call it in every worker, calls after the first one do nothing.
+        """
+        if self.multiprocess_dir is None:
+            return
+        with self._flushing_lock:
+            if self._flushing_pid == os.getpid():
+                return
+            self._flushing_pid = os.getpid()
+
+        def flush_periodically():
+            while True:
+                self.flush()
+                time.sleep(self.flush_interval)
+
+        threading.Thread(
+            target=flush_periodically, name="metrics-flush", daemon=True
+        ).start()
+
+    def flush(self):
+        """Write the metrics of this process to the shared directory."""
+        self.multiprocess_dir.mkdir(parents=True, exist_ok=True)
+        path = self.multiprocess_dir / "{}.json".format(os.getpid())
+        tmp_path = path.with_suffix(".tmp")
+        with self._flush_lock:
+            snapshot = {
+                metric.name: [
+                    [list(key), value] for key, value in metric.snapshot().items()
+                ]
+                for metric in self._metrics
+            }
+            with tmp_path.open("w", encoding="utf-8") as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, path)
+
+    def _merged_metrics(self):
+        snapshots = {}
+        for path in self.multiprocess_dir.glob("*.json"):
+            try:
+                with path.open(encoding="utf-8") as file:
+                    snapshots[int(path.stem)] = json.load(file)
+            except (OSError, ValueError):
+                continue
+        merged = []
+        for metric in self._metrics:
+            values = {}
+            for pid, snapshot in sorted(snapshots.items()):
+                for key, value in snapshot.get(metric.name, []):
+                    key = tuple(key)
+                    if isinstance(metric, Gauge):
+                        if _is_running(pid):
+                            values[key + (str(pid),)] = value
+                    elif key not in values:
+                        values[key] = value
+                    elif isinstance(metric, Histogram):
+                        values[key] = [a + b for a, b in zip(values[key], value)]
+                    else:
+                        values[key] += value
+            if isinstance(metric, Gauge):
+                merged.append(
+                    metric.with_values(values, metric.labelnames + ("worker",))
+                )
+            else:
+                merged.append(metric.with_values(values))
+        return merged
+
+    def _register(self, metric):
+        if any(registered.name == metric.name for registered in self._metrics):
+            raise ValueError("Metric {} is already registered".format(metric.name))
+        self._metrics.append(metric)
+        return metric
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value, quotes=True):
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    if quotes:
+        value = value.replace('"', '\\"')
+    return value
+
+
+def _number(value):
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(value)
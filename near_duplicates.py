@@ -0,0 +1,147 @@
+"""Detection of near-duplicate documents with MinHash and LSH.
+
+Every document is represented by the MinHash signature of its word shingles.
+Signatures are split into bands and documents sharing a band are candidates
+to be duplicates, so a document is only compared with a few others. The
+candidates are confirmed when their signatures estimate the Jaccard
+similarity of the shingles to be at least `threshold`.
+"""
+import re
+import zlib
+
+import numpy as np
+
+DROP = "drop"
+WEIGHT = "weight"
+POLICIES = (DROP, WEIGHT)
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text, size):
+    """Set of hashes of the `size` words long shingles of the text."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {
+        zlib.crc32(" ".join(words[i : i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    }
+
+
+def optimal_bands(num_perm, threshold):
+    """Number of bands and rows per band to split signatures into.
+
+    With b bands of r rows documents become candidates with probability
+    1 - (1 - s^r)^b, which changes sharply around s = (1 / b)^(1 / r), so the
+    split with this value closest to the threshold is taken.
+    """
+    splits = [
+        (num_perm // rows, rows)
+        for rows in range(1, num_perm + 1)
+        if num_perm % rows == 0
+    ]
+    return min(
+        splits, key=lambda split: abs((1 / split[0]) ** (1 / split[1]) - threshold)
+    )
+
+
+class MinHasher:
+    def __init__(self, num_perm=128, shingle_size=5, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        random_state = np.random.RandomState(seed)
+        self._a = random_state.randint(
+            1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64
+        )
+        self._b = random_state.randint(
+            0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64
+        )
+
+    def signature(self, text):
+        hashes = np.fromiter(
+            shingles(text, self.shingle_size), dtype=np.uint64
+        ).reshape(-1, 1)
+        # overflows of the products are fine, they are just other hashes
+        with np.errstate(over="ignore"):
+            permuted = ((self._a * hashes + self._b) % MERSENNE_PRIME) & MAX_HASH
+        return permuted.min(axis=0)
+
+
+class NearDuplicateFilter:
+    """Find the documents that are near-duplicates of the ones added before.
+
+    `add` returns the id of the first added document the new one duplicates
+    or None if it's original. The number of documents every original one
+    stands for is kept in `multiplicity`.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self._hasher = MinHasher(
+            num_perm=num_perm, shingle_size=shingle_size, seed=seed
+        )
+        self._n_bands, self._rows = optimal_bands(num_perm, threshold)
+        self._bands = [{} for _ in range(self._n_bands)]
+        self._signatures = {}
+        self.multiplicity = {}
+
+    def add(self, doc_id, text):
+        signature = self._hasher.signature(text)
+        band_keys = [
+            signature[i * self._rows : (i + 1) * self._rows].tobytes()
+            for i in range(self._n_bands)
+        ]
+        original_id = self._find_original(signature, band_keys)
+        if original_id is not None:
+            self.multiplicity[original_id] += 1
+            return original_id
+        self._signatures[doc_id] = signature
+        self.multiplicity[doc_id] = 1
+        for band, band_key in zip(self._bands, band_keys):
+            band.setdefault(band_key, []).append(doc_id)
+        return None
+
+    def _find_original(self, signature, band_keys):
+        checked = set()
+        for band, band_key in zip(self._bands, band_keys):
+            for candidate_id in band.get(band_key, ()):
+                if candidate_id in checked:
+                    continue
+                checked.add(candidate_id)
+                similarity = np.mean(self._signatures[candidate_id] == signature)
+                if similarity >= self.threshold:
+                    return candidate_id
+        return None
+
+
+def conllu_text(conllu):
+    """Text of the CoNLL-U sentences from "# text" comments or word forms."""
+    texts = []
+    forms = []
+    for line in conllu.splitlines():
+        if line.startswith("# text = "):
+            texts.append(line[len("# text = ") :])
+        elif line and not line.startswith("#"):
+            columns = line.split("\t")
+            if len(columns) > 1 and columns[0].isdigit():
+                forms.append(columns[1])
+    return "\n".join(texts) if texts else " ".join(forms)
+
+
+def conllu_sentences_number(conllu):
+    return sum(1 for line in conllu.splitlines() if line.startswith("1\t"))
+
+
+def sentence_weights(documents, multiplicity):
+    """Weight of every sentence of the (id, CoNLL-U) original documents.
+
+    It's the number of documents the original one stands for.
+    """
+    return [
+        multiplicity[doc_id]
+        for doc_id, conllu in documents
+        for _ in range(conllu_sentences_number(conllu))
+    ]
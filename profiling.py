@@ -0,0 +1,186 @@
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+_local = threading.local()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory_delta = 0
+        self.counts = {}
+
+    def to_dict(self):
+        return {
+            "stage": self.name,
+            "calls": self.calls,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_memory_delta": self.peak_memory_delta,
+            "counts": dict(self.counts),
+        }
+
+
+class _Frame:
+    def __init__(self, stats, memory_start):
+        self.stats = stats
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.memory_start = memory_start
+        self.memory_peak = memory_start
+
+
+class Profiler:
+    """Collect wall time, CPU time, peak memory delta and item counts per stage.
+
+    Peak memory is only measured when `trace_memory` is set, because tracemalloc
+    slows the pipeline down considerably.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self._stats = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """Make this profiler collect the stages run by the current thread."""
+        started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        stack = _profilers_stack()
+        stack.append(self)
+        try:
+            yield self
+        finally:
+            stack.pop()
+            if started_tracing:
+                tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            if name not in self._stats:
+                self._stats[name] = StageStats(name)
+            stats = self._stats[name]
+        memory_start = 0
+        if self.trace_memory and tracemalloc.is_tracing():
+            memory_start, memory_peak = tracemalloc.get_traced_memory()
+            self._update_memory_peaks(memory_peak)
+            if hasattr(tracemalloc, "reset_peak"):  # python 3.9+
+                tracemalloc.reset_peak()
+        frame = _Frame(stats, memory_start)
+        self._frames.append(frame)
+        try:
+            yield stats
+        finally:
+            self._frames.pop()
+            wall_time = time.perf_counter() - frame.wall_start
+            cpu_time = time.process_time() - frame.cpu_start
+            memory_delta = 0
+            if self.trace_memory and tracemalloc.is_tracing():
+                _, memory_peak = tracemalloc.get_traced_memory()
+                self._update_memory_peaks(memory_peak)
+                frame.memory_peak = max(frame.memory_peak, memory_peak)
+                memory_delta = frame.memory_peak - frame.memory_start
+            with self._lock:
+                stats.calls += 1
+                stats.wall_time += wall_time
+                stats.cpu_time += cpu_time
+                stats.peak_memory_delta = max(stats.peak_memory_delta, memory_delta)
+
+    def count(self, name, value=1):
+        """Add `value` to the `name` counter of the innermost running stage."""
+        if not self._frames:
+            return
+        counts = self._frames[-1].stats.counts
+        with self._lock:
+            counts[name] = counts.get(name, 0) + value
+
+    def report(self):
+        with self._lock:
+            return [stats.to_dict() for stats in self._stats.values()]
+
+    def format_report(self):
+        lines = [
+            "{:<24} {:>8} {:>12} {:>12} {:>14}  {}".format(
+                "stage", "calls", "wall, s", "cpu, s", "peak mem, MB", "counts"
+            )
+        ]
+        for stats in self.report():
+            lines.append(
+                "{:<24} {:>8} {:>12.3f} {:>12.3f} {:>14.1f}  {}".format(
+                    stats["stage"],
+                    stats["calls"],
+                    stats["wall_time"],
+                    stats["cpu_time"],
+                    stats["peak_memory_delta"] / 2 ** 20,
+                    ", ".join(
+                        "{}={}".format(key, value)
+                        for key, value in stats["counts"].items()
+                    ),
+                )
+            )
+        return "\n".join(lines)
+
+    @property
+    def _frames(self):
+        if not hasattr(self._local, "frames"):
+            self._local.frames = []
+        return self._local.frames
+
+    def _update_memory_peaks(self, memory_peak):
+        for frame in self._frames:
+            frame.memory_peak = max(frame.memory_peak, memory_peak)
+
+
+def _profilers_stack():
+    if not hasattr(_local, "profilers"):
+        _local.profilers = []
+    return _local.profilers
+
+
+def active_profiler():
+    stack = _profilers_stack()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def stage(name):
+    profiler = active_profiler()
+    if profiler is None:
+        yield None
+    else:
+        with profiler.stage(name) as stats:
+            yield stats
+
+
+def count(name, value=1):
+    profiler = active_profiler()
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+def profiled(name):
+    """Decorator recording every call of the function as the stage `name`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = active_profiler()
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
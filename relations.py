@@ -1,11 +1,18 @@
 import argparse
+import csv
+import hashlib
+import heapq
 import io
 import json
 import logging
+import os
+import pickle
 import xml.etree.ElementTree as ET
+import zipfile
+from contextlib import contextmanager
 from copy import deepcopy
 from functools import reduce
-from itertools import groupby
+from itertools import chain, groupby, repeat
 from pathlib import Path
 from typing import List, NamedTuple, Sequence
 
@@ -18,10 +25,67 @@ from sklearn.metrics import silhouette_score
 from sklearn_extra.cluster import KMedoids
 from tqdm import tqdm
 
+import profiling
+import tracing
+from checkpoint import (
+    STAGE_CLUSTERS,
+    STAGE_GRAPH_MERGED,
+    STAGE_GRAPH_PREMERGE,
+    STAGE_RELTUPLES,
+    Checkpointer,
+    NullCheckpointer,
+    hash_inputs,
+)
+from graph_index import EntityIndex, ego_nodes
+from heavy_hitters import CAPACITY_FACTOR, SpaceSaving
+from near_duplicates import (
+    POLICIES,
+    WEIGHT,
+    NearDuplicateFilter,
+    conllu_text,
+)
+from near_duplicates import sentence_weights as documents_sentence_weights
+from relations_store import write_relations
 from udpipe_model import UDPipeModel
+from udpipe_service import load_udpipe
 
 MIN_CLUSTER_SIZE = 50
 NODE_DISTANCE_THRESHOLD = 0.3
+PROGRESS_STEP = 100
+# relative growth of the distance of new sentences to the medoids of their
+# clusters after which all sentences are clustered anew
+DRIFT_THRESHOLD = 0.2
+STATE_ATTRIBUTES = (
+    "reltuples",
+    "sentence_weights",
+    "cluster_labels",
+    "medoid_clusters",
+    "medoids",
+    "medoid_distance",
+    "assigned_distance",
+    "assigned_number",
+    "merged_graph",
+)
+EXPORT_FORMATS = ("gexf", "json", "jsonl", "tables")
+DEFAULT_EXPORT_FORMATS = ("gexf", "json")
+# how node vectors are written to GEXF, quantized ones are rounded
+GEXF_VECTORS = ("full", "quantized", "none")
+VECTOR_DECIMALS = 4
+NODE_COLUMNS = ("name", "label", "lemmas", "weight", "feat_type", "description")
+EDGE_COLUMNS = (
+    "source",
+    "target",
+    "label",
+    "lemmas",
+    "deprel",
+    "weight",
+    "feat_type",
+    "description",
+)
+
+EXTRACTION_LOGGER = tracing.get_logger(tracing.EXTRACTION)
+MERGE_LOGGER = tracing.get_logger(tracing.MERGE)
+FILTER_LOGGER = tracing.get_logger(tracing.FILTER)
 
 
 class Reltuple(NamedTuple):
@@ -37,10 +101,42 @@ class Reltuple(NamedTuple):
 
 
 class SentenceReltuples:
-    def __init__(self, sentence, w2v_model, additional_relations=False, stopwords=[]):
+    """Relations extracted from a sentence.
+
+    The parsed ufal.udpipe.Sentence is only used during extraction and is
+    released right after it, so the object keeps just the sentence id, text,
+    vector and relations.
+    """
+
+    __slots__ = (
+        "sentence",
+        "id",
+        "text",
+        "multiplicity",
+        "sentence_vector",
+        "_stopwords",
+        "_reltuples",
+    )
+
+    @profiling.profiled("SentenceReltuples")
+    def __init__(
+        self,
+        sentence,
+        w2v_model,
+        additional_relations=False,
+        stopwords=[],
+        sentence_id=None,
+    ):
         self.sentence = sentence
+        self.id = sentence_id
+        self.text = sentence.getText()
+        # number of copies of the sentence in the text, see TextReltuples
+        self.multiplicity = 1
         self.sentence_vector = _get_phrase_vector(sentence, "all", w2v_model)
-        self._stopwords = set(stopwords)
+        if isinstance(stopwords, (set, frozenset)):
+            self._stopwords = stopwords
+        else:
+            self._stopwords = set(stopwords)
         words_ids_tuples = self._get_words_ids_tuples(
             additional_relations=additional_relations
         )
@@ -50,21 +146,28 @@ class SentenceReltuples:
             for reltuple in self._reltuples
             if reltuple.left_arg != reltuple.right_arg
         ]
-        logging.info(
-            "{} relations were extracted from the sentence {}:\n".format(
-                len(self._reltuples), self.sentence.getText()
-            )
-            + "\n".join(
-                "({}, {}, {})".format(
-                    reltuple.left_arg, reltuple.relation, reltuple.right_arg
-                )
-                for reltuple in self._reltuples
-            )
-        )
+        profiling.count("sentences")
+        profiling.count("reltuples", len(self._reltuples))
+        tracing.trace(EXTRACTION_LOGGER, logging.INFO, self._extraction_trace)
+        self.sentence = None
+        self._stopwords = None
 
     def __getitem__(self, index):
         return self._reltuples[index]
 
+    def __len__(self):
+        return len(self._reltuples)
+
+    def _extraction_trace(self):
+        return "{} relations were extracted from the sentence {}:\n".format(
+            len(self._reltuples), self.text
+        ) + "\n".join(
+            "({}, {}, {})".format(
+                reltuple.left_arg, reltuple.relation, reltuple.right_arg
+            )
+            for reltuple in self._reltuples
+        )
+
     def _to_tuple(self, reltuple, w2v_model):
         left_arg = self._arg_to_string(reltuple[0], lemmatized=False)
         left_arg_lemmas = self._arg_to_string(reltuple[0], lemmatized=True)
@@ -136,8 +239,15 @@ class SentenceReltuples:
             args = {tuple(left_arg) for left_arg, _, _ in result} | {
                 tuple(right_arg) for _, _, right_arg in result
             }
+            # phrases nested in several arguments are decomposed only once
+            memo = {}
+            additional_reltuples = []
             for arg in args:
-                result += self._get_additional_reltuples(list(arg))
+                if arg not in memo:  # otherwise its relations are already here
+                    additional_reltuples += self._get_additional_reltuples(
+                        list(arg), memo=memo
+                    )
+            result += _unique_words_ids_tuples(additional_reltuples)
         return [
             (left_arg, relation, right_arg)
             for left_arg, relation, right_arg in result
@@ -164,7 +274,21 @@ class SentenceReltuples:
         relation = self._get_copula(copula)
         return [(subj, relation, right_arg) for subj in subjects]
 
-    def _get_additional_reltuples(self, words_ids):
+    def _get_additional_reltuples(self, words_ids, memo=None):
+        """Relations of the phrase with its parts, recursively.
+
+        `memo` maps phrases that are already decomposed to their relations.
+        """
+        if memo is None:
+            memo = {}
+        key = tuple(words_ids)
+        if key in memo:
+            return memo[key]
+        result = self._derive_additional_reltuples(words_ids, memo)
+        memo[key] = result
+        return result
+
+    def _derive_additional_reltuples(self, words_ids, memo):
         result = []
         is_a_deprels = ["appos", "flat", "flat:foreign", "flat:name", "conj"]
         relates_to_deprels = ["nmod"]
@@ -178,13 +302,13 @@ class SentenceReltuples:
                 subtree = self._get_subtree(child)
                 descendants_ids = [id_ for id_ in words_ids if id_ in subtree]
                 result.append((words_ids, "_is_a_", descendants_ids))
-                result += self._get_additional_reltuples(descendants_ids)
+                result += self._get_additional_reltuples(descendants_ids, memo)
                 main_phrase_ids = [
                     id_ for id_ in main_phrase_ids if id_ not in descendants_ids
                 ]
         if len(words_ids) != len(main_phrase_ids):  # found "is_a" relation?
             result.append((words_ids, "_is_a_", main_phrase_ids))
-            result += self._get_additional_reltuples(main_phrase_ids)
+            result += self._get_additional_reltuples(main_phrase_ids, memo)
             return result
 
         old_main_phrase_length = len(main_phrase_ids)
@@ -194,7 +318,7 @@ class SentenceReltuples:
                 subtree = self._get_subtree(child)
                 descendants_ids = [id_ for id_ in words_ids if id_ in subtree]
                 result.append((words_ids, "_relates_to_", descendants_ids))
-                result += self._get_additional_reltuples(descendants_ids)
+                result += self._get_additional_reltuples(descendants_ids, memo)
                 main_phrase_ids = [
                     id_ for id_ in main_phrase_ids if id_ not in descendants_ids
                 ]
@@ -202,7 +326,7 @@ class SentenceReltuples:
             main_phrase_ids
         ):  # found "relates_to" relation?
             result.append((words_ids, "_is_a_", main_phrase_ids))
-            result += self._get_additional_reltuples(main_phrase_ids)
+            result += self._get_additional_reltuples(main_phrase_ids, memo)
         elif len(main_phrase_ids) > 1:
             result.append((main_phrase_ids, "_is_a_", [root.id]))
         return result
@@ -370,6 +494,58 @@ class SentenceReltuples:
         return word.deprel == "conj"
 
 
+class _AggregatedNode:
+    __slots__ = ("lemmas", "labels", "description", "weight", "vector", "feat_type")
+
+    def __init__(self, lemmas, feat_type):
+        self.lemmas = lemmas
+        self.labels = set()
+        self.description = set()
+        self.weight = 0
+        self.vector = None
+        self.feat_type = feat_type
+
+    def add(self, label, description, weight, vector):
+        self.labels.update(label.split(" | "))
+        self.description.add(description)
+        self.weight += weight
+        # the same running average RelGraph._add_node keeps
+        self.vector = vector if self.vector is None else (self.vector + vector) / 2
+
+
+class _AggregatedEdge:
+    """Insertions of an edge as (sentence index, weight, description, cluster).
+
+    An inherited edge starts with the `inherited` (weight, description,
+    feat_type) of the edge it's copied from.
+    """
+
+    __slots__ = ("label", "lemmas", "deprel", "events", "inherited")
+
+    def __init__(self, label, lemmas, deprel):
+        self.label = label
+        self.lemmas = lemmas
+        self.deprel = deprel
+        self.events = []
+        self.inherited = None
+
+    def state(self, time=None):
+        """Weight, description and feat_type after the sentence `time`."""
+        if self.inherited is None:
+            weight, description, feat_type = 0, set(), set()
+        else:
+            weight, description, feat_type = self.inherited
+            description = set(description)
+            feat_type = set(feat_type)
+        for event_time, event_weight, event_description, cluster in self.events:
+            if time is not None and event_time > time:
+                break
+            weight += event_weight
+            description.add(event_description)
+            feat_type.add(cluster)
+        return weight, description, feat_type
+
+
 class RelGraph:
     def __init__(self):
         self._graph = nx.MultiDiGraph()
@@ -380,6 +556,22 @@ class RelGraph:
         for sentence_reltuple in reltuples_iter:
             graph.add_sentence_reltuples(sentence_reltuple)
 
+    @classmethod
+    def from_attributes(cls, nodes, edges, inherit_relations=True):
+        """Graph of the nodes and edges given by their attributes.
+
+        `nodes` are dicts of `_add_node` arguments and `edges` are dicts of
+        `_add_edge` arguments with the node names `node_name` gives.
+        """
+        graph = cls()
+        for node in nodes:
+            graph._add_node(**node)
+        for edge in edges:
+            graph._add_edge(**edge)
+        if inherit_relations:
+            graph._inherit_relations()
+        return graph
+
     @property
     def nodes_number(self):
         return self._graph.number_of_nodes()
@@ -388,146 +580,451 @@ class RelGraph:
     def edges_number(self):
         return self._graph.number_of_edges()
 
+    @profiling.profiled("index")
+    def index(self):
+        """EntityIndex to search the nodes of the graph by their words."""
+        return EntityIndex.from_graph(self._graph)
+
+    @profiling.profiled("add_sentence_reltuples")
     def add_sentence_reltuples(
-        self, sentence_reltuples: SentenceReltuples, cluster: int = 0
+        self, sentence_reltuples: SentenceReltuples, cluster: int = 0, weight: int = 1
     ):
-        sentence_text = sentence_reltuples.sentence.getText()
+        profiling.count("reltuples", len(sentence_reltuples))
         for reltuple in sentence_reltuples:
-            source = self._add_node(
-                reltuple.left_arg_lemmas,
-                sentence_text,
-                label=reltuple.left_arg,
-                vector=reltuple.left_w2v,
-                feat_type=cluster,
-            )
-            target = self._add_node(
-                reltuple.right_arg_lemmas,
-                sentence_text,
-                label=reltuple.right_arg,
-                vector=reltuple.right_w2v,
-                feat_type=cluster,
+            self._add_reltuple(reltuple, sentence_reltuples.text, cluster, weight)
+        self._inherit_relations()
+
+    @profiling.profiled("extend")
+    def extend(self, items):
+        """Add the (sentence_reltuples, cluster, weight) items to a built graph.
+
+        The relations are inherited once after all the items and only around
+        the nodes they touch. Return the touched nodes, merging can be limited
+        to them.
+        """
+        touched = set()
+        for sentence_reltuples, cluster, weight in items:
+            profiling.count("reltuples", len(sentence_reltuples))
+            for reltuple in sentence_reltuples:
+                touched.update(
+                    self._add_reltuple(
+                        reltuple, sentence_reltuples.text, cluster, weight
+                    )
+                )
+        touched |= self._inherit_relations(nodes=touched)
+        return touched
+
+    def _add_reltuple(self, reltuple, sentence_text, cluster, weight):
+        # clusters can be floats, _add_node only takes ints for single ones
+        cluster = {cluster}
+        source = self._add_node(
+            reltuple.left_arg_lemmas,
+            sentence_text,
+            label=reltuple.left_arg,
+            weight=weight,
+            vector=reltuple.left_w2v,
+            feat_type=cluster,
+        )
+        target = self._add_node(
+            reltuple.right_arg_lemmas,
+            sentence_text,
+            label=reltuple.right_arg,
+            weight=weight,
+            vector=reltuple.right_w2v,
+            feat_type=cluster,
+        )
+        self._add_edge(
+            source,
+            target,
+            reltuple.relation,
+            reltuple.relation_lemmas,
+            reltuple.right_deprel,
+            sentence_text,
+            weight=weight,
+            feat_type=cluster,
+        )
+        return source, target
+
+    @profiling.profiled("add_sentences_reltuples")
+    def add_sentences_reltuples(self, items, nodes_to_keep=None):
+        """Build the graph of the (sentence_reltuples, cluster, weight) items.
+
+        The graph is the same as the one `add_sentence_reltuples` builds from
+        the items one by one, but the nodes and edges are aggregated first and
+        then added once each, and the inherited relations are found in a
+        single pass instead of after every sentence. If `nodes_to_keep` is
+        given, other nodes and their relations are skipped.
+        """
+        if self.nodes_number > 0:
+            raise ValueError("Bulk insertion needs an empty graph")
+        nodes = {}
+        edges = {}
+        for time, (sentence_reltuples, cluster, weight) in enumerate(items):
+            sentence_text = sentence_reltuples.text
+            profiling.count("reltuples", len(sentence_reltuples))
+            for reltuple in sentence_reltuples:
+                source = node_name(reltuple.left_arg_lemmas, cluster)
+                target = node_name(reltuple.right_arg_lemmas, cluster)
+                keep_source = nodes_to_keep is None or source in nodes_to_keep
+                keep_target = nodes_to_keep is None or target in nodes_to_keep
+                if keep_source:
+                    self._aggregate_node(
+                        nodes,
+                        source,
+                        reltuple.left_arg_lemmas,
+                        reltuple.left_arg,
+                        sentence_text,
+                        weight,
+                        reltuple.left_w2v,
+                        cluster,
+                    )
+                if keep_target:
+                    self._aggregate_node(
+                        nodes,
+                        target,
+                        reltuple.right_arg_lemmas,
+                        reltuple.right_arg,
+                        sentence_text,
+                        weight,
+                        reltuple.right_w2v,
+                        cluster,
+                    )
+                if not (keep_source and keep_target):
+                    # the kept node is still as heavy as without filtering
+                    continue
+                if reltuple.relation in ["_is_a_", "_relates_to_"]:
+                    key = reltuple.relation
+                else:
+                    key = "{} + {}".format(
+                        reltuple.relation_lemmas, reltuple.right_deprel
+                    )
+                edge = edges.get((source, target, key))
+                if edge is None:
+                    edge = edges[(source, target, key)] = _AggregatedEdge(
+                        reltuple.relation,
+                        reltuple.relation_lemmas,
+                        reltuple.right_deprel,
+                    )
+                edge.events.append((time, weight, sentence_text, cluster))
+
+        for node in nodes.values():
+            self._add_node(
+                node.lemmas,
+                node.description,
+                " | ".join(node.labels),
+                weight=node.weight,
+                vector=node.vector,
+                feat_type=node.feat_type,
             )
+        for source, target, key in self._inherit_aggregated_relations(edges):
+            edge = edges[(source, target, key)]
+            weight, description, feat_type = edge.state()
             self._add_edge(
                 source,
                 target,
-                reltuple.relation,
-                reltuple.relation_lemmas,
-                reltuple.right_deprel,
-                sentence_text,
-                feat_type=cluster,
+                edge.label,
+                edge.lemmas,
+                edge.deprel,
+                description,
+                weight=weight,
+                feat_type=feat_type,
             )
-        self._inherit_relations()
 
-    def merge_relations(self):
+    @staticmethod
+    def _aggregate_node(
+        nodes, node, lemmas, label, description, weight, vector, cluster
+    ):
+        aggregated = nodes.get(node)
+        if aggregated is None:
+            aggregated = nodes[node] = _AggregatedNode(lemmas, {cluster})
+        aggregated.add(label, description, weight, vector)
+
+    @staticmethod
+    def _inherit_aggregated_relations(edges):
+        """Add the edges `_inherit_relations` would copy to `edges`.
+
+        An edge exists from the earliest sentence it's inserted by or can be
+        copied at, i.e. when both the copied edge and the `_is_a_` edge exist,
+        so the edges are created in the order of these times like in Dijkstra's
+        algorithm. A copy starts with the state of the copied edge at that
+        time. Return the keys of all the edges in the order of creation.
+        """
+        is_a_successors = {}
+        heap = []
+        for i, ((source, target, key), edge) in enumerate(edges.items()):
+            if key == "_is_a_":
+                is_a_successors.setdefault(source, []).append(
+                    (target, edge.events[0][0])
+                )
+            heap.append((edge.events[0][0], 0, i, (source, target, key), None))
+        heapq.heapify(heap)
+        counter = len(heap)
+        created = {}
+        while heap:
+            time, _, _, edge_key, origin_key = heapq.heappop(heap)
+            if edge_key in created:
+                continue
+            created[edge_key] = time
+            source, target, key = edge_key
+            if origin_key is not None:
+                origin = edges[origin_key]
+                edge = edges.get(edge_key)
+                if edge is None:
+                    edge = edges[edge_key] = _AggregatedEdge(
+                        origin.label, origin.lemmas, origin.deprel
+                    )
+                else:
+                    # the copy is older than the edge inserted directly
+                    edge.label = origin.label
+                    edge.lemmas = origin.lemmas
+                    edge.deprel = origin.deprel
+                edge.inherited = origin.state(time)
+            if key in ["_is_a_", "_relates_to_"]:
+                continue
+            candidates = [
+                ((source, node, key), is_a_time)
+                for node, is_a_time in is_a_successors.get(target, ())
+            ] + [
+                ((node, target, key), is_a_time)
+                for node, is_a_time in is_a_successors.get(source, ())
+            ]
+            for candidate, is_a_time in candidates:
+                if candidate not in created:
+                    counter += 1
+                    heapq.heappush(
+                        heap, (max(time, is_a_time), 1, counter, candidate, edge_key)
+                    )
+        return list(created)
+
+    @profiling.profiled("merge_relations")
+    def merge_relations(self, nodes=None):
+        """Merge similar nodes and parallel edges until there is nothing to merge.
+
+        If `nodes` are given, the rest of the graph is considered merged
+        already, so only the merges of these nodes, the nodes with the same
+        labels and the nodes they are merged into are looked for.
+        """
+        touched = nodes_by_label = None
+        if nodes is not None:
+            touched = set(nodes)
+            nodes_by_label = {}
+            for node, label in self._graph.nodes(data="label"):
+                nodes_by_label.setdefault(label, set()).add(node)
         while True:
-            same_name_nodes_to_merge_lists = self._find_same_name_nodes_to_merge()
+            same_name_nodes_to_merge_lists = self._find_same_name_nodes_to_merge(
+                self._merge_scope(touched, nodes_by_label)
+            )
             if len(same_name_nodes_to_merge_lists) > 0:
                 for same_name_nodes_to_merge in same_name_nodes_to_merge_lists:
-                    logging.info(
-                        (
-                            "Found {n_to_merge} same name arguments to merge:\n"
-                            "{args}\n"
-                            "Clusters of arguments: \n"
-                            "{clusters}"
-                        ).format(
-                            n_to_merge=len(same_name_nodes_to_merge),
-                            args="\n".join(
-                                self._graph.nodes[node]["label"]
-                                for node in same_name_nodes_to_merge
-                            ),
-                            clusters="\n".join(
-                                str(self._graph.nodes[node]["feat_type"])
-                                for node in same_name_nodes_to_merge
-                            ),
-                        )
+                    tracing.trace(
+                        MERGE_LOGGER,
+                        logging.INFO,
+                        self._nodes_merge_trace,
+                        "same_name",
+                        same_name_nodes_to_merge,
                     )
-                    self._merge_nodes(same_name_nodes_to_merge)
+                    merged = self._merge_nodes(same_name_nodes_to_merge)
+                    self._touch(merged, touched, nodes_by_label)
+                    profiling.count("merges")
 
             nodes_to_merge = []
             edges_to_merge = []
 
-            for source, target, key in self._graph.edges:
+            for source, target, key in self._merge_scope(touched, nodes_by_label):
                 targets_to_merge = self._find_nodes_to_merge(source=source, key=key)
                 if len(targets_to_merge) > 1:
-                    logging.info(
-                        (
-                            "Found {n_to_merge} right arguments to merge: \n"
-                            "Shared left argument: {left_arg} \n"
-                            "Shared relation: {rel} \n"
-                            "Values to merge: \n"
-                            "{values_to_merge}"
-                        ).format(
-                            n_to_merge=len(targets_to_merge),
-                            left_arg=self._graph.nodes[source]["label"],
-                            rel=self._graph[source][next(iter(targets_to_merge))][key][
-                                "label"
-                            ],
-                            values_to_merge="\n".join(
-                                self._graph.nodes[node]["label"]
-                                for node in targets_to_merge
-                            ),
-                        )
+                    tracing.trace(
+                        MERGE_LOGGER,
+                        logging.INFO,
+                        self._nodes_merge_trace,
+                        "shared_left_arg",
+                        targets_to_merge,
+                        shared_node=source,
+                        edge=(source, next(iter(targets_to_merge)), key),
                     )
                     nodes_to_merge = targets_to_merge
                     break
 
                 sources_to_merge = self._find_nodes_to_merge(target=target, key=key)
                 if len(sources_to_merge) > 1:
-                    logging.info(
-                        (
-                            "Found {n_to_merge} left arguments to merge: \n"
-                            "Shared right argument: {right_arg} \n"
-                            "Shared relation: {rel} \n"
-                            "Values to merge: \n"
-                            "{values_to_merge}"
-                        ).format(
-                            n_to_merge=len(sources_to_merge),
-                            right_arg=self._graph.nodes[target]["label"],
-                            rel=self._graph[next(iter(sources_to_merge))][target][key][
-                                "label"
-                            ],
-                            values_to_merge="\n".join(
-                                self._graph.nodes[node]["label"]
-                                for node in sources_to_merge
-                            ),
-                        )
+                    tracing.trace(
+                        MERGE_LOGGER,
+                        logging.INFO,
+                        self._nodes_merge_trace,
+                        "shared_right_arg",
+                        sources_to_merge,
+                        shared_node=target,
+                        edge=(next(iter(sources_to_merge)), target, key),
                     )
                     nodes_to_merge = sources_to_merge
                     break
 
                 edges_to_merge = self._find_edges_to_merge(source, target)
                 if len(edges_to_merge) > 1:
-                    logging.info(
-                        (
-                            "Found {n_to_merge} relations to merge: \n"
-                            "Shared left argument: {left_arg} \n"
-                            "Shared right argument: {right_arg} \n"
-                            "Values to merge: \n"
-                            "{values_to_merge}"
-                        ).format(
-                            n_to_merge=len(edges_to_merge),
-                            left_arg=self._graph.nodes[source]["label"],
-                            right_arg=self._graph.nodes[target]["label"],
-                            values_to_merge="\n".join(
-                                {
-                                    self._graph[s][t][key]["label"]
-                                    for s, t, key in edges_to_merge
-                                }
-                            ),
-                        )
+                    tracing.trace(
+                        MERGE_LOGGER,
+                        logging.INFO,
+                        self._edges_merge_trace,
+                        source,
+                        target,
+                        edges_to_merge,
                     )
                     break
 
             if len(nodes_to_merge) > 1:
-                self._merge_nodes(nodes_to_merge)
+                merged = self._merge_nodes(nodes_to_merge)
+                self._touch(merged, touched, nodes_by_label)
+                profiling.count("merges")
             elif len(edges_to_merge) > 1:
                 self._merge_edges(edges_to_merge)
+                profiling.count("merges")
             else:
                 break
+        profiling.count("nodes", self.nodes_number)
+        profiling.count("edges", self.edges_number)
+
+    def _merge_scope(self, touched, nodes_by_label):
+        """Edges to look for merges at, all of them if nothing is `touched`."""
+        if touched is None:
+            return self._graph.edges
+        touched.intersection_update(self._graph)
+        scope = set(touched)
+        for node in touched:
+            scope.update(
+                n
+                for n in nodes_by_label.get(self._graph.nodes[node]["label"], ())
+                if n in self._graph
+            )
+        return list(
+            {
+                *self._graph.out_edges(scope, keys=True),
+                *self._graph.in_edges(scope, keys=True),
+            }
+        )
 
+    def _touch(self, node, touched, nodes_by_label):
+        if touched is not None:
+            touched.add(node)
+            label = self._graph.nodes[node]["label"]
+            nodes_by_label.setdefault(label, set()).add(node)
+
+    @profiling.profiled("filter_nodes")
     def filter_nodes(self, n_nodes_to_leave):
         nodes_to_remove = self._find_nodes_to_remove(n_nodes_to_leave)
+        self._trace_filtering(nodes_to_remove)
         self._perform_filtering(nodes_to_remove)
+        self._log_filtering(nodes_to_remove)
+
+    @profiling.profiled("filter_nodes")
+    def filtered(self, n_nodes_to_leave):
+        """Graph `filter_nodes` would leave, this graph isn't changed.
+
+        Only the nodes left and the filtered out ones between them, whose
+        relations are joined, are copied. Attribute values are shared with
+        this graph, they are replaced and not changed in place.
+        """
+        nodes_to_remove = self._find_nodes_to_remove(n_nodes_to_leave)
+        self._trace_filtering(nodes_to_remove)
+        nodes_to_leave = set(self._graph) - nodes_to_remove
+        between = self._reachable(nodes_to_leave, nodes_to_remove) & (
+            self._reachable(nodes_to_leave, nodes_to_remove, reverse=True)
+        )
+        graph = RelGraph()
+        graph._graph = self._graph.subgraph(nodes_to_leave | between).copy()
+        graph._perform_filtering(between)
+        graph._log_filtering(nodes_to_remove)
+        return graph
+
+    def _reachable(self, nodes, through, reverse=False):
+        """Nodes of `through` reachable from `nodes` by nodes of `through`."""
+        neighbours = self._graph.predecessors if reverse else self._graph.successors
+        reached = set()
+        queue = list(nodes)
+        while queue:
+            for neighbour in neighbours(queue.pop()):
+                if neighbour in through and neighbour not in reached:
+                    reached.add(neighbour)
+                    queue.append(neighbour)
+        return reached
+
+    def _trace_filtering(self, nodes_to_remove):
+        tracing.trace(
+            FILTER_LOGGER,
+            logging.DEBUG,
+            lambda: "Nodes to filter out:\n"
+            + "\n".join(self._graph.nodes[node]["label"] for node in nodes_to_remove),
+        )
+
+    def _log_filtering(self, nodes_to_remove):
+        FILTER_LOGGER.info(
+            "%d nodes were filtered out, %d nodes and %d edges are left",
+            len(nodes_to_remove),
+            self.nodes_number,
+            self.edges_number,
+        )
+        profiling.count("nodes", self.nodes_number)
+        profiling.count("edges", self.edges_number)
+
+    @profiling.profiled("ego_subgraph")
+    def ego_subgraph(self, nodes, radius=1, min_weight=0, max_nodes=None):
+        """Graph of the nodes at most `radius` relations away from the given
+        ones, following only the relations of at least `min_weight`.
+
+        At most `max_nodes` nodes are kept, the nearest ones with the heaviest
+        relations and then the heaviest ones, see `graph_index.ego_nodes`. The
+        nodes are the ones `EntityIndex.ego` gives for the graph.
+        """
+
+        def neighbours(node):
+            for source, target, weight in chain(
+                self._graph.out_edges(node, data="weight"),
+                self._graph.in_edges(node, data="weight"),
+            ):
+                if weight >= min_weight:
+                    yield weight, target if source == node else source
+
+        kept = ego_nodes(
+            nodes,
+            radius,
+            neighbours,
+            max_nodes=max_nodes,
+            key=lambda node: (-self._graph.nodes[node]["weight"], node),
+        )
+        graph = RelGraph()
+        graph._graph = self._graph.subgraph(kept).copy()
+        graph._graph.remove_edges_from(
+            [
+                (source, target, key)
+                for source, target, key, weight in graph._graph.edges(
+                    keys=True, data="weight"
+                )
+                if weight < min_weight
+            ]
+        )
+        return graph
+
+    def _nodes_merge_trace(self, reason, nodes, shared_node=None, edge=None):
+        res = {
+            "event": "merge_nodes",
+            "reason": reason,
+            "labels": [self._graph.nodes[node]["label"] for node in nodes],
+            "clusters": [
+                sorted(self._graph.nodes[node]["feat_type"]) for node in nodes
+            ],
+        }
+        if shared_node is not None:
+            res["shared_arg"] = self._graph.nodes[shared_node]["label"]
+        if edge is not None:
+            res["relation"] = self._graph.edges[edge]["label"]
+        return res
+
+    def _edges_merge_trace(self, source, target, edges):
+        return {
+            "event": "merge_edges",
+            "left_arg": self._graph.nodes[source]["label"],
+            "right_arg": self._graph.nodes[target]["label"],
+            "labels": sorted({self._graph.edges[edge]["label"] for edge in edges}),
+        }
 
     def _add_edge(
         self, source, target, label, lemmas, deprel, description, weight=1, feat_type=0
@@ -630,60 +1127,95 @@ class RelGraph:
             self._graph.nodes[node]["weight"] += weight
         return node
 
-    def _inherit_relations(self):
-        modified = True
-        while modified:
-            modified = False
-            for node in self._graph:
-                predecessors_by_is_a = {
-                    n
-                    for n in self._graph.predecessors(node)
-                    if self._graph.has_edge(n, node, key="_is_a_")
-                }
-                in_verb_rel_edges = [
-                    (source, key, attr)
-                    for n in predecessors_by_is_a
-                    for source, _, key, attr in self._graph.in_edges(
-                        n, data=True, keys=True
-                    )
-                    if key not in ["_is_a_", "_relates_to_"]
-                ]
-                out_verb_rel_edges = [
-                    (target, key, attr)
-                    for n in predecessors_by_is_a
-                    for _, target, key, attr in self._graph.out_edges(
-                        n, data=True, keys=True
-                    )
-                    if key not in ["_is_a_", "_relates_to_"]
-                ]
-                for source, key, attr in in_verb_rel_edges:
-                    if self._graph.has_edge(source, node, key=key):
-                        continue
-                    self._add_edge(
-                        source,
-                        node,
-                        attr["label"],
-                        attr["lemmas"],
-                        attr["deprel"],
-                        attr["description"],
-                        weight=attr["weight"],
-                        feat_type=attr["feat_type"],
-                    )
-                    modified = True
-                for target, key, attr in out_verb_rel_edges:
-                    if self._graph.has_edge(node, target, key=key):
-                        continue
-                    self._add_edge(
-                        node,
-                        target,
-                        attr["label"],
-                        attr["lemmas"],
-                        attr["deprel"],
-                        attr["description"],
-                        weight=attr["weight"],
-                        feat_type=attr["feat_type"],
-                    )
-                    modified = True
+    @profiling.profiled("_inherit_relations")
+    def _inherit_relations(self, nodes=None):
+        """Copy the verb relations of `_is_a_` predecessors to their successors.
+
+        All nodes are checked unless `nodes` are given, then only these nodes
+        and the ones the copied relations get to. Return the nodes that got
+        new relations.
+        """
+        modified_nodes = set()
+        if nodes is None:
+            modified = True
+            while modified:
+                modified = False
+                for node in self._graph:
+                    added = self._inherit_node_relations(node)
+                    if added:
+                        modified = True
+                        modified_nodes.update(n for edge in added for n in edge)
+            return modified_nodes
+
+        # the successors of the nodes may inherit their new relations
+        queued = {s for n in nodes for s in [n, *self._is_a_successors(n)]}
+        queue = list(queued)
+        while queue:
+            node = queue.pop()
+            queued.discard(node)
+            for edge in self._inherit_node_relations(node):
+                modified_nodes.update(edge)
+                for successor in (s for n in edge for s in self._is_a_successors(n)):
+                    if successor not in queued:
+                        queue.append(successor)
+                        queued.add(successor)
+        return modified_nodes
+
+    def _is_a_successors(self, node):
+        return [
+            n
+            for n in self._graph.successors(node)
+            if self._graph.has_edge(node, n, key="_is_a_")
+        ]
+
+    def _inherit_node_relations(self, node):
+        predecessors_by_is_a = {
+            n
+            for n in self._graph.predecessors(node)
+            if self._graph.has_edge(n, node, key="_is_a_")
+        }
+        in_verb_rel_edges = [
+            (source, key, attr)
+            for n in predecessors_by_is_a
+            for source, _, key, attr in self._graph.in_edges(n, data=True, keys=True)
+            if key not in ["_is_a_", "_relates_to_"]
+        ]
+        out_verb_rel_edges = [
+            (target, key, attr)
+            for n in predecessors_by_is_a
+            for _, target, key, attr in self._graph.out_edges(n, data=True, keys=True)
+            if key not in ["_is_a_", "_relates_to_"]
+        ]
+        added = []
+        for source, key, attr in in_verb_rel_edges:
+            if self._graph.has_edge(source, node, key=key):
+                continue
+            self._add_edge(
+                source,
+                node,
+                attr["label"],
+                attr["lemmas"],
+                attr["deprel"],
+                attr["description"],
+                weight=attr["weight"],
+                feat_type=attr["feat_type"],
+            )
+            added.append((source, node))
+        for target, key, attr in out_verb_rel_edges:
+            if self._graph.has_edge(node, target, key=key):
+                continue
+            self._add_edge(
+                node,
+                target,
+                attr["label"],
+                attr["lemmas"],
+                attr["deprel"],
+                attr["description"],
+                weight=attr["weight"],
+                feat_type=attr["feat_type"],
+            )
+            added.append((node, target))
+        return added
 
     def _find_target_merge_candidates(self, source, key):
         return {
@@ -802,9 +1334,9 @@ class RelGraph:
                     edges.discard((s2, t2, key2))
         return edges
 
-    def _find_same_name_nodes_to_merge(self):
+    def _find_same_name_nodes_to_merge(self, edges):
         labels_edges_dict = {}
-        for s, t, k in self._graph.edges:
+        for s, t, k in edges:
             labels = (
                 self._graph.nodes[s]["label"],
                 self._graph[s][t][k]["label"],
@@ -867,6 +1399,7 @@ class RelGraph:
 
         for node in other_nodes:
             self._graph.remove_node(node)
+        return main_node
 
     def _merge_edges(self, edges):
         def new_str_attr_value(attr_key):
@@ -902,13 +1435,28 @@ class RelGraph:
             )
             self._graph.remove_edge(source, target, key=key)
 
-    def save(self, path):
+    @profiling.profiled("save")
+    def save(self, path, vectors="full"):
+        """Write the graph to GEXF, the graph can't be changed afterwards.
+
+        Node vectors are written as they are, rounded to `VECTOR_DECIMALS`
+        with vectors="quantized" or not at all with vectors="none".
+        """
+        if vectors not in GEXF_VECTORS:
+            raise ValueError("Unknown vectors mode: {}".format(vectors))
+        profiling.count("nodes", self.nodes_number)
+        profiling.count("edges", self.edges_number)
         self._transform()
         for node in self._graph:
-            if self._graph.nodes[node].get("vector") is not None:
+            vector = self._graph.nodes[node].get("vector")
+            if vector is not None and vectors == "none":
+                del self._graph.nodes[node]["vector"]
+            elif vector is not None and vectors == "quantized":
                 self._graph.nodes[node]["vector"] = str(
-                    self._graph.nodes[node]["vector"].tolist()
+                    np.round(vector.astype(np.float64), VECTOR_DECIMALS).tolist()
                 )
+            elif vector is not None:
+                self._graph.nodes[node]["vector"] = str(vector.tolist())
             self._graph.nodes[node]["description"] = " | ".join(
                 self._graph.nodes[node]["description"]
             )
@@ -924,6 +1472,63 @@ class RelGraph:
         xml_tree = ET.ElementTree(root_element)
         xml_tree.write(path, encoding="utf-8")
 
+    @profiling.profiled("save_tables")
+    def save_tables(self, file):
+        """Write the graph as a zip of nodes.csv, edges.csv and vectors.npy.
+
+        Edges refer to the nodes by their rows and row i of the float32
+        vectors array is the vector of node i, zeros if it has none. Call it
+        before `save`, which changes the graph.
+        """
+        nodes = list(self._graph)
+        rows = {node: i for i, node in enumerate(nodes)}
+        node_vectors = [self._graph.nodes[node].get("vector") for node in nodes]
+        dimension = next(
+            (len(vector) for vector in node_vectors if vector is not None), 0
+        )
+        vectors = np.zeros((len(nodes), dimension), dtype=np.float32)
+        for i, vector in enumerate(node_vectors):
+            if vector is not None:
+                vectors[i] = vector
+
+        with zipfile.ZipFile(file, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_:
+            with _zip_csv(zip_, "nodes.csv") as writer:
+                writer.writerow(NODE_COLUMNS)
+                for node in nodes:
+                    attr = self._graph.nodes[node]
+                    writer.writerow(
+                        (
+                            node,
+                            attr["label"],
+                            attr["lemmas"],
+                            attr["weight"],
+                            " | ".join(str(elem) for elem in attr["feat_type"]),
+                            " | ".join(attr["description"]),
+                        )
+                    )
+            with _zip_csv(zip_, "edges.csv") as writer:
+                writer.writerow(EDGE_COLUMNS)
+                for source, target, attr in self._graph.edges(data=True):
+                    writer.writerow(
+                        (
+                            rows[source],
+                            rows[target],
+                            attr["label"],
+                            attr["lemmas"],
+                            attr["deprel"],
+                            attr["weight"],
+                            " | ".join(str(elem) for elem in attr["feat_type"]),
+                            " | ".join(attr["description"]),
+                        )
+                    )
+            # float32 doesn't compress, it's stored as is
+            vectors_info = zipfile.ZipInfo("vectors.npy")
+            vectors_info.compress_type = zipfile.ZIP_STORED
+            with zip_.open(vectors_info, mode="w") as vectors_file:
+                np.save(vectors_file, vectors)
+        profiling.count("nodes", len(nodes))
+        profiling.count("edges", self.edges_number)
+
     def _find_nodes_to_remove(self, n_nodes_to_leave):
         all_nodes = sorted(
             set(self._graph.nodes),
@@ -970,8 +1575,12 @@ class RelGraph:
                 out_edges = list(self._graph.out_edges(node, keys=True))
                 for pred, _, key_pred in in_edges:
                     for _, succ, key_succ in out_edges:
+                        # joining a loop only adds to edges removed with the
+                        # node, but their weights are read by the next joins
                         if (
-                            self._graph[node][succ][key_succ]["label"]
+                            pred == node
+                            or succ == node
+                            or self._graph[node][succ][key_succ]["label"]
                             != self._graph[pred][node][key_pred]["label"]
                         ):
                             continue
@@ -1009,6 +1618,8 @@ class RelGraph:
             else:
                 new_attr["viz"] = {"color": {"b": 255, "g": 0, "r": 0}}
             new_attr["node_type"] = "relation"
+            # the weight sizes the node, the relation's own one is kept apart
+            new_attr["relation_weight"] = attr["weight"]
             new_attr["weight"] = min(
                 self._graph.nodes[source]["weight"], self._graph.nodes[target]["weight"]
             )
@@ -1069,41 +1680,438 @@ class TextReltuples:
         stopwords,
         additional_relations,
         entities_limit,
+        checkpointer=None,
+        profiler=None,
+        progress=None,
+        sentence_weights=None,
+        entity_prefilter=None,
+        keep_state=False,
     ):
-        sentences = udpipe_model.read(conllu, "conllu")
         self._reltuples: Sequence[SentenceReltuples] = []
         self._dict = {}
         self._graph = RelGraph()
-        for s in sentences:
-            sentence_reltuples = SentenceReltuples(
-                s,
+        # state of incremental updates, see update
+        self._merged_graph = None
+        self._sentence_weights = None
+        self._cluster_labels = None
+        self._medoid_clusters = None
+        self._medoids = None
+        self._medoid_distance = None
+        self._assigned_distance = 0.0
+        self._assigned_number = 0
+        self._profiler = profiler if profiler is not None else profiling.Profiler()
+        with self._profiler.activate():
+            self._build(
+                conllu,
+                udpipe_model,
                 w2v_model,
-                additional_relations=additional_relations,
-                stopwords=stopwords,
+                stopwords,
+                additional_relations,
+                entities_limit,
+                checkpointer,
+                progress or _ignore_progress,
+                sentence_weights,
+                entity_prefilter,
+                keep_state,
             )
-            self._reltuples.append(sentence_reltuples)
-        cluster_labels = self._cluster(
-            min_cluster_size=MIN_CLUSTER_SIZE, max_cluster_size=MIN_CLUSTER_SIZE + 50,
+
+    @classmethod
+    def load_state(cls, path, entities_limit, profiler=None):
+        """Load the state `save_state` saved, to `update` it.
+
+        The graph is filtered by `entities_limit` the first time it's read
+        unless `update` filters it before.
+        """
+        with open(path, mode="rb") as file:
+            state = pickle.load(file)
+        text_reltuples = cls.__new__(cls)
+        text_reltuples._dict = {}
+        text_reltuples._profiler = (
+            profiler if profiler is not None else profiling.Profiler()
         )
-        for sentence_reltuples, cluster in zip(self._reltuples, cluster_labels):
-            self._graph.add_sentence_reltuples(sentence_reltuples, cluster=cluster)
-            self._dict[sentence_reltuples.sentence.getText()] = [
-                (reltuple.left_arg, reltuple.relation, reltuple.right_arg)
-                for reltuple in sentence_reltuples
-            ]
-        self._graph.merge_relations()
-        self._graph.filter_nodes(entities_limit)
+        for name, value in state.items():
+            setattr(text_reltuples, "_{}".format(name), value)
+        text_reltuples._fill_dict()
+        text_reltuples._graph = None
+        text_reltuples._entities_limit = entities_limit
+        return text_reltuples
+
+    def save_state(self, path):
+        """Save everything `update` needs, the graph is saved unfiltered."""
+        self._check_state()
+        state = {name: getattr(self, "_{}".format(name)) for name in STATE_ATTRIBUTES}
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, mode="wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @property
+    def drift(self):
+        """Relative growth of the distance of sentences to their medoids.
+
+        It's the mean cosine distance of the sentences assigned to clusters by
+        `update` to their medoids compared to the one of the clustered
+        sentences.
+        """
+        if not self._assigned_number or not self._medoid_distance:
+            return 0.0
+        mean_distance = self._assigned_distance / self._assigned_number
+        return mean_distance / self._medoid_distance - 1
+
+    def update(
+        self,
+        conllu,
+        udpipe_model,
+        w2v_model,
+        stopwords,
+        additional_relations,
+        entities_limit,
+        sentence_weights=None,
+        drift_threshold=DRIFT_THRESHOLD,
+        progress=None,
+    ):
+        """Add the relations of the new sentences to the ones and the graph.
+
+        New sentences are assigned to the clusters of the nearest medoids and
+        only the nodes they touch are merged, so the clusters and the merges
+        of the sentences there were stay. Once `drift` exceeds
+        `drift_threshold`, all the sentences are clustered and the graph is
+        built anew. Needs the state kept with `keep_state` or `load_state`.
+
+        Until then the graph can differ from the one built anew from all the
+        sentences: the sentences aren't clustered again, nodes merged before
+        stay merged and merges are only looked for around the touched nodes.
+        """
+        self._check_state()
+        progress = progress or _ignore_progress
+        with self._profiler.activate():
+            sentences = udpipe_model.read(conllu, "conllu")
+            first_id = len(self._reltuples)
+            progress("extract", 0, len(sentences))
+            with profiling.stage("extract"):
+                self._extract(
+                    sentences,
+                    w2v_model,
+                    stopwords,
+                    additional_relations,
+                    progress,
+                    first_id=first_id,
+                )
+            new_reltuples = self._reltuples[first_id:]
+            if sentence_weights is None:
+                sentence_weights = [1] * len(new_reltuples)
+            elif len(sentence_weights) != len(new_reltuples):
+                raise ValueError(
+                    "Got {} sentence weights for {} sentences".format(
+                        len(sentence_weights), len(new_reltuples)
+                    )
+                )
+            self._sentence_weights.extend(sentence_weights)
+            self._fill_dict(new_reltuples)
+
+            progress("cluster")
+            cluster_labels = self._assign_clusters(new_reltuples)
+            self._cluster_labels.extend(cluster_labels)
+            if self.drift > drift_threshold:
+                logging.info(
+                    "Clusters drifted by {:.2f}, clustering {} sentences anew".format(
+                        self.drift, len(self._reltuples)
+                    )
+                )
+                self._set_clusters(
+                    self._cluster(
+                        min_cluster_size=MIN_CLUSTER_SIZE,
+                        max_cluster_size=MIN_CLUSTER_SIZE + 50,
+                    )
+                )
+                progress("graph", 0, len(self._reltuples))
+                self._merged_graph = RelGraph()
+                self._merged_graph.add_sentences_reltuples(
+                    _reporting_progress(
+                        zip(
+                            self._reltuples,
+                            self._cluster_labels,
+                            self._sentence_weights,
+                        ),
+                        progress,
+                        "graph",
+                    )
+                )
+                progress("merge")
+                self._merged_graph.merge_relations()
+            else:
+                progress("graph", 0, len(new_reltuples))
+                touched = self._merged_graph.extend(
+                    zip(new_reltuples, cluster_labels, sentence_weights)
+                )
+                progress("merge")
+                self._merged_graph.merge_relations(nodes=touched)
+            progress("filter")
+            self._filter(entities_limit)
 
     @property
     def graph(self):
+        if self._graph is None:
+            with self._profiler.activate():
+                self._filter(self._entities_limit)
         return self._graph
 
     @property
     def dictionary(self):
         return self._dict
 
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @property
+    def profile(self):
+        """Per-stage timings, memory and item counts of building this object."""
+        return self._profiler.report()
+
+    def sentences_relations(self):
+        """Yield relations of every distinct sentence in the dictionary order."""
+        seen_texts = set()
+        for sentence_reltuples in self._reltuples:
+            if sentence_reltuples.text in seen_texts:
+                continue
+            seen_texts.add(sentence_reltuples.text)
+            yield {
+                "id": len(seen_texts) - 1,
+                "sentence": sentence_reltuples.text,
+                "count": sentence_reltuples.multiplicity,
+                "relations": [
+                    {
+                        "left_arg": reltuple.left_arg,
+                        "left_arg_lemmas": reltuple.left_arg_lemmas,
+                        "relation": reltuple.relation,
+                        "relation_lemmas": reltuple.relation_lemmas,
+                        "right_arg": reltuple.right_arg,
+                        "right_arg_lemmas": reltuple.right_arg_lemmas,
+                    }
+                    for reltuple in sentence_reltuples
+                ],
+            }
+
     # TODO iterate over reltuples by __iter__?
 
+    def _build(
+        self,
+        conllu,
+        udpipe_model,
+        w2v_model,
+        stopwords,
+        additional_relations,
+        entities_limit,
+        checkpointer,
+        progress,
+        sentence_weights,
+        entity_prefilter,
+        keep_state,
+    ):
+        if checkpointer is None:
+            checkpointer = NullCheckpointer()
+        if checkpointer.has(STAGE_RELTUPLES):
+            self._reltuples = checkpointer.load(STAGE_RELTUPLES)
+        else:
+            sentences = udpipe_model.read(conllu, "conllu")
+            progress("extract", 0, len(sentences))
+            with profiling.stage("extract"):
+                self._extract(
+                    sentences, w2v_model, stopwords, additional_relations, progress
+                )
+            checkpointer.save(STAGE_RELTUPLES, self._reltuples)
+        self._fill_dict()
+        if sentence_weights is None:
+            sentence_weights = repeat(1)
+        elif len(sentence_weights) != len(self._reltuples):
+            raise ValueError(
+                "Got {} sentence weights for {} sentences".format(
+                    len(sentence_weights), len(self._reltuples)
+                )
+            )
+
+        cluster_labels = None
+        if checkpointer.has(STAGE_GRAPH_MERGED):
+            self._graph = checkpointer.load(STAGE_GRAPH_MERGED)
+        else:
+            if checkpointer.has(STAGE_GRAPH_PREMERGE):
+                self._graph = checkpointer.load(STAGE_GRAPH_PREMERGE)
+            else:
+                progress("cluster")
+                if checkpointer.has(STAGE_CLUSTERS):
+                    cluster_labels = checkpointer.load(STAGE_CLUSTERS)
+                else:
+                    cluster_labels = self._cluster(
+                        min_cluster_size=MIN_CLUSTER_SIZE,
+                        max_cluster_size=MIN_CLUSTER_SIZE + 50,
+                    )
+                    checkpointer.save(STAGE_CLUSTERS, cluster_labels)
+                nodes_to_keep = None
+                if entity_prefilter is not None and entities_limit < float("inf"):
+                    nodes_to_keep = self._prefilter_entities(
+                        cluster_labels,
+                        sentence_weights,
+                        int(entities_limit * entity_prefilter),
+                    )
+                progress("graph", 0, len(self._reltuples))
+                self._graph.add_sentences_reltuples(
+                    _reporting_progress(
+                        zip(self._reltuples, cluster_labels, sentence_weights),
+                        progress,
+                        "graph",
+                    ),
+                    nodes_to_keep=nodes_to_keep,
+                )
+                checkpointer.save(STAGE_GRAPH_PREMERGE, self._graph)
+            progress("merge")
+            self._graph.merge_relations()
+            checkpointer.save(STAGE_GRAPH_MERGED, self._graph)
+        if keep_state:
+            if cluster_labels is None:
+                cluster_labels = checkpointer.load(STAGE_CLUSTERS)
+            self._set_clusters(cluster_labels)
+            self._sentence_weights = (
+                [1] * len(self._reltuples)
+                if isinstance(sentence_weights, repeat)
+                else list(sentence_weights)
+            )
+            self._merged_graph = self._graph
+        progress("filter")
+        self._filter(entities_limit)
+
+    def _filter(self, entities_limit):
+        if self._merged_graph is not None:
+            self._graph = self._merged_graph.filtered(entities_limit)
+        else:
+            self._graph.filter_nodes(entities_limit)
+
+    def _check_state(self):
+        if self._merged_graph is None:
+            raise ValueError("The state for updates wasn't kept, see keep_state")
+
+    @profiling.profiled("cluster_medoids")
+    def _set_clusters(self, cluster_labels):
+        """Find the medoids of the clusters and reset the drift."""
+        vectors = self._sentence_vectors(self._reltuples)
+        labels = np.array(cluster_labels)
+        self._cluster_labels = list(cluster_labels)
+        self._medoid_clusters = sorted(set(self._cluster_labels))
+        medoids = []
+        distances = []
+        for cluster in self._medoid_clusters:
+            members = vectors[labels == cluster]
+            pairwise = _cosine_distances(members, members)
+            medoid_index = pairwise.sum(axis=1).argmin()
+            medoids.append(members[medoid_index])
+            distances.append(pairwise[medoid_index])
+        self._medoids = np.array(medoids)
+        self._medoid_distance = float(np.concatenate(distances).mean())
+        self._assigned_distance = 0.0
+        self._assigned_number = 0
+
+    def _assign_clusters(self, reltuples):
+        """Clusters of the nearest medoids of the sentences."""
+        if not reltuples:
+            return []
+        distances = _cosine_distances(self._sentence_vectors(reltuples), self._medoids)
+        nearest = distances.argmin(axis=1)
+        self._assigned_distance += float(
+            distances[np.arange(len(reltuples)), nearest].sum()
+        )
+        self._assigned_number += len(reltuples)
+        profiling.count("sentences", len(reltuples))
+        return [self._medoid_clusters[i] for i in nearest]
+
+    @staticmethod
+    def _sentence_vectors(reltuples):
+        return np.array(
+            [sentence_reltuples.sentence_vector for sentence_reltuples in reltuples]
+        )
+
+    @profiling.profiled("prefilter_entities")
+    def _prefilter_entities(self, cluster_labels, sentence_weights, n_candidates):
+        """Nodes that can be among the `n_candidates` heaviest ones.
+
+        Node weights are estimated in a pass over the relations with a
+        Space-Saving sketch, so the long tail of rare arguments never gets to
+        the graph.
+        """
+        sketch = SpaceSaving(max(n_candidates, 1) * CAPACITY_FACTOR)
+        for sentence_reltuples, cluster, weight in zip(
+            self._reltuples, cluster_labels, sentence_weights
+        ):
+            for reltuple in sentence_reltuples:
+                sketch.add(node_name(reltuple.left_arg_lemmas, cluster), weight)
+                sketch.add(node_name(reltuple.right_arg_lemmas, cluster), weight)
+        candidates = sketch.candidates(n_candidates)
+        FILTER_LOGGER.info(
+            "%d entities are kept for the graph, node weights are overestimated "
+            "by at most %s of the total %s",
+            len(candidates),
+            sketch.error_bound,
+            sketch.total,
+        )
+        if sketch.error_bound >= sketch.threshold(n_candidates) > 0:
+            FILTER_LOGGER.warning(
+                "Entities prefilter may drop frequent entities, the error bound %s "
+                "reaches the weight %s of the last candidate, increase the factor",
+                sketch.error_bound,
+                sketch.threshold(n_candidates),
+            )
+        profiling.count("entities", len(candidates))
+        profiling.count("error_bound", sketch.error_bound)
+        return candidates
+
+    def _extract(
+        self,
+        sentences,
+        w2v_model,
+        stopwords,
+        additional_relations,
+        progress,
+        first_id=0,
+    ):
+        """Extract relations from every distinct sentence once.
+
+        Copies of a sentence share its SentenceReltuples, which counts them
+        in `multiplicity`. The copies stay in their places in `_reltuples`,
+        so clustering and the graph are the same as if every copy was
+        extracted on its own.
+        """
+        extracted = {}
+        stopwords = set(stopwords)
+        for i in range(1, len(sentences) + 1):
+            s = sentences[i - 1]
+            # release the parsed sentence as soon as it's extracted
+            sentences[i - 1] = None
+            key = _sentence_key(s)
+            sentence_reltuples = extracted.get(key)
+            if sentence_reltuples is None:
+                sentence_reltuples = SentenceReltuples(
+                    s,
+                    w2v_model,
+                    additional_relations=additional_relations,
+                    stopwords=stopwords,
+                    sentence_id=first_id + i - 1,
+                )
+                extracted[key] = sentence_reltuples
+            else:
+                sentence_reltuples.multiplicity += 1
+                profiling.count("duplicate_sentences")
+            self._reltuples.append(sentence_reltuples)
+            if i % PROGRESS_STEP == 0:
+                progress("extract", i)
+        profiling.count("sentences", len(sentences))
+
+    def _fill_dict(self, reltuples=None):
+        for sentence_reltuples in self._reltuples if reltuples is None else reltuples:
+            self._dict[sentence_reltuples.text] = [
+                (reltuple.left_arg, reltuple.relation, reltuple.right_arg)
+                for reltuple in sentence_reltuples
+            ]
+
+    @profiling.profiled("_cluster")
     def _cluster(
         self, min_cluster_size=10, max_cluster_size=100, cluster_size_step=10
     ) -> List[int]:
@@ -1115,6 +2123,7 @@ class TextReltuples:
         )
         max_sil_score = -1
         n_sentences = len(self._reltuples)
+        profiling.count("sentences", n_sentences)
         res_labels = np.zeros(n_sentences)
         for cluster_size in range(
             min_cluster_size, max_cluster_size, cluster_size_step
@@ -1133,6 +2142,65 @@ class TextReltuples:
         return res_labels.tolist()
 
 
+def _cosine_distances(vectors1, vectors2):
+    # vectors of sentences without known words are zero, they are far from all
+    return np.nan_to_num(distance.cdist(vectors1, vectors2, "cosine"), nan=1.0)
+
+
+@contextmanager
+def _zip_csv(zip_, name):
+    with zip_.open(name, mode="w") as binary_file:
+        text_file = io.TextIOWrapper(binary_file, encoding="utf-8", newline="")
+        yield csv.writer(text_file)
+        text_file.flush()
+        text_file.detach()
+
+
+def node_name(lemmas, cluster):
+    """Name of the node of the argument with these lemmas in the cluster."""
+    return "{} + {}".format(lemmas, str({cluster}))
+
+
+def _ignore_progress(stage, done=None, total=None):
+    pass
+
+
+def _reporting_progress(items, progress, stage):
+    for i, item in enumerate(items, start=1):
+        yield item
+        if i % PROGRESS_STEP == 0:
+            progress(stage, i)
+
+
+def _unique_words_ids_tuples(words_ids_tuples):
+    seen = set()
+    result = []
+    for left_arg, relation, right_arg in words_ids_tuples:
+        key = (tuple(left_arg), relation, tuple(right_arg))
+        if key not in seen:
+            seen.add(key)
+            result.append((left_arg, relation, right_arg))
+    return result
+
+
+def _sentence_key(sentence):
+    """Digest of the sentence that is the same for identically parsed copies.
+
+    The text is a part of it, since copies share the text shown in the
+    descriptions and it can differ by spacing alone.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(sentence.getText().encode("utf-8"))
+    digest.update(b"\n")
+    for word in sentence.words[1:]:
+        digest.update(
+            "{}\t{}\t{}\t{}\t{}\t{}\n".format(
+                word.form, word.lemma, word.upostag, word.feats, word.head, word.deprel
+            ).encode("utf-8")
+        )
+    return digest.digest()
+
+
 def _get_phrase_vector(sentence, words_ids, w2v_model) -> np.ndarray:
     if words_ids == "all":
         words_ids = range(len(sentence.words))
@@ -1165,23 +2233,103 @@ def build_dir_graph(
     additional_relations: bool,
     entities_limit: int,
     w2v_model,
+    work_dir: Path = None,
+    resume: bool = False,
+    profile: bool = False,
+    near_duplicates: str = None,
+    near_duplicates_threshold: float = 0.8,
+    entity_prefilter: float = None,
+    state_path: Path = None,
+    export_formats: Sequence[str] = DEFAULT_EXPORT_FORMATS,
+    gexf_vectors: str = "full",
 ):
+    profiler = profiling.Profiler(trace_memory=profile)
     conllu = ""
-    for path in tqdm(conllu_dir.glob("*.conllu")):
+    sentence_weights = None
+    if near_duplicates is not None:
+        duplicates_filter = NearDuplicateFilter(threshold=near_duplicates_threshold)
+        documents = []
+    for path in tqdm(sorted(conllu_dir.glob("*.conllu"))):
         with path.open("r", encoding="utf8") as conllu_file:
-            conllu = "{}\n{}".format(conllu, conllu_file.read())
-
-    text_reltuples = TextReltuples(
-        conllu, udpipe_model, w2v_model, stopwords, additional_relations, entities_limit
-    )
+            document = conllu_file.read()
+        if near_duplicates is not None:
+            original = duplicates_filter.add(path.name, conllu_text(document))
+            if original is not None:
+                logging.info("{} is a near-duplicate of {}".format(path, original))
+                continue
+            documents.append((path.name, document))
+        conllu = "{}\n{}".format(conllu, document)
+    if near_duplicates == WEIGHT:
+        sentence_weights = documents_sentence_weights(
+            documents, duplicates_filter.multiplicity
+        )
 
-    json_path = save_dir / "relations_{}.json".format(conllu_dir.name)
-    with json_path.open("w", encoding="utf8") as json_file:
-        json.dump(text_reltuples.dictionary, json_file, ensure_ascii=False, indent=4)
+    if state_path is not None and state_path.exists():
+        text_reltuples = TextReltuples.load_state(
+            state_path, entities_limit, profiler=profiler
+        )
+        text_reltuples.update(
+            conllu,
+            udpipe_model,
+            w2v_model,
+            stopwords,
+            additional_relations,
+            entities_limit,
+            sentence_weights=sentence_weights,
+        )
+    else:
+        checkpointer = None
+        if work_dir is not None:
+            input_hash = hash_inputs(
+                conllu,
+                additional_relations,
+                sorted(stopwords),
+                sentence_weights,
+                entity_prefilter,
+                # the prefilter keeps a number of entities depending on it
+                None if entity_prefilter is None else entities_limit,
+            )
+            checkpointer = Checkpointer(work_dir, input_hash, resume=resume)
+
+        text_reltuples = TextReltuples(
+            conllu,
+            udpipe_model,
+            w2v_model,
+            stopwords,
+            additional_relations,
+            entities_limit,
+            checkpointer=checkpointer,
+            profiler=profiler,
+            sentence_weights=sentence_weights,
+            entity_prefilter=entity_prefilter,
+            keep_state=state_path is not None,
+        )
+    if state_path is not None:
+        text_reltuples.save_state(state_path)
+
+    if "json" in export_formats:
+        json_path = save_dir / "relations_{}.json".format(conllu_dir.name)
+        with json_path.open("w", encoding="utf8") as json_file:
+            json.dump(
+                text_reltuples.dictionary, json_file, ensure_ascii=False, indent=4
+            )
+    if "jsonl" in export_formats:
+        write_relations(
+            save_dir / "relations_{}.jsonl".format(conllu_dir.name),
+            text_reltuples.sentences_relations(),
+        )
 
-    graph_path = save_dir / "graph_{}.gexf".format(conllu_dir.name)
-    text_reltuples.graph.save(graph_path)
+    with profiler.activate():
+        # before GEXF, saving it changes the graph
+        if "tables" in export_formats:
+            tables_path = save_dir / "graph_{}.zip".format(conllu_dir.name)
+            text_reltuples.graph.save_tables(tables_path)
+        if "gexf" in export_formats:
+            graph_path = save_dir / "graph_{}.gexf".format(conllu_dir.name)
+            text_reltuples.graph.save(graph_path, vectors=gexf_vectors)
     print(text_reltuples.graph.nodes_number, text_reltuples.graph.edges_number)
+    if profile:
+        print(profiler.format_report())
 
 
 if __name__ == "__main__":
@@ -1205,10 +2353,94 @@ if __name__ == "__main__":
         help="Filter extracted relations to only contain this many entities",
         type=int,
     )
+    parser.add_argument(
+        "--work-dir",
+        help="Directory to keep checkpoints of the pipeline stages in "
+        "(default: <save_dir>/work_<conllu_dir name>)",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Skip the stages completed by a previous run on the same input",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Print time, memory and item counts of every pipeline stage",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--trace-level",
+        help="Log level of a subsystem ({}), e.g. merge=OFF".format(
+            ", ".join(tracing.SUBSYSTEMS)
+        ),
+        action="append",
+        metavar="SUBSYSTEM=LEVEL",
+    )
+    parser.add_argument(
+        "--trace-sample",
+        help="Share of a subsystem's records below WARNING to log, e.g. "
+        "extraction=0.01",
+        action="append",
+        metavar="SUBSYSTEM=RATE",
+    )
+    parser.add_argument(
+        "--merge-trace", help="Write merge traces to this file as JSON lines"
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        help="Drop near-duplicate documents or keep one copy weighted by the "
+        "number of copies",
+        choices=POLICIES,
+    )
+    parser.add_argument(
+        "--near-duplicates-threshold",
+        help="Estimated Jaccard similarity of near-duplicates (default: 0.8)",
+        type=float,
+        default=0.8,
+    )
+    parser.add_argument(
+        "--entity-prefilter",
+        help="Skip the relations of the arguments that can't be among this many "
+        "times --entities-limit most frequent ones, estimated while building "
+        "the graph",
+        type=float,
+        metavar="FACTOR",
+    )
+    parser.add_argument(
+        "--state",
+        help="File to keep the state of the graph in. If it exists, the documents "
+        "are added to the graph of the state incrementally",
+    )
+    parser.add_argument(
+        "--parser-socket",
+        help="Parse texts with the UDPipe service listening on this Unix socket "
+        "instead of loading the model",
+    )
+    parser.add_argument(
+        "--export",
+        help="Output format, may be repeated: GEXF graph, indented JSON of the "
+        "relations, JSON Lines of the relations of every sentence or zip of node "
+        "and edge CSV tables with float32 vectors (default: gexf and json)",
+        choices=EXPORT_FORMATS,
+        action="append",
+    )
+    parser.add_argument(
+        "--gexf-vectors",
+        help="Write node vectors to GEXF as they are, rounded or not at all "
+        "(default: full)",
+        choices=GEXF_VECTORS,
+        default="full",
+    )
     args = parser.parse_args()
+    tracing.configure(
+        levels=tracing.parse_specs(args.trace_level),
+        sample_rates=tracing.parse_specs(args.trace_sample, value_type=float),
+        merge_trace_path=args.merge_trace,
+    )
     conllu_dir = Path(args.conllu_dir)
     save_dir = Path(args.save_dir)
-    udpipe_model = UDPipeModel(args.model_path)
+    work_dir = Path(args.work_dir or save_dir / "work_{}".format(conllu_dir.name))
+    udpipe_model = load_udpipe(args.model_path, args.parser_socket)
     entities_limit = args.entities_limit or float("inf")
     with open("stopwords.txt", mode="r", encoding="utf-8") as file:
         stopwords = list(file.read().split())
@@ -1222,4 +2454,13 @@ if __name__ == "__main__":
         args.add,
         entities_limit,
         w2v_model,
+        work_dir=work_dir,
+        resume=args.resume,
+        profile=args.profile,
+        near_duplicates=args.near_duplicates,
+        near_duplicates_threshold=args.near_duplicates_threshold,
+        entity_prefilter=args.entity_prefilter,
+        state_path=Path(args.state) if args.state else None,
+        export_formats=args.export or DEFAULT_EXPORT_FORMATS,
+        gexf_vectors=args.gexf_vectors,
     )
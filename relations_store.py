@@ -0,0 +1,71 @@
+"""JSON Lines storage of extracted relations with cursor-based reading.
+
+Every line holds the relations of one sentence. A cursor is the byte offset
+of the line to continue reading from, so any page is read without scanning
+the lines before it. Cursors given by clients should be checked with
+`is_line_start`.
+"""
+import json
+
+
+def write_relations(path, records):
+    with open(path, mode="w", encoding="utf-8") as file:
+        dump_relations(records, file)
+
+
+def dump_relations(records, file):
+    for record in records:
+        file.write(json.dumps(record, ensure_ascii=False))
+        file.write("\n")
+
+
+def matches_lemma(record, lemma):
+    """Check whether an argument of any relation in the record is `lemma`."""
+    lemma = lemma.lower().strip()
+    for relation in record["relations"]:
+        for arg_lemmas in (relation["left_arg_lemmas"], relation["right_arg_lemmas"]):
+            if arg_lemmas == lemma or lemma in arg_lemmas.split():
+                return True
+    return False
+
+
+def is_line_start(path, cursor):
+    """Check whether the cursor is the offset of a line or the end of the file."""
+    if cursor == 0:
+        return True
+    with open(path, mode="rb") as file:
+        if cursor < 0 or cursor > file.seek(0, 2):
+            return False
+        file.seek(cursor - 1)
+        return file.read(1) == b"\n"
+
+
+def iter_lines(path, cursor=0, lemma=None):
+    """Yield (line, next_cursor) of the records from the cursor on.
+
+    If `lemma` is given, only the records mentioning it are yielded.
+    """
+    with open(path, mode="rb") as file:
+        file.seek(cursor)
+        for line in iter(file.readline, b""):
+            cursor += len(line)
+            if lemma is not None and not matches_lemma(json.loads(line), lemma):
+                continue
+            yield line, cursor
+
+
+def read_page(path, cursor=0, limit=100, lemma=None):
+    """Return up to `limit` records from the cursor on and the next cursor.
+
+    The next cursor is None when there are no more records.
+    """
+    records = []
+    next_cursor = None
+    for line, line_end in iter_lines(path, cursor=cursor, lemma=lemma):
+        if len(records) == limit:
+            break
+        records.append(json.loads(line))
+        next_cursor = line_end
+    else:
+        next_cursor = None
+    return records, next_cursor
@@ -0,0 +1,130 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class ResultCache:
+    """Index of already produced extraction artifacts by request key.
+
+    The index is kept in a JSON file. When there are more than `max_entries`
+    entries or their artifacts take more than `max_bytes`, the least recently
+    used entries are evicted together with their artifact files.
+
+    The cache may be shared by several processes, e.g. workers of a pre-fork
+    server. The index is re-read before every lookup and changed under a lock
+    on a file next to it. Lookups don't rewrite the index, they append the
+    key to a log of uses that the next `put` applies.
+    """
+
+    def __init__(self, index_path, max_entries=100, max_bytes=None):
+        self.index_path = Path(index_path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock_path = self.index_path.with_name(self.index_path.name + ".lock")
+        self._uses_path = self.index_path.with_name(self.index_path.name + ".uses")
+        # flock doesn't exclude the threads sharing a file descriptor
+        self._lock = threading.Lock()
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key):
+        entry = self._read_index().get(key)
+        if entry is None:
+            return None
+        if not all(Path(path).exists() for path in entry["paths"]):
+            logging.warning("Artifacts of cached result {} are gone".format(key))
+            with self._locked():
+                entries = self._read_index()
+                if entries.get(key, {}).get("paths") == entry["paths"]:
+                    del entries[key]
+                    self._write_index(entries)
+            return None
+        with self._uses_path.open("a", encoding="utf-8") as file:
+            file.write(json.dumps([key, time.time()], ensure_ascii=False) + "\n")
+        return entry["result"]
+
+    def put(self, key, result, paths):
+        """Remember `result` of the request `key` stored in the files `paths`."""
+        paths = [str(path) for path in paths]
+        size = sum(os.path.getsize(path) for path in paths)
+        with self._locked():
+            entries = self._read_index()
+            self._apply_uses(entries)
+            entries[key] = {
+                "result": result,
+                "paths": paths,
+                "size": size,
+                "last_used": time.time(),
+            }
+            self._evict(entries)
+            self._write_index(entries)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, self._lock_path.open("a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _apply_uses(self, entries):
+        """Move the last use times of the log of uses to the entries."""
+        applied_path = self._uses_path.with_name(
+            "{}.{}".format(self._uses_path.name, os.getpid())
+        )
+        try:
+            # lookups appending meanwhile start a new log
+            os.replace(self._uses_path, applied_path)
+        except FileNotFoundError:
+            return
+        with applied_path.open("r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    key, last_used = json.loads(line)
+                except ValueError:
+                    continue
+                if key in entries:
+                    entries[key]["last_used"] = max(
+                        entries[key]["last_used"], last_used
+                    )
+        os.remove(applied_path)
+
+    def _evict(self, entries):
+        by_last_use = sorted(entries, key=lambda key: entries[key]["last_used"])
+        total_size = sum(entry["size"] for entry in entries.values())
+        for key in by_last_use:
+            if len(entries) <= self.max_entries and (
+                self.max_bytes is None or total_size <= self.max_bytes
+            ):
+                break
+            entry = entries.pop(key)
+            total_size -= entry["size"]
+            for path in entry["paths"]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            logging.info("Evicted cached result {}".format(key))
+
+    def _read_index(self):
+        try:
+            with self.index_path.open("r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning("Result cache index {} is broken".format(self.index_path))
+            return {}
+
+    def _write_index(self, entries):
+        tmp_path = self.index_path.with_name(
+            "{}.{}.tmp".format(self.index_path.name, os.getpid())
+        )
+        with tmp_path.open("w", encoding="utf-8") as file:
+            json.dump(entries, file, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
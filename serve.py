@@ -0,0 +1,259 @@
+"""Pre-fork server of the web app.
+
+The models are loaded and warmed up once in the master process, then the
+workers are forked and share them copy-on-write (the word2vec vectors are
+shared through the page cache if they are memory-mapped, see W2V_MMAP_PATH).
+
+    python serve.py --workers 4
+
+The master restarts workers that died, replaces all of them on SIGHUP after
+they finish the requests in progress and stops on SIGTERM or SIGINT. A
+stopping worker lets its extraction jobs finish within the graceful timeout
+and marks the rest failed, as the master marks the jobs of killed workers
+when it starts. Set METRICS_MULTIPROCESS_DIR for /metrics to show the metrics
+of all the workers instead of the one answering the scrape, and
+ADMISSION_STATE_PATH for the admission budgets to hold for all the workers
+together rather than for every one of them. The same preloaded app can be
+served by gunicorn instead, with app.stop_jobs called from its worker_exit
+hook:
+
+    gunicorn --preload --workers 4 --bind localhost:5000 "serve:preloaded_app()"
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+RESPAWN_DELAY = 1.0
+POLL_INTERVAL = 0.5
+# time a stopping worker leaves itself to exit before the master kills it
+EXIT_MARGIN = 1.0
+
+
+def preloaded_app():
+    """Import the app with its models and warm them up before forking."""
+    # pylint: disable=import-outside-toplevel
+    from app import JOB_QUEUE, METRICS, app, warm_up
+
+    METRICS.clear_multiprocess_dir()
+    JOB_QUEUE.fail_abandoned()
+    warm_up()
+    if hasattr(gc, "freeze"):  # python 3.7+
+        # keep the objects allocated so far out of the collections in the
+        # workers, so that collecting doesn't copy the shared memory pages
+        gc.freeze()
+    return app
+
+
+class PreforkServer:
+    """Serve `wsgi_app` with forked workers.
+
+    A worker that stops serving calls `on_exit(timeout)` with the time left of
+    the graceful timeout.
+    """
+
+    def __init__(
+        self,
+        wsgi_app,
+        host,
+        port,
+        workers=2,
+        threaded=True,
+        graceful_timeout=30,
+        on_exit=None,
+    ):
+        self.wsgi_app = wsgi_app
+        self.host = host
+        self.port = port
+        self.n_workers = workers
+        self.threaded = threaded
+        self.graceful_timeout = graceful_timeout
+        self.on_exit = on_exit
+        self._socket = None
+        self._workers = {}
+        self._stopping = False
+        self._reloading = False
+
+    def run(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(128)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        logging.info(
+            "Serving on {}:{} with {} workers".format(
+                self.host, self.port, self.n_workers
+            )
+        )
+        try:
+            self._spawn_workers()
+            while not self._stopping:
+                time.sleep(POLL_INTERVAL)
+                self._reap_workers()
+                if self._reloading:
+                    self._reloading = False
+                    self._reload()
+                elif not self._stopping:
+                    self._spawn_workers()
+        finally:
+            self._stop_workers(list(self._workers))
+            self._socket.close()
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reloading = True
+
+    def _spawn_workers(self):
+        while len(self._workers) < self.n_workers:
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker()  # never returns
+            self._workers[pid] = time.monotonic()
+            logging.info("Started worker {}".format(pid))
+
+    def _reap_workers(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self._workers.pop(pid, None)
+            if started is None:
+                continue
+            if status != 0 and not self._stopping:
+                logging.warning(
+                    "Worker {} died with status {}, restarting".format(pid, status)
+                )
+                if time.monotonic() - started < RESPAWN_DELAY:
+                    time.sleep(RESPAWN_DELAY)  # don't spin on a crashing worker
+
+    def _reload(self):
+        """Replace the workers with new ones without dropping requests.
+
+        The new workers start accepting connections before the old ones stop
+        accepting them and finish the requests in progress.
+        """
+        old_workers = list(self._workers)
+        self._workers.clear()
+        self._spawn_workers()
+        self._stop_workers(old_workers)
+        logging.info("Replaced workers {}".format(old_workers))
+
+    def _stop_workers(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                continue
+        deadline = time.monotonic() + self.graceful_timeout
+        pids = set(pids)
+        while pids and time.monotonic() < deadline:
+            for pid in list(pids):
+                try:
+                    exited = os.waitpid(pid, os.WNOHANG)[0] != 0
+                except ChildProcessError:
+                    exited = True
+                if exited:
+                    pids.discard(pid)
+                    self._workers.pop(pid, None)
+            time.sleep(0.1)
+        for pid in pids:
+            logging.warning("Worker {} didn't stop in time, killing".format(pid))
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._workers.pop(pid, None)
+
+    def _run_worker(self):
+        exit_code = 0
+        stop_requested = None
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master handles it
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            server = make_server(
+                self.host,
+                self.port,
+                self.wsgi_app,
+                threaded=self.threaded,
+                fd=self._socket.fileno(),
+            )
+            # wait for the requests in progress when closing
+            server.daemon_threads = False
+            server.block_on_close = True
+
+            def shutdown(signum, frame):
+                nonlocal stop_requested
+                stop_requested = time.monotonic()
+                threading.Thread(target=server.shutdown, daemon=True).start()
+
+            signal.signal(signal.SIGTERM, shutdown)
+            server.serve_forever()
+            server.server_close()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Worker {} failed".format(os.getpid()))
+            exit_code = 1
+        finally:
+            try:
+                if self.on_exit is not None:
+                    self.on_exit(self._exit_timeout(stop_requested))
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Worker {} failed to exit".format(os.getpid()))
+                exit_code = 1
+            finally:
+                logging.shutdown()
+                os._exit(exit_code)  # pylint: disable=protected-access
+
+    def _exit_timeout(self, stop_requested):
+        """Time left of the graceful timeout since the worker was told to stop."""
+        timeout = self.graceful_timeout - EXIT_MARGIN
+        if stop_requested is not None:
+            timeout -= time.monotonic() - stop_requested
+        return max(0.0, timeout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the web app with a pool of pre-forked workers"
+    )
+    parser.add_argument(
+        "--workers", help="Number of worker processes", type=int, default=2
+    )
+    parser.add_argument("--host", help="Default: HOST from the config")
+    parser.add_argument("--port", help="Default: PORT from the config", type=int)
+    parser.add_argument(
+        "--no-threads",
+        help="Process one request at a time in every worker",
+        dest="threaded",
+        action="store_false",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        help="Seconds to wait for workers to finish requests on restart",
+        type=float,
+        default=30,
+    )
+    args = parser.parse_args()
+
+    wsgi_app = preloaded_app()
+    from app import stop_jobs  # pylint: disable=wrong-import-position
+
+    PreforkServer(
+        wsgi_app,
+        args.host or wsgi_app.config["HOST"],
+        args.port or wsgi_app.config["PORT"],
+        workers=args.workers,
+        threaded=args.threaded,
+        graceful_timeout=args.graceful_timeout,
+        on_exit=stop_jobs,
+    ).run()
@@ -1,50 +1,203 @@
 import html
 import re
+from concurrent.futures import FIRST_COMPLETED, wait
 
+import profiling
 
+CLEAN_BLOCK_SIZE = 1024 * 1024
+
+
+@profiling.profiled("parse_text")
 def parse_text(text, udpipe_model, format_=None):
     text = clean_text(text, format_=format_)
     conllu = get_conllu(udpipe_model, text)
     return conllu
 
 
+def parse_documents(documents, udpipe_model, executor, max_pending=None):
+    """Parse (doc_id, text, format_) documents concurrently with the executor.
+
+    Yield (doc_id, conllu, error) in the order the documents are finished.
+    No more than `max_pending` documents are submitted at a time.
+    """
+    if max_pending is None:
+        max_pending = getattr(executor, "_max_workers", 1) * 2
+    pending = set()
+    for doc_id, text, format_ in documents:
+        pending.add(
+            executor.submit(_parse_document, doc_id, text, udpipe_model, format_)
+        )
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def document_conllu(doc_id, conllu):
+    """Mark the CoNLL-U of a document with its id in the newdoc comment."""
+    newdoc = "# newdoc id = {}\n".format(doc_id)
+    if conllu.startswith("# newdoc\n"):
+        return newdoc + conllu[len("# newdoc\n") :]
+    return newdoc + conllu
+
+
+def _parse_document(doc_id, text, udpipe_model, format_):
+    try:
+        return doc_id, parse_text(text, udpipe_model, format_=format_), None
+    except Exception as e:  # pylint: disable=broad-except
+        return doc_id, None, e
+
+
+@profiling.profiled("clean_text")
 def clean_text(text, format_=None):
-    result = ""
-    if format_ == "htm":
-        result = clean_htm(text)
-    elif format_ == "hdr":
-        result = clean_hdr(text)
-    elif format_ == "sts":
-        result = clean_sts(text)
-    else:
-        result = text
-
-    result = re.sub(r"<[^>]+>", "", result)
-    result = re.sub(r"\\n+", "\n", result)
-    result = html.unescape(result)
-    result = re.sub(r"([^.!?])(\s*\n+)", newline_repl, result)
-
+    result = _clean_format(text, format_)
+    for step, _ in CLEAN_STEPS:
+        result = step(result)
     return result
 
 
+@profiling.profiled("clean_text")
+def clean_text_file(text_file, format_=None, block_size=CLEAN_BLOCK_SIZE):
+    """Clean text read block by block from the text file object.
+
+    Gives the same result as clean_text of the whole text. Blocks are cut
+    where the format cleaning doesn't look across, and every step of the
+    cleaning after it carries the end of its input that a match could still
+    continue from over to the next block.
+    """
+    pieces = (
+        _clean_format(block, format_)
+        for block in _iter_blocks(text_file, block_size, format_)
+    )
+    for step, split in CLEAN_STEPS:
+        pieces = _stream_step(pieces, step, split)
+    return "".join(pieces)
+
+
+def _clean_format(text, format_):
+    if format_ == "htm":
+        return clean_htm(text)
+    if format_ == "hdr":
+        return clean_hdr(text)
+    if format_ == "sts":
+        return clean_sts(text)
+    return text
+
+
+def _remove_tags(text):
+    return re.sub(r"<[^>]+>", "", text)
+
+
+def _tags_split(text):
+    # a tag can start at the first "<" after the last ">"
+    start = text.find("<", text.rfind(">") + 1)
+    return len(text) if start == -1 else start
+
+
+def _replace_escaped_newlines(text):
+    return re.sub(r"\\n+", "\n", text)
+
+
+def _escaped_newlines_split(text):
+    match = re.search(r"\\n*\Z", text)
+    return len(text) if match is None else match.start()
+
+
+def _charrefs_split(text):
+    # only the reference starting at the last "&" can continue, see
+    # html._charref
+    start = text.rfind("&")
+    if start != -1 and re.fullmatch(
+        r"&(#[xX]?[0-9a-fA-F]*|[^\t\n\f <&#;]{0,32})", text[start:]
+    ):
+        return start
+    return len(text)
+
+
+def _mark_line_ends(text):
+    return re.sub(r"([^.!?])(\s*\n+)", newline_repl, text)
+
+
+def _line_ends_split(text):
+    # a line end is marked after the last non-space character
+    return max(len(text.rstrip()) - 1, 0)
+
+
+# steps of clean_text after the format cleaning with the functions giving
+# where their input can be split without changing the result
+CLEAN_STEPS = (
+    (_remove_tags, _tags_split),
+    (_replace_escaped_newlines, _escaped_newlines_split),
+    (html.unescape, _charrefs_split),
+    (_mark_line_ends, _line_ends_split),
+)
+
+
+def _stream_step(pieces, step, split):
+    carry = ""
+    for piece in pieces:
+        text = carry + piece
+        cut = split(text)
+        if cut:
+            yield step(text[:cut])
+        carry = text[cut:]
+    if carry:
+        yield step(carry)
+
+
+def _iter_blocks(text_file, block_size, format_):
+    tail = ""
+    while True:
+        chunk = text_file.read(block_size)
+        if not chunk:
+            break
+        text = tail + chunk
+        cut = _find_block_cut(text, format_)
+        if cut is None:
+            tail = text
+            continue
+        yield text[:cut]
+        tail = text[cut:]
+    if tail:
+        yield tail
+
+
+def _find_block_cut(text, format_):
+    """Position to cut the text at without changing the format cleaning."""
+    if format_ not in ("htm", "hdr", "sts"):
+        return len(text)
+    pos = len(text) - 1
+    while True:
+        pos = text.rfind("\n", 0, pos)
+        if pos == -1:
+            return None
+        if pos + 1 == len(text):
+            continue
+        # "name = value" lines of htm can have spaces before "=", numbers of
+        # sts lines are separated by any spaces
+        if format_ == "htm" and (text[pos + 1].isspace() or text[pos + 1] == "="):
+            continue
+        if format_ == "sts" and text[:pos].rstrip()[-1:].isdigit():
+            continue
+        return pos + 1
+
+
 def newline_repl(matchobj):
     return "{}. ".format(matchobj.group(1))
 
 
 def clean_sts(text):
-    result = ""
     matches = re.findall(r"(\d+\s+){6}(.+)", text)
-    for m in matches:
-        result = "{}\n{}".format(result, m[1])
-    return result
+    return "".join("\n{}".format(m[1]) for m in matches)
 
 
 def clean_hdr(text):
-    result = ""
     matches = re.findall(r"TEXT_THEMAN_ANNO=(.+)", text)
-    for m in matches:
-        result = "{}\n{}".format(result, m)
-    return result
+    return "".join("\n{}".format(m) for m in matches)
 
 
 def clean_htm(text):
@@ -53,6 +206,7 @@ def clean_htm(text):
 
 def get_conllu(udpipe_model, text):
     sentences = udpipe_model.tokenize(text)
+    profiling.count("sentences", len(sentences))
     for s in sentences:
         udpipe_model.tag(s)
         udpipe_model.parse(s)
@@ -0,0 +1,114 @@
+import multiprocessing
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionError, Cost, estimate_cost
+
+
+def _cost(memory, size=1000):
+    return Cost(bytes=size, sentences=1, memory=memory)
+
+
+def test_estimate_cost_of_text(tmp_path):
+    path = tmp_path / "text.txt"
+    path.write_bytes("Раз. Два! Три?".encode("utf-8"))
+    cost = estimate_cost([path, path])
+    assert cost.bytes == 2 * path.stat().st_size
+    assert cost.sentences == 6
+
+
+def test_estimate_cost_of_conllu(tmp_path, monkeypatch):
+    path = tmp_path / "text.conllu"
+    path.write_bytes(b"1\ta\n2\tb\n\n1\tc\n\n# text = d\n1\td\n")
+    for chunk_size in (1, 2, 3, 1024):
+        monkeypatch.setattr(admission, "SCAN_CHUNK_SIZE", chunk_size)
+        assert estimate_cost([path], is_conllu=True).sentences == 3
+
+
+def test_check_rejects_request_over_budget():
+    controller = AdmissionController(memory_budget=100)
+    controller.check(_cost(100))
+    with pytest.raises(AdmissionError) as error:
+        controller.acquire(_cost(101))
+    assert error.value.status_code == 413
+
+
+def _acquire_in_thread(controller, cost):
+    acquired = threading.Event()
+    thread = threading.Thread(
+        target=lambda: (controller.acquire(cost), acquired.set()), daemon=True
+    )
+    thread.start()
+    return acquired
+
+
+def test_concurrency_limit():
+    controller = AdmissionController(max_concurrent=1)
+    controller.acquire(_cost(1))
+    acquired = _acquire_in_thread(controller, _cost(1))
+    assert not acquired.wait(0.1)
+    controller.release(_cost(1))
+    assert acquired.wait(5)
+    assert controller.status()["running"] == 1
+
+
+def test_memory_budget():
+    controller = AdmissionController(max_concurrent=10, memory_budget=100)
+    controller.acquire(_cost(60))
+    acquired = _acquire_in_thread(controller, _cost(60))
+    assert not acquired.wait(0.1)
+    controller.acquire(_cost(40))
+    assert controller.status()["memory"] == 100
+    controller.release(_cost(60))
+    assert acquired.wait(5)
+
+
+def test_fast_lane_passes_concurrency_limit():
+    controller = AdmissionController(max_concurrent=1, fast_lane_bytes=10)
+    controller.acquire(_cost(1))
+    assert _acquire_in_thread(controller, _cost(1, size=10)).wait(5)
+
+
+def _hold(state_path, acquired, release):
+    controller = AdmissionController(max_concurrent=1, state_path=state_path)
+    controller.acquire(_cost(1))
+    acquired.set()
+    release.wait(10)
+    controller.release(_cost(1))
+
+
+def test_limits_are_shared_by_processes(tmp_path):
+    state_path = tmp_path / "admission.json"
+    context = multiprocessing.get_context("fork")
+    acquired = context.Event()
+    release = context.Event()
+    process = context.Process(target=_hold, args=(state_path, acquired, release))
+    process.start()
+    try:
+        assert acquired.wait(10)
+        controller = AdmissionController(max_concurrent=1, state_path=state_path)
+        assert controller.status()["running"] == 1
+        waiting = _acquire_in_thread(controller, _cost(1))
+        assert not waiting.wait(0.5)
+        release.set()
+        assert waiting.wait(5)
+    finally:
+        release.set()
+        process.join(10)
+
+
+def test_limits_of_dead_processes_are_released(tmp_path):
+    state_path = tmp_path / "admission.json"
+    context = multiprocessing.get_context("fork")
+    acquired = context.Event()
+    process = context.Process(
+        target=_hold, args=(state_path, acquired, context.Event())
+    )
+    process.start()
+    assert acquired.wait(10)
+    process.kill()
+    process.join(10)
+    controller = AdmissionController(max_concurrent=1, state_path=state_path)
+    assert controller.status()["running"] == 0
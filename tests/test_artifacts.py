@@ -0,0 +1,92 @@
+import gzip
+import os
+import time
+
+import pytest
+
+import artifacts
+from artifacts import ArtifactStore
+
+TEXT = "граф\n" * 1000
+
+
+def _store(tmp_path, **kwargs):
+    return ArtifactStore(
+        {"graph": tmp_path / "graphs", "conllu": tmp_path / "conllu"}, **kwargs
+    )
+
+
+def _write_text(file):
+    file.write(TEXT)
+
+
+def test_write_compressed(tmp_path):
+    store = _store(tmp_path, compression="gzip", uncompressed=["conllu"])
+    path = store.write("graph", "a.gexf", _write_text).result()
+    assert path == tmp_path / "graphs" / "a.gexf.gz"
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        assert file.read() == TEXT
+    chunks = list(store.iter_decompressed("graph", "a.gexf"))
+    assert b"".join(chunks).decode("utf-8") == TEXT
+
+    path = store.write(
+        "conllu", "a.conllu", lambda file: file.write(b"1\t\n"), binary=True
+    ).result()
+    assert path == tmp_path / "conllu" / "a.conllu"
+    assert path.read_bytes() == b"1\t\n"
+
+
+def test_zstd(tmp_path):
+    if artifacts.zstandard is None:
+        with pytest.raises(ValueError):
+            _store(tmp_path, compression="zstd")
+        return
+    store = _store(tmp_path, compression="zstd")
+    store.write("graph", "a.gexf", _write_text).result()
+    with store.open("graph", "a.gexf") as file:
+        assert file.read().decode("utf-8") == TEXT
+
+
+def test_failed_write_leaves_nothing(tmp_path):
+    store = _store(tmp_path)
+
+    def fail(file):
+        file.write("half")
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        store.write("graph", "a.gexf", fail).result()
+    assert list((tmp_path / "graphs").iterdir()) == []
+
+
+def test_unknown_type(tmp_path):
+    with pytest.raises(KeyError):
+        _store(tmp_path).path("json", "a.json")
+
+
+def _artifact(store, filename, age, size=100):
+    path = store.write(
+        "graph", filename, lambda file: file.write(b"x" * size), binary=True
+    ).result()
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_cleanup_by_age(tmp_path):
+    store = _store(tmp_path, max_age=60)
+    old = _artifact(store, "old", 120)
+    new = _artifact(store, "new", 0)
+    (tmp_path / "graphs" / "writing.tmp").write_bytes(b"x")
+    os.utime(tmp_path / "graphs" / "writing.tmp", (0, 0))
+    assert store.cleanup() == 1
+    assert not old.exists()
+    assert new.exists()
+    assert (tmp_path / "graphs" / "writing.tmp").exists()
+
+
+def test_cleanup_by_size(tmp_path):
+    store = _store(tmp_path, max_bytes=250)
+    paths = [_artifact(store, str(age), age) for age in (30, 20, 10, 0)]
+    assert store.cleanup() == 2
+    assert [path.exists() for path in paths] == [False, False, True, True]
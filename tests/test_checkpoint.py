@@ -0,0 +1,46 @@
+import json
+
+from benchmarks.stubs import ConlluReader, StubKeyedVectors
+from benchmarks.synthetic import SyntheticConfig, generate_conllu
+from checkpoint import MANIFEST_FILENAME, STAGE_RELTUPLES, Checkpointer
+from relations import build_dir_graph
+
+
+def test_old_format_checkpoint_is_a_miss(tmp_path):
+    Checkpointer(tmp_path, "input").save(STAGE_RELTUPLES, ["reltuples"])
+    assert Checkpointer(tmp_path, "input", resume=True).has(STAGE_RELTUPLES)
+
+    # manifests of the checkpoints made before the format was versioned
+    manifest_path = tmp_path / MANIFEST_FILENAME
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    del manifest["format_version"]
+    manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+    assert not Checkpointer(tmp_path, "input", resume=True).has(STAGE_RELTUPLES)
+
+
+def _build_graph(tmp_path, entities_limit):
+    build_dir_graph(
+        tmp_path / "conllu",
+        tmp_path,
+        ConlluReader(),
+        [],
+        True,
+        entities_limit,
+        StubKeyedVectors(seed=1),
+        work_dir=tmp_path / "work",
+        resume=True,
+        entity_prefilter=2.0,
+        export_formats=("json",),
+    )
+    manifest_path = tmp_path / "work" / MANIFEST_FILENAME
+    return json.loads(manifest_path.read_text(encoding="utf-8"))["input_hash"]
+
+
+def test_prefilter_checkpoint_depends_on_entities_limit(tmp_path):
+    (tmp_path / "conllu").mkdir()
+    (tmp_path / "conllu" / "text.conllu").write_text(
+        generate_conllu(30, SyntheticConfig(seed=1)), encoding="utf-8"
+    )
+    input_hash = _build_graph(tmp_path, 10)
+    assert _build_graph(tmp_path, 10) == input_hash
+    assert _build_graph(tmp_path, 20) != input_hash
@@ -0,0 +1,179 @@
+import io
+import random
+
+import numpy as np
+
+from graph_index import EntityIndex, iter_gexf, iter_json
+from relations import RelGraph, node_name
+
+# lemmas and weights of the entities
+ENTITIES = {
+    "кот": 5,
+    "черный кот": 3,
+    "пёс": 4,
+    "дом": 2,
+    "город": 1,
+    "река": 1,
+}
+# source, relation, target and weight of the relations
+RELATIONS = [
+    ("кот", "ловить", "пёс", 7),
+    ("черный кот", "_is_a_", "кот", 1),
+    ("пёс", "жить", "дом", 2),
+    ("дом", "стоять", "город", 5),
+    ("город", "стоять", "река", 3),
+]
+
+
+def _graph():
+    return RelGraph.from_attributes(
+        (
+            {
+                "lemmas": lemmas,
+                "description": "{} в тексте".format(lemmas),
+                "label": lemmas.capitalize(),
+                "weight": weight,
+                "vector": np.ones(3) * weight,
+                "feat_type": 0,
+            }
+            for lemmas, weight in ENTITIES.items()
+        ),
+        (
+            {
+                "source": node_name(source, 0),
+                "target": node_name(target, 0),
+                "label": relation,
+                "lemmas": relation,
+                "deprel": "obj",
+                "description": "{} {} {}".format(source, relation, target),
+                "weight": weight,
+            }
+            for source, relation, target, weight in RELATIONS
+        ),
+        inherit_relations=False,
+    )
+
+
+def _gexf_index(tmp_path):
+    path = tmp_path / "graph.gexf"
+    _graph().save(path)
+    with path.open("rb") as file:
+        return EntityIndex.from_gexf(file)
+
+
+def test_search_ranks_entities_by_weight(tmp_path):
+    for index in (EntityIndex.from_graph(_graph()._graph), _gexf_index(tmp_path)):
+        assert [entity["lemmas"] for entity in index.search("кот")] == [
+            "кот",
+            "черный кот",
+        ]
+        assert [entity["lemmas"] for entity in index.search("черн кот")] == []
+        assert [
+            entity["lemmas"] for entity in index.search("кот черн", prefix=True)
+        ] == ["черный кот"]
+        assert [entity["lemmas"] for entity in index.search("д", prefix=True)] == [
+            "дом"
+        ]
+
+
+def test_search_ranks_relations_by_weight(tmp_path):
+    for index in (EntityIndex.from_graph(_graph()._graph), _gexf_index(tmp_path)):
+        (entity,) = index.search("пёс")
+        assert entity["relations_number"] == 2
+        assert [
+            (relation["relation"], relation["weight"], relation["direction"])
+            for relation in entity["relations"]
+        ] == [("ловить", 7, "in"), ("жить", 2, "out")]
+
+
+def test_gexf_keeps_relation_weights(tmp_path):
+    graph_index = EntityIndex.from_graph(_graph()._graph)
+    gexf_index = _gexf_index(tmp_path)
+    assert gexf_index.entities_number == graph_index.entities_number
+    assert gexf_index.relations_number == graph_index.relations_number
+    seeds = [node_name("пёс", 0)]
+    for min_weight in (0, 3, 6):
+        assert gexf_index.ego(seeds, radius=3, min_weight=min_weight) == (
+            graph_index.ego(seeds, radius=3, min_weight=min_weight)
+        )
+
+
+def test_ego(tmp_path):
+    index = EntityIndex.from_graph(_graph()._graph)
+    seeds = [node_name("пёс", 0)]
+    entities, relations = index.ego(seeds, radius=1)
+    assert [entity["lemmas"] for entity in entities] == ["пёс", "кот", "дом"]
+    assert {relation["relation"] for relation in relations} == {"ловить", "жить"}
+    entities, _ = index.ego(seeds, radius=2, min_weight=3)
+    assert [entity["lemmas"] for entity in entities] == ["пёс", "кот"]
+    entities, _ = index.ego(seeds, radius=5, max_nodes=3)
+    assert [entity["lemmas"] for entity in entities] == ["пёс", "кот", "дом"]
+
+
+def test_ego_gexf_is_indexed_again(tmp_path):
+    index = EntityIndex.from_graph(_graph()._graph)
+    entities, relations = index.ego([node_name("дом", 0)], radius=2)
+    ego_index = EntityIndex.from_gexf(
+        io.BytesIO("".join(iter_gexf(entities, relations)).encode("utf-8"))
+    )
+    assert ego_index.ego([node_name("дом", 0)], radius=2) == (entities, relations)
+    assert '"relations": [' in "".join(iter_json(entities, relations))
+
+
+def _random_graph(seed):
+    rng = random.Random(seed)
+    lemmas = ["слово{}".format(i) for i in range(30)]
+    return RelGraph.from_attributes(
+        (
+            {
+                "lemmas": lemma,
+                "description": lemma,
+                "label": lemma,
+                # few weights, so that there are ties
+                "weight": rng.randint(1, 3),
+                "vector": None,
+                "feat_type": 0,
+            }
+            for lemma in lemmas
+        ),
+        (
+            {
+                "source": node_name(rng.choice(lemmas), 0),
+                "target": node_name(rng.choice(lemmas), 0),
+                "label": "связь{}".format(i),
+                "lemmas": "связь{}".format(i),
+                "deprel": "obj",
+                "description": "",
+                "weight": rng.randint(1, 3),
+            }
+            for i in range(60)
+        ),
+        inherit_relations=False,
+    )
+
+
+def test_ego_subgraph_is_index_ego():
+    for seed in range(20):
+        graph = _random_graph(seed)
+        index = EntityIndex.from_graph(graph._graph)
+        seeds = [node_name("слово{}".format(seed), 0)]
+        for radius, min_weight, max_nodes in [(1, 0, None), (3, 2, None), (5, 0, 7)]:
+            subgraph = graph.ego_subgraph(
+                seeds, radius=radius, min_weight=min_weight, max_nodes=max_nodes
+            )
+            entities, relations = index.ego(
+                seeds, radius=radius, min_weight=min_weight, max_nodes=max_nodes
+            )
+            assert set(subgraph._graph) == {entity["id"] for entity in entities}
+            assert sorted(
+                (source, attr["label"], target, attr["weight"])
+                for source, target, attr in subgraph._graph.edges(data=True)
+            ) == sorted(
+                (
+                    relation["source"],
+                    relation["relation"],
+                    relation["target"],
+                    relation["weight"],
+                )
+                for relation in relations
+            )
@@ -0,0 +1,55 @@
+import random
+from collections import Counter
+
+import pytest
+
+from heavy_hitters import SpaceSaving
+
+
+def _stream(seed, n_items=5000):
+    rng = random.Random(seed)
+    # few frequent items and a long tail of rare ones
+    return [
+        ("item{}".format(int(rng.paretovariate(1.2))), rng.randint(1, 3))
+        for _ in range(n_items)
+    ]
+
+
+def test_counts_are_exact_below_capacity():
+    sketch = SpaceSaving(10)
+    for item, weight in [("a", 1), ("b", 2), ("a", 3)]:
+        sketch.add(item, weight)
+    assert sketch.estimate("a") == (4, 4)
+    assert sketch.estimate("b") == (2, 2)
+    assert sketch.estimate("c") == (0, 0)
+    assert sketch.error_bound == 0
+    assert sketch.candidates(1) == {"a"}
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        SpaceSaving(0)
+
+
+def test_bounds():
+    for seed in range(5):
+        stream = _stream(seed)
+        counts = Counter()
+        sketch = SpaceSaving(20)
+        for item, weight in stream:
+            counts[item] += weight
+            sketch.add(item, weight)
+        assert len(sketch) == 20
+        assert sketch.total == sum(counts.values())
+        assert sketch.error_bound <= sketch.total / sketch.capacity
+        for item, count in counts.items():
+            upper, lower = sketch.estimate(item)
+            assert lower <= count <= upper
+            if item not in sketch:
+                assert count <= sketch.error_bound
+        for n in (1, 3, 5):
+            top = {item for item, _ in counts.most_common(n)}
+            # no item that isn't monitored can be among the top ones
+            assert sketch.error_bound < sketch.threshold(n)
+            assert top <= sketch.candidates(n)
+        assert len(sketch._heap) <= 4 * sketch.capacity + 1
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, STOPPED_ERROR, Job, JobQueue
+
+STAGES = ["parse", "graph"]
+
+
+def test_stop_lets_submitted_jobs_finish():
+    def handler(job):
+        time.sleep(0.01)
+        return job.payload
+
+    job_queue = JobQueue(handler, STAGES)
+    jobs = [job_queue.submit(i) for i in range(5)]
+    assert job_queue.stop(timeout=10) == []
+    assert [job.status for job in jobs] == [DONE] * 5
+    assert [job.result for job in jobs] == list(range(5))
+
+
+def test_stop_fails_unfinished_jobs(tmp_path):
+    release = threading.Event()
+    job_queue = JobQueue(lambda job: release.wait(), STAGES, state_dir=tmp_path)
+    running = job_queue.submit("running")
+    queued = job_queue.submit("queued")
+    try:
+        assert job_queue.stop(timeout=0.1) == [running, queued]
+        for job in (running, queued):
+            assert job.status == FAILED
+            assert job.error == STOPPED_ERROR
+            # other processes see it too
+            state_path = tmp_path / "{}.json".format(job.id)
+            assert Job.from_state(state_path).status == FAILED
+    finally:
+        release.set()
+
+
+def test_fail_abandoned(tmp_path):
+    abandoned = Job("payload", STAGES, state_dir=tmp_path)
+    abandoned._save_state(force=True)
+    job_queue = JobQueue(lambda job: None, STAGES, state_dir=tmp_path)
+    assert job_queue.get(abandoned.id).status == QUEUED
+    job_queue.fail_abandoned()
+    job = job_queue.get(abandoned.id)
+    assert job.status == FAILED
+    assert job.error == STOPPED_ERROR
+
+
+def _run_order(order):
+    started = []
+    release = threading.Event()
+
+    def handler(job):
+        started.append(job.payload)
+        if job.payload == "blocking":
+            release.wait(10)
+
+    job_queue = JobQueue(handler, STAGES, order=order)
+    job_queue.submit("blocking")
+    while not started:
+        time.sleep(0.01)
+    for payload, priority in [("low", 2), ("high", 0), ("middle", 1), ("high2", 0)]:
+        job_queue.submit(payload, priority=priority)
+    release.set()
+    job_queue.stop(timeout=10)
+    return started[1:]
+
+
+def test_priority_order():
+    assert _run_order("priority") == ["high", "high2", "middle", "low"]
+    assert _run_order("fifo") == ["low", "high", "middle", "high2"]
+    with pytest.raises(ValueError):
+        JobQueue(lambda job: None, STAGES, order="random")
+
+
+def test_progress_and_failure():
+    def handler(job):
+        job.set_progress("parse", 1, 2)
+        assert job.to_dict()["stages"][0] == {
+            "stage": "parse",
+            "status": RUNNING,
+            "done": 1,
+            "total": 2,
+        }
+        job.set_progress("graph")
+        assert job.stages["parse"]["done"] == 2
+        raise ValueError("broken")
+
+    job_queue = JobQueue(handler, STAGES)
+    job = job_queue.submit("payload")
+    job_queue.stop(timeout=10)
+    assert job.status == FAILED
+    assert job.error == "broken"
+    assert job.payload is None
+
+
+def test_jobs_are_shared_by_state_dir(tmp_path):
+    job_queue = JobQueue(lambda job: job.payload * 2, STAGES, state_dir=tmp_path)
+    job = job_queue.submit(21)
+    job_queue.stop(timeout=10)
+    other = JobQueue(lambda job: None, STAGES, state_dir=tmp_path)
+    assert other.get(job.id).result == 42
+    assert other.get("../{}".format(job.id)) is None
+    assert other.get("missing") is None
+
+
+def test_history_limit(tmp_path):
+    job_queue = JobQueue(lambda job: None, STAGES, history_limit=2, state_dir=tmp_path)
+    jobs = [job_queue.add_done(i) for i in range(4)]
+    assert [job_queue.get(job.id) for job in jobs[:2]] == [None, None]
+    assert [job_queue.get(job.id).result for job in jobs[2:]] == [2, 3]
@@ -0,0 +1,117 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from metrics import Registry, StageTimer
+
+
+def _registry(multiprocess_dir=None):
+    registry = Registry(multiprocess_dir=multiprocess_dir)
+    requests = registry.counter("requests_total", "Requests", ["endpoint"])
+    sizes = registry.histogram("sizes", "Sizes", buckets=(10, 100))
+    running = registry.gauge("running", "Running jobs")
+    return registry, requests, sizes, running
+
+
+def test_render():
+    registry, requests, sizes, running = _registry()
+    requests.inc(endpoint="/")
+    requests.inc(2, endpoint="/")
+    sizes.observe(5)
+    sizes.observe(50)
+    sizes.observe(500)
+    running.set(3)
+    lines = registry.render().splitlines()
+    assert 'requests_total{endpoint="/"} 3' in lines
+    assert 'sizes_bucket{le="10"} 1' in lines
+    assert 'sizes_bucket{le="100"} 2' in lines
+    assert 'sizes_bucket{le="+Inf"} 3' in lines
+    assert "sizes_sum 555.0" in lines
+    assert "sizes_count 3" in lines
+    assert "running 3" in lines
+
+
+def test_labels_are_checked():
+    _, requests, _, _ = _registry()
+    with pytest.raises(ValueError):
+        requests.inc(method="GET")
+
+
+def test_stage_timer():
+    registry = Registry()
+    stages = registry.histogram("stages", "Stages", ["stage"])
+    timer = StageTimer(stages)
+    timer("extract", 0, 10)
+    timer("extract", 5, 10)
+    timer("merge")
+    timer.finish()
+    assert set(stages.snapshot()) == {("extract",), ("merge",)}
+    assert all(sum(counts[:-1]) == 1 for counts in stages.snapshot().values())
+
+
+def _work(multiprocess_dir, n_requests, done, exit_):
+    registry, requests, sizes, running = _registry(multiprocess_dir)
+    for _ in range(n_requests):
+        requests.inc(endpoint="/")
+        sizes.observe(50)
+    running.set(n_requests)
+    registry.flush()
+    done.set()
+    exit_.wait(10)
+
+
+def test_workers_are_merged(tmp_path):
+    context = multiprocessing.get_context("fork")
+    registry, _, _, _ = _registry(tmp_path)
+    registry.clear_multiprocess_dir()
+    exit_ = context.Event()
+    workers = []
+    for n_requests in (1, 2, 3):
+        done = context.Event()
+        worker = context.Process(
+            target=_work, args=(tmp_path, n_requests, done, exit_)
+        )
+        worker.start()
+        assert done.wait(10)
+        workers.append(worker)
+    try:
+        lines = registry.render().splitlines()
+        assert 'requests_total{endpoint="/"} 6' in lines
+        assert 'sizes_bucket{le="100"} 6' in lines
+        for worker, n_requests in zip(workers, (1, 2, 3)):
+            assert 'running{{worker="{}"}} {}'.format(worker.pid, n_requests) in lines
+    finally:
+        exit_.set()
+        for worker in workers:
+            worker.join(10)
+
+    # the counters of exited workers stay, their gauges don't
+    lines = registry.render().splitlines()
+    assert 'requests_total{endpoint="/"} 6' in lines
+    assert not any(
+        'worker="{}"'.format(worker.pid) in line
+        for worker in workers
+        for line in lines
+    )
+
+
+def test_concurrent_flushes(tmp_path):
+    registry, requests, _, _ = _registry(tmp_path)
+    errors = []
+
+    def flush_many():
+        try:
+            for _ in range(200):
+                requests.inc(endpoint="/")
+                registry.flush()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=flush_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert 'requests_total{endpoint="/"} 1600' in registry.render().splitlines()
@@ -0,0 +1,41 @@
+from benchmarks.stubs import ConlluReader, StubKeyedVectors
+from benchmarks.synthetic import SyntheticConfig, generate_conllu
+from near_duplicates import (
+    NearDuplicateFilter,
+    conllu_sentences_number,
+    conllu_text,
+    sentence_weights,
+)
+from relations import TextReltuples
+
+
+def test_weighted_conllu_near_duplicates():
+    original = generate_conllu(20, SyntheticConfig(seed=1))
+    conllu_documents = [
+        original,
+        generate_conllu(15, SyntheticConfig(seed=2)),
+        # the same text with other sentence ids
+        original.replace("# sent_id = ", "# sent_id = copy-"),
+    ]
+    duplicates_filter = NearDuplicateFilter()
+    documents = []
+    for i, document in enumerate(conllu_documents):
+        if duplicates_filter.add(i, conllu_text(document)) is None:
+            documents.append((i, document))
+    assert [doc_id for doc_id, _ in documents] == [0, 1]
+
+    weights = sentence_weights(documents, duplicates_filter.multiplicity)
+    assert weights == [2] * 20 + [1] * 15
+    conllu = "".join("\n{}".format(document) for _, document in documents)
+    assert conllu_sentences_number(conllu) == len(weights)
+
+    text_reltuples = TextReltuples(
+        conllu,
+        ConlluReader(),
+        StubKeyedVectors(seed=1),
+        [],
+        True,
+        10,
+        sentence_weights=weights,
+    )
+    assert text_reltuples.graph.nodes_number > 0
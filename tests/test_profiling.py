@@ -0,0 +1,60 @@
+import threading
+
+import profiling
+from profiling import Profiler
+
+
+@profiling.profiled("work")
+def _work(n_items):
+    profiling.count("items", n_items)
+    return n_items
+
+
+def _stats(profiler):
+    return {stats["stage"]: stats for stats in profiler.report()}
+
+
+def test_nothing_is_recorded_without_profiler():
+    with profiling.stage("extract") as stats:
+        assert stats is None
+        profiling.count("items")
+    assert _work(3) == 3
+    assert profiling.active_profiler() is None
+
+
+def test_stages_and_counts():
+    profiler = Profiler()
+    with profiler.activate():
+        with profiling.stage("extract"):
+            profiling.count("sentences", 2)
+            _work(3)
+            _work(4)
+            profiling.count("sentences")
+    stats = _stats(profiler)
+    assert stats["extract"]["calls"] == 1
+    assert stats["extract"]["counts"] == {"sentences": 3}
+    assert stats["work"]["calls"] == 2
+    assert stats["work"]["counts"] == {"items": 7}
+    assert stats["extract"]["wall_time"] >= stats["work"]["wall_time"]
+    assert "extract" in profiler.format_report()
+
+
+def test_memory_peaks():
+    profiler = Profiler(trace_memory=True)
+    with profiler.activate():
+        with profiling.stage("outer"):
+            with profiling.stage("inner"):
+                data = bytearray(8 * 2 ** 20)
+                del data
+    stats = _stats(profiler)
+    assert stats["inner"]["peak_memory_delta"] >= 8 * 2 ** 20
+    assert stats["outer"]["peak_memory_delta"] >= 8 * 2 ** 20
+
+
+def test_other_threads_are_not_profiled():
+    profiler = Profiler()
+    with profiler.activate():
+        thread = threading.Thread(target=_work, args=(1,))
+        thread.start()
+        thread.join()
+    assert profiler.report() == []
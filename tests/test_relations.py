@@ -0,0 +1,208 @@
+import csv
+import io
+import json
+import re
+import zipfile
+from copy import deepcopy
+
+import numpy as np
+import pytest
+
+from benchmarks.stubs import ConlluReader, StubKeyedVectors
+from benchmarks.synthetic import SyntheticConfig, generate_conllu
+from relations import RelGraph, SentenceReltuples, TextReltuples
+
+
+def _items():
+    # a small vocabulary makes the sentences share arguments and relations
+    conllu = generate_conllu(60, SyntheticConfig(vocabulary_size=40, seed=1))
+    w2v_model = StubKeyedVectors(seed=1)
+    return [
+        (
+            SentenceReltuples(sentence, w2v_model, additional_relations=True),
+            i % 2,
+            i % 3 + 1,
+        )
+        for i, sentence in enumerate(ConlluReader().read(conllu, "conllu"))
+    ]
+
+
+def _attributes(attr):
+    attr = dict(attr)
+    # labels are joined in the order of a set
+    attr["label"] = set(attr["label"].split(" | "))
+    if attr.get("vector") is not None:
+        attr["vector"] = np.round(attr["vector"], 6).tolist()
+    return attr
+
+
+def test_bulk_graph_is_sequential_graph():
+    items = _items()
+    sequential = RelGraph()
+    for sentence_reltuples, cluster, weight in items:
+        sequential.add_sentence_reltuples(sentence_reltuples, cluster, weight)
+    bulk = RelGraph()
+    bulk.add_sentences_reltuples(items)
+
+    assert any(key == "_is_a_" for _, _, key in sequential._graph.edges(keys=True))
+    assert {
+        node: _attributes(attr) for node, attr in bulk._graph.nodes(data=True)
+    } == {
+        node: _attributes(attr) for node, attr in sequential._graph.nodes(data=True)
+    }
+    assert {
+        (source, target, key): _attributes(attr)
+        for source, target, key, attr in bulk._graph.edges(keys=True, data=True)
+    } == {
+        (source, target, key): _attributes(attr)
+        for source, target, key, attr in sequential._graph.edges(
+            keys=True, data=True
+        )
+    }
+
+
+def test_update_loaded_state(tmp_path):
+    w2v_model = StubKeyedVectors(seed=1)
+    text_reltuples = TextReltuples(
+        generate_conllu(40, SyntheticConfig(seed=1)),
+        ConlluReader(),
+        w2v_model,
+        [],
+        True,
+        15,
+        keep_state=True,
+    )
+    text_reltuples.save_state(tmp_path / "state.pickle")
+
+    loaded = TextReltuples.load_state(tmp_path / "state.pickle", 15)
+    assert loaded.graph.nodes_number == text_reltuples.graph.nodes_number
+    loaded.update(
+        generate_conllu(10, SyntheticConfig(seed=2)),
+        ConlluReader(),
+        w2v_model,
+        [],
+        True,
+        15,
+    )
+    assert 0 < loaded.graph.nodes_number <= 15
+
+
+def _state(graph):
+    return (
+        {node: _attributes(attr) for node, attr in graph._graph.nodes(data=True)},
+        {
+            (source, target, key): _attributes(attr)
+            for source, target, key, attr in graph._graph.edges(keys=True, data=True)
+        },
+    )
+
+
+def test_filtered_is_filter_nodes():
+    graph = RelGraph()
+    graph.add_sentences_reltuples(_items())
+    graph.merge_relations()
+    state = _state(graph)
+    for limit in (3, 10, 25, float("inf")):
+        filtered = deepcopy(graph)
+        filtered.filter_nodes(limit)
+        assert _state(graph.filtered(limit)) == _state(filtered)
+        assert _state(graph) == state
+
+
+def _text_reltuples(conllu, **kwargs):
+    return TextReltuples(
+        conllu,
+        ConlluReader(),
+        StubKeyedVectors(seed=1),
+        [],
+        True,
+        15,
+        keep_state=True,
+        **kwargs,
+    )
+
+
+def _update(text_reltuples, conllu, drift_threshold):
+    text_reltuples.update(
+        conllu,
+        ConlluReader(),
+        StubKeyedVectors(seed=1),
+        [],
+        True,
+        15,
+        drift_threshold=drift_threshold,
+    )
+
+
+def _total_weight(graph):
+    return sum(weight for _, weight in graph._graph.nodes(data="weight"))
+
+
+def test_update_and_rebuild():
+    conllu = generate_conllu(40, SyntheticConfig(seed=1))
+    new_conllu = generate_conllu(10, SyntheticConfig(seed=2))
+    rebuilt = _text_reltuples(conllu + new_conllu)
+
+    # past the drift threshold the graph is built anew
+    updated = _text_reltuples(conllu)
+    _update(updated, new_conllu, drift_threshold=-1)
+    assert _state(updated.graph) == _state(rebuilt.graph)
+    assert _state(updated._merged_graph) == _state(rebuilt._merged_graph)
+
+    # otherwise it can differ, but it has the same sentences in old clusters
+    updated = _text_reltuples(conllu)
+    cluster_labels = list(updated._cluster_labels)
+    _update(updated, new_conllu, drift_threshold=float("inf"))
+    assert updated._cluster_labels[: len(cluster_labels)] == cluster_labels
+    assert _total_weight(updated._merged_graph) == _total_weight(rebuilt._merged_graph)
+    assert 0 < updated.graph.nodes_number <= 15
+
+
+def _bulk_graph():
+    graph = RelGraph()
+    graph.add_sentences_reltuples(_items())
+    return graph
+
+
+def _zip_rows(zip_, name):
+    with zip_.open(name) as file:
+        return list(csv.DictReader(io.TextIOWrapper(file, encoding="utf-8")))
+
+
+def test_save_tables():
+    graph = _bulk_graph()
+    file = io.BytesIO()
+    graph.save_tables(file)
+    with zipfile.ZipFile(file) as zip_:
+        nodes = _zip_rows(zip_, "nodes.csv")
+        edges = _zip_rows(zip_, "edges.csv")
+        with zip_.open("vectors.npy") as vectors_file:
+            vectors = np.load(io.BytesIO(vectors_file.read()))
+    names = [node["name"] for node in nodes]
+    assert names == list(graph._graph)
+    assert sorted(
+        (names[int(edge["source"])], names[int(edge["target"])], edge["label"])
+        for edge in edges
+    ) == sorted(graph._graph.edges(data="label"))
+    assert vectors.dtype == np.float32
+    for row, name in enumerate(names):
+        assert np.allclose(vectors[row], graph._graph.nodes[name]["vector"], atol=1e-6)
+
+
+def _gexf_vectors(tmp_path, vectors):
+    path = tmp_path / "graph.gexf"
+    _bulk_graph().save(path, vectors=vectors)
+    return re.findall(r'for="vector" value="([^"]*)"', path.read_text("utf-8"))
+
+
+def test_save_gexf_vectors(tmp_path):
+    full = _gexf_vectors(tmp_path, "full")
+    quantized = _gexf_vectors(tmp_path, "quantized")
+    assert len(full) == len(quantized) > 0
+    for full_vector, quantized_vector in zip(full, quantized):
+        values = json.loads(quantized_vector)
+        assert all(round(value, 4) == value for value in values)
+        assert np.allclose(values, json.loads(full_vector), atol=1e-4)
+    assert _gexf_vectors(tmp_path, "none") == []
+    with pytest.raises(ValueError):
+        _gexf_vectors(tmp_path, "half")
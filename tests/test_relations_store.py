@@ -0,0 +1,50 @@
+from relations_store import is_line_start, read_page, write_relations
+
+
+def _record(i, lemma):
+    return {
+        "id": i,
+        "text": "Предложение {}".format(i),
+        "relations": [
+            {
+                "left_arg_lemmas": lemma,
+                "relation": "быть",
+                "right_arg_lemmas": "слово {}".format(i),
+            }
+        ],
+    }
+
+
+def _write(tmp_path):
+    path = tmp_path / "relations.jsonl"
+    records = [_record(i, "кот" if i % 3 == 0 else "пёс") for i in range(10)]
+    write_relations(path, records)
+    return path, records
+
+
+def test_pages_cover_all_records(tmp_path):
+    path, records = _write(tmp_path)
+    read = []
+    cursor = 0
+    while cursor is not None:
+        assert is_line_start(path, cursor)
+        page, cursor = read_page(path, cursor=cursor, limit=3)
+        read.extend(page)
+    assert read == records
+
+
+def test_pages_of_lemma(tmp_path):
+    path, records = _write(tmp_path)
+    page, cursor = read_page(path, limit=2, lemma="Кот")
+    assert [record["id"] for record in page] == [0, 3]
+    page, cursor = read_page(path, cursor=cursor, limit=2, lemma="кот")
+    assert [record["id"] for record in page] == [6, 9]
+    assert cursor is None
+
+
+def test_cursor_in_line_is_not_line_start(tmp_path):
+    path, _ = _write(tmp_path)
+    data = path.read_bytes()
+    line_starts = {0} | {i + 1 for i, byte in enumerate(data) if byte == ord("\n")}
+    for cursor in range(-1, len(data) + 2):
+        assert is_line_start(path, cursor) == (cursor in line_starts)
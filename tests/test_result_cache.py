@@ -0,0 +1,86 @@
+import multiprocessing
+
+from result_cache import ResultCache
+
+
+def _artifact(tmp_path, name):
+    path = tmp_path / name
+    path.write_text(name, encoding="utf-8")
+    return path
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(tmp_path / "results.json")
+    cache.put("key", {"graph": "a.gexf"}, [_artifact(tmp_path, "a.gexf")])
+    assert cache.get("key") == {"graph": "a.gexf"}
+    assert ResultCache(tmp_path / "results.json").get("key") == {"graph": "a.gexf"}
+    assert cache.get("other") is None
+
+
+def test_get_does_not_rewrite_index(tmp_path):
+    cache = ResultCache(tmp_path / "results.json")
+    cache.put("key", {}, [_artifact(tmp_path, "a")])
+    index_stat = (tmp_path / "results.json").stat()
+    assert cache.get("key") == {}
+    assert (tmp_path / "results.json").stat().st_mtime_ns == index_stat.st_mtime_ns
+    assert (tmp_path / "results.json").stat().st_ino == index_stat.st_ino
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "results.json", max_entries=2)
+    cache.put("a", "a", [_artifact(tmp_path, "a")])
+    cache.put("b", "b", [_artifact(tmp_path, "b")])
+    # the use of "a" is seen by another process
+    assert ResultCache(tmp_path / "results.json").get("a") == "a"
+    cache.put("c", "c", [_artifact(tmp_path, "c")])
+    assert cache.get("b") is None
+    assert not (tmp_path / "b").exists()
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+
+
+def test_evicts_by_size(tmp_path):
+    cache = ResultCache(tmp_path / "results.json", max_bytes=3)
+    cache.put("a", "a", [_artifact(tmp_path, "a"), _artifact(tmp_path, "a2")])
+    cache.put("b", "b", [_artifact(tmp_path, "b")])
+    assert cache.get("a") is None
+    assert not (tmp_path / "a").exists()
+    assert not (tmp_path / "a2").exists()
+    assert cache.get("b") == "b"
+    cache.put("c", "c", [_artifact(tmp_path, "c")])
+    assert cache.get("b") == "b"
+
+
+def test_forgets_result_with_removed_artifacts(tmp_path):
+    cache = ResultCache(tmp_path / "results.json")
+    cache.put("key", {}, [_artifact(tmp_path, "a")])
+    (tmp_path / "a").unlink()
+    assert cache.get("key") is None
+    assert "key" not in cache._read_index()
+
+
+def _put_many(index_path, tmp_path, worker, n_keys):
+    cache = ResultCache(index_path, max_entries=1000)
+    for i in range(n_keys):
+        name = "{}-{}".format(worker, i)
+        cache.put(name, name, [_artifact(tmp_path, name)])
+        cache.get(name)
+
+
+def test_workers_keep_each_others_entries(tmp_path):
+    index_path = tmp_path / "results.json"
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_put_many, args=(index_path, tmp_path, worker, 30))
+        for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+    cache = ResultCache(index_path)
+    for worker in range(4):
+        for i in range(30):
+            name = "{}-{}".format(worker, i)
+            assert cache.get(name) == name
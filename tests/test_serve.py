@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import urllib.request
+
+from serve import PreforkServer
+
+
+def _hello(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [str(os.getpid()).encode("ascii")]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def _get(port):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            with urllib.request.urlopen("http://localhost:{}/".format(port)) as reply:
+                return reply.read().decode("ascii")
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _serve(port, exits_path):
+    def on_exit(timeout):
+        with open(exits_path, mode="a", encoding="utf-8") as file:
+            file.write("{} {}\n".format(os.getpid(), timeout))
+
+    PreforkServer(
+        _hello, "localhost", port, workers=2, graceful_timeout=5, on_exit=on_exit
+    ).run()
+
+
+def test_stopped_workers_exit_cleanly(tmp_path):
+    port = _free_port()
+    exits_path = tmp_path / "exits"
+    master = multiprocessing.get_context("fork").Process(
+        target=_serve, args=(port, exits_path)
+    )
+    master.start()
+    try:
+        worker_pid = int(_get(port))
+    finally:
+        os.kill(master.pid, signal.SIGTERM)
+        master.join(10)
+    assert master.exitcode == 0
+    exits = dict(
+        line.split() for line in exits_path.read_text(encoding="utf-8").splitlines()
+    )
+    assert len(exits) == 2
+    assert str(worker_pid) in exits
+    assert all(0 < float(timeout) < 5 for timeout in exits.values())
@@ -0,0 +1,117 @@
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from syntax import clean_text, clean_text_file, document_conllu, parse_documents
+
+# pieces the texts are made of, chosen to hit matches of every cleaning step
+# at block cuts
+COMMON_PIECES = [
+    "слово",
+    "a",
+    " ",
+    "  ",
+    "\n",
+    "\n\n",
+    " \n",
+    ".",
+    "!",
+    "?",
+    "<b>",
+    "<",
+    ">",
+    "&amp;",
+    "&amp",
+    "&",
+    "&#1092;",
+    "&#x444",
+    "#",
+    ";",
+    "\\n",
+    "\\",
+    "n",
+    "1",
+    "23",
+]
+FORMAT_PIECES = {
+    None: [],
+    "hdr": ["TEXT_THEMAN_ANNO=", "\nTEXT_THEMAN_ANNO=", "OTHER=", "\n"],
+    "htm": ["\ntitle = ", "\nname", "=", " =", "\n=", "\n"],
+    "sts": ["\n1 2 3 4 5 6 ", "1 ", "\n12 ", " 3 ", "4\n", "\n"],
+}
+
+
+def random_text(rng, format_):
+    pieces = COMMON_PIECES + FORMAT_PIECES[format_] * 4
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 60)))
+
+
+@pytest.mark.parametrize("format_", [None, "hdr", "htm", "sts"])
+def test_clean_text_file_is_clean_text(format_):
+    rng = random.Random(format_)
+    for _ in range(500):
+        text = random_text(rng, format_)
+        expected = clean_text(text, format_=format_)
+        for block_size in (1, 2, 3, 5, 8, 13):
+            assert (
+                clean_text_file(
+                    io.StringIO(text), format_=format_, block_size=block_size
+                )
+                == expected
+            ), (text, block_size)
+
+
+class FakeModel:
+    """Model writing every text as a document of one "sentence"."""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def tokenize(self, text):
+        if text == "fail":
+            raise ValueError("Cannot parse")
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self._lock:
+            self.running -= 1
+        return [text]
+
+    def tag(self, sentence):
+        pass
+
+    def parse(self, sentence):
+        pass
+
+    def write(self, sentences, out_format):
+        return "# newdoc\n" + "".join(sentences)
+
+
+def test_parse_documents():
+    model = FakeModel()
+    documents = [(i, "текст {}".format(i), None) for i in range(20)]
+    documents.append(("bad", "fail", None))
+    with ThreadPoolExecutor(4) as executor:
+        results = {
+            doc_id: (conllu, error)
+            for doc_id, conllu, error in parse_documents(
+                iter(documents), model, executor, max_pending=2
+            )
+        }
+    assert model.max_running <= 2
+    conllu, error = results.pop("bad")
+    assert conllu is None
+    assert str(error) == "Cannot parse"
+    assert results == {i: ("# newdoc\nтекст {}".format(i), None) for i in range(20)}
+
+
+def test_document_conllu():
+    assert document_conllu(7, "# newdoc\n1\tслово\n") == "# newdoc id = 7\n1\tслово\n"
+    assert document_conllu(7, "1\tслово\n") == "# newdoc id = 7\n1\tслово\n"
@@ -0,0 +1,75 @@
+import json
+import logging
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def reset_loggers():
+    yield
+    tracing.configure()
+    for subsystem in tracing.SUBSYSTEMS:
+        tracing.get_logger(subsystem).setLevel(logging.NOTSET)
+
+
+def _counting():
+    calls = []
+
+    def message():
+        calls.append(1)
+        return {"event": "merge_nodes", "nodes": ["a", "b"]}
+
+    return message, calls
+
+
+def test_disabled_trace_is_not_built(caplog):
+    tracing.configure(levels={"merge": "OFF"})
+    message, calls = _counting()
+    logger = tracing.get_logger(tracing.MERGE)
+    with caplog.at_level(logging.DEBUG):
+        tracing.trace(logger, logging.CRITICAL, message)
+    assert calls == []
+    assert caplog.records == []
+
+
+def test_sampled_out_trace_is_not_built(caplog):
+    tracing.configure(levels={"merge": "DEBUG"}, sample_rates={"merge": 0.0})
+    message, calls = _counting()
+    logger = tracing.get_logger(tracing.MERGE)
+    with caplog.at_level(logging.DEBUG):
+        tracing.trace(logger, logging.INFO, message)
+        tracing.trace(logger, logging.WARNING, message)
+    assert [record.levelno for record in caplog.records] == [logging.WARNING]
+
+
+def test_merge_trace_file(tmp_path):
+    path = tmp_path / "merges.jsonl"
+    tracing.configure(levels={"merge": "INFO"}, merge_trace_path=path)
+    message, calls = _counting()
+    logger = tracing.get_logger(tracing.MERGE)
+    tracing.trace(logger, logging.INFO, message)
+    tracing.trace(logger, logging.DEBUG, message)
+    tracing.configure()
+    (line,) = path.read_text(encoding="utf-8").splitlines()
+    record = json.loads(line)
+    assert record["subsystem"] == "merge"
+    assert record["level"] == "INFO"
+    assert record["nodes"] == ["a", "b"]
+    assert len(calls) == 1
+
+
+def test_unknown_level():
+    with pytest.raises(ValueError):
+        tracing.configure(levels={"merge": "LOUD"})
+
+
+def test_parse_specs():
+    assert tracing.parse_specs(["merge=0.5", "filter=1"], float) == {
+        "merge": 0.5,
+        "filter": 1.0,
+    }
+    for spec in ("merge", "parse=DEBUG", "merge="):
+        with pytest.raises(ValueError):
+            tracing.parse_specs([spec])
@@ -0,0 +1,115 @@
+import multiprocessing
+import socketserver
+import threading
+import time
+
+import pytest
+
+import udpipe_service
+from udpipe_service import ParserService, UDPipeClient, receive_message, send_message
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    """Reply with the text of every request as its CoNLL-U."""
+
+    def handle(self):
+        while True:
+            message = receive_message(self.request)
+            if message is None:
+                return
+            send_message(self.request, {"conllu": message["text"]})
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    path = str(tmp_path / "udpipe.sock")
+    server = socketserver.ThreadingUnixStreamServer(path, EchoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def _exchange_many(client, name, n_requests):
+    for i in range(n_requests):
+        text = "{} {}".format(name, i)
+        assert client._request(text, None) == text
+
+
+def test_forked_process_uses_own_connection(socket_path):
+    client = UDPipeClient(socket_path)
+    _exchange_many(client, "parent", 1)
+    child = multiprocessing.get_context("fork").Process(
+        target=_exchange_many, args=(client, "child", 300)
+    )
+    child.start()
+    _exchange_many(client, "parent", 300)
+    child.join()
+    assert child.exitcode == 0
+
+
+class FakeModel:
+    """Model "parsing" a text into its upper case, slowly."""
+
+    def __init__(self, path):
+        self.parsed = 0
+
+    def tokenize(self, text):
+        if text == "fail":
+            raise ValueError("Cannot parse")
+        return [text]
+
+    def read(self, text, in_format):
+        return [text]
+
+    def tag(self, sentence):
+        pass
+
+    def parse(self, sentence):
+        time.sleep(0.005)
+
+    def write(self, sentences, out_format):
+        self.parsed += 1
+        return "".join(sentences).upper()
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(udpipe_service, "UDPipeModel", FakeModel)
+    service = ParserService(
+        "model.udpipe", str(tmp_path / "parser.sock"), n_models=2, claim_size=4
+    )
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while service._server is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield service
+    service.shutdown()
+    thread.join(10)
+
+
+def test_service_parses_and_reports_errors(service):
+    client = UDPipeClient(service.socket_path)
+    assert client._request("текст", None) == "ТЕКСТ"
+    with pytest.raises(Exception, match="Cannot parse"):
+        client._request("fail", None)
+    assert client._request("ещё текст", "horizontal") == "ЕЩЁ ТЕКСТ"
+
+
+def test_burst_is_parsed_by_all_models(service):
+    client = UDPipeClient(service.socket_path)
+    replies = {}
+
+    def request(i):
+        replies[i] = client._request("текст {}".format(i), None)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert replies == {i: "ТЕКСТ {}".format(i) for i in range(40)}
+    assert sum(model.parsed for model in service._models) == 40
+    assert all(model.parsed > 0 for model in service._models)
@@ -0,0 +1,126 @@
+import numpy as np
+
+from benchmarks.stubs import ConlluReader, StubKeyedVectors
+from benchmarks.synthetic import SyntheticConfig, generate_conllu
+from relations import RelGraph, SentenceReltuples
+from windowed_graph import WindowedRelGraph
+
+
+def _items(n_sentences, seed):
+    # a small vocabulary makes the sentences share arguments and relations
+    conllu = generate_conllu(
+        n_sentences, SyntheticConfig(vocabulary_size=40, seed=seed)
+    )
+    w2v_model = StubKeyedVectors(seed=1)
+    return [
+        (
+            SentenceReltuples(sentence, w2v_model, additional_relations=True),
+            i % 2,
+            i % 3 + 1,
+        )
+        for i, sentence in enumerate(ConlluReader().read(conllu, "conllu"))
+    ]
+
+
+def _add(graph, items, timestamp):
+    for sentence_reltuples, cluster, weight in items:
+        graph.add_sentence_reltuples(
+            sentence_reltuples, timestamp, cluster=cluster, weight=weight
+        )
+
+
+def _nodes(graph):
+    return {
+        node: {key: value for key, value in attr.items() if key != "vector"}
+        for node, attr in graph._graph.nodes(data=True)
+    }
+
+
+def _edges(graph):
+    return {
+        (source, target, key): attr
+        for source, target, key, attr in graph._graph.edges(keys=True, data=True)
+    }
+
+
+def _assert_same_graphs(graph, expected):
+    assert _nodes(graph) == _nodes(expected)
+    assert _edges(graph) == _edges(expected)
+    for node, vector in expected._graph.nodes(data="vector"):
+        assert np.allclose(graph._graph.nodes[node]["vector"], vector)
+
+
+def test_expired_batch_leaves_no_trace():
+    kept = _items(40, seed=1)
+    batch = _items(40, seed=2)
+    expected = WindowedRelGraph(10, None)
+    _add(expected, kept, 100)
+
+    batch_first = WindowedRelGraph(10, None)
+    _add(batch_first, batch, 0)
+    _add(batch_first, kept, 100)
+    batch_between = WindowedRelGraph(10, None)
+    _add(batch_between, kept[:20], 100)
+    _add(batch_between, batch, 0)
+    _add(batch_between, kept[20:], 100)
+    for graph in (batch_first, batch_between):
+        assert graph.expire(now=105) == len(batch)
+        assert graph.sentences_number == len(kept)
+        _assert_same_graphs(graph.graph(), expected.graph())
+
+
+def test_expiring_everything_empties_graph():
+    graph = WindowedRelGraph(10, None)
+    _add(graph, _items(40, seed=1), 0)
+    assert graph.graph().edges_number > 0
+    graph.expire(now=100)
+    assert graph.graph().nodes_number == 0
+    assert graph.graph().edges_number == 0
+
+
+def test_graph_has_inherited_relations():
+    graph = WindowedRelGraph(10, None)
+    _add(graph, _items(80, seed=1), 0)
+    expected = RelGraph.from_attributes(
+        (node.attributes() for node in graph._nodes.values()),
+        (
+            edge.attributes(source, target)
+            for (source, target, _), edge in graph._edges.items()
+        ),
+    )
+    assert any(key == "_is_a_" for _, _, key in graph._edges)
+    assert graph.graph().edges_number > len(graph._edges)
+    assert set(graph.graph()._graph.edges(keys=True)) == set(
+        expected._graph.edges(keys=True)
+    )
+
+
+def test_inherited_relation_copies_heaviest_origin():
+    graph = WindowedRelGraph(10, None)
+    _add(graph, _items(80, seed=1), 0)
+    is_a = {}
+    for source, target, key in graph._edges:
+        if key == "_is_a_":
+            is_a.setdefault(target, set()).add(source)
+
+    def predecessors(node):
+        closure, queue = {node}, [node]
+        while queue:
+            for predecessor in is_a.get(queue.pop(), ()):
+                if predecessor not in closure:
+                    closure.add(predecessor)
+                    queue.append(predecessor)
+        return closure
+
+    inherited = 0
+    for (source, target, key), attr in _edges(graph.graph()).items():
+        if (source, target, key) in graph._edges:
+            continue
+        inherited += 1
+        assert attr["weight"] == max(
+            graph._edges[(origin_source, origin_target, key)].weight
+            for origin_source in predecessors(source)
+            for origin_target in predecessors(target)
+            if (origin_source, origin_target, key) in graph._edges
+        )
+    assert inherited > 0
@@ -0,0 +1,55 @@
+import codecs
+
+from chardet.universaldetector import UniversalDetector
+
+SAMPLE_SIZE = 64 * 1024
+MAX_DETECTION_BYTES = 4 * 1024 * 1024
+
+
+def detect_encoding(binary_file):
+    """Guess whether the binary file object holds utf-8 or cp1251 text.
+
+    The file is read in chunks from its current position, which is restored
+    afterwards. Text that is valid utf-8 up to the first non-ascii chunk is
+    taken for utf-8 without running chardet. Otherwise chunks are fed to the
+    chardet incremental detector until it is confident.
+    """
+    start = binary_file.tell()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    detector = UniversalDetector()
+    bytes_read = 0
+    try:
+        while bytes_read < MAX_DETECTION_BYTES:
+            chunk = binary_file.read(SAMPLE_SIZE)
+            if not chunk:
+                break
+            bytes_read += len(chunk)
+            if utf8_decoder is not None:
+                try:
+                    utf8_decoder.decode(chunk)
+                except UnicodeDecodeError:
+                    utf8_decoder = None
+                else:
+                    if not chunk.isascii():
+                        return "utf-8"
+                    continue
+            detector.feed(chunk)
+            if detector.done:
+                break
+    finally:
+        binary_file.seek(start)
+
+    if utf8_decoder is not None:  # only ascii text so far
+        return "utf-8"
+    detector.close()
+    if detector.result["encoding"] == "utf-8":
+        return "utf-8"
+    else:
+        return "cp1251"
+
+
+def open_text(path):
+    """Open the file at `path` for reading as text in the detected encoding."""
+    with open(path, mode="rb") as binary_file:
+        encoding = detect_encoding(binary_file)
+    return open(path, mode="r", encoding=encoding, errors="replace", newline="")
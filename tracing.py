@@ -0,0 +1,135 @@
+import json
+import logging
+import random
+
+EXTRACTION = "extraction"
+MERGE = "merge"
+FILTER = "filter"
+SUBSYSTEMS = (EXTRACTION, MERGE, FILTER)
+
+OFF = logging.CRITICAL + 10
+logging.addLevelName(OFF, "OFF")
+
+LOGGER_PREFIX = "relations"
+
+
+class LazyMessage:
+    """Log message that is built only when a handler actually emits it.
+
+    `func(*args, **kwargs)` should return either a string or a JSON-serializable
+    dict.
+    """
+
+    __slots__ = ("_func", "_args", "_kwargs", "_value")
+
+    def __init__(self, func, *args, **kwargs):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._value = None
+
+    def value(self):
+        if self._value is None:
+            self._value = self._func(*self._args, **self._kwargs)
+        return self._value
+
+    def __str__(self):
+        value = self.value()
+        if isinstance(value, str):
+            return value
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class SamplingFilter(logging.Filter):
+    """Let through only about `rate` of the records below `always_level`."""
+
+    def __init__(self, rate, always_level=logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.always_level = always_level
+
+    def filter(self, record):
+        if record.levelno >= self.always_level:
+            return True
+        return random.random() < self.rate
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "time": record.created,
+            "level": record.levelname,
+            "subsystem": record.name[len(LOGGER_PREFIX) + 1 :],
+        }
+        if isinstance(record.msg, LazyMessage) and isinstance(
+            record.msg.value(), dict
+        ):
+            payload.update(record.msg.value())
+        else:
+            payload["message"] = record.getMessage()
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_logger(subsystem):
+    return logging.getLogger("{}.{}".format(LOGGER_PREFIX, subsystem))
+
+
+def trace(logger, level, func, *args, **kwargs):
+    """Log the result of `func(*args, **kwargs)` if `level` is enabled.
+
+    Nothing is computed unless the record passes the level check, the sampling
+    filter and reaches a handler.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, LazyMessage(func, *args, **kwargs))
+
+
+def configure(levels=None, sample_rates=None, merge_trace_path=None):
+    """Set per-subsystem levels and sampling rates and the merge trace file.
+
+    `levels` maps subsystem names to level names or numbers ("OFF" disables
+    the subsystem entirely), `sample_rates` maps them to the share of records
+    below WARNING to keep. If `merge_trace_path` is given, merge traces are
+    written there as JSON lines instead of the common log.
+    """
+    levels = levels or {}
+    sample_rates = sample_rates or {}
+    for subsystem in SUBSYSTEMS:
+        logger = get_logger(subsystem)
+        if subsystem in levels:
+            level = levels[subsystem]
+            if isinstance(level, str):
+                level = logging.getLevelName(level.upper())
+                if not isinstance(level, int):
+                    raise ValueError(
+                        "Unknown level for {}: {}".format(subsystem, levels[subsystem])
+                    )
+            logger.setLevel(level)
+        for filter_ in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+            logger.removeFilter(filter_)
+        rate = sample_rates.get(subsystem, 1.0)
+        if rate < 1.0:
+            logger.addFilter(SamplingFilter(rate))
+
+    merge_logger = get_logger(MERGE)
+    for handler in list(merge_logger.handlers):
+        merge_logger.removeHandler(handler)
+        handler.close()
+    if merge_trace_path is not None:
+        handler = logging.FileHandler(merge_trace_path, "a", "utf-8")
+        handler.setFormatter(JsonLinesFormatter())
+        merge_logger.addHandler(handler)
+        merge_logger.propagate = False
+    else:
+        merge_logger.propagate = True
+
+
+def parse_specs(specs, value_type=str):
+    """Parse "subsystem=value" strings, as given on the command line."""
+    res = {}
+    for spec in specs or []:
+        subsystem, _, value = spec.partition("=")
+        if subsystem not in SUBSYSTEMS or not value:
+            raise ValueError("Wrong trace specification: {}".format(spec))
+        res[subsystem] = value_type(value)
+    return res
@@ -0,0 +1,310 @@
+"""Local UDPipe parsing service and its client.
+
+The service loads a few instances of the model once and parses texts sent to
+it over a Unix socket, so that the processes parsing texts (web workers, CLI
+runs) don't have to keep a model each. Start it with
+
+    python udpipe_service.py models/russian-syntagrus-ud-2.4-190531.udpipe \\
+        --socket /tmp/udpipe.sock --models 2
+
+Messages in both directions are utf-8 JSON objects prefixed with their length
+as a 4-byte big-endian integer. A request is {"text": ..., "in_format": ...},
+where `in_format` is None to tokenize the text, and the reply is
+{"conllu": ...} with the tagged and parsed sentences or {"error": ...}.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+import ufal.udpipe
+
+from udpipe_model import UDPipeModel
+
+# pylint: disable=no-member
+
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+DEFAULT_CLAIM_SIZE = 16
+
+
+def send_message(sock, message):
+    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def receive_message(sock):
+    """Receive a message or return None if the connection is closed."""
+    header = _receive_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError("Message of {} bytes is too large".format(size))
+    data = _receive_exactly(sock, size)
+    if data is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return json.loads(data.decode("utf-8"))
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            if chunks:
+                raise ConnectionError("Connection closed in the middle of a message")
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class _ParseRequest:
+    def __init__(self, text, in_format):
+        self.text = text
+        self.in_format = in_format
+        self.reply = None
+        self.done = threading.Event()
+
+
+class ParserService:
+    """Parse texts with `n_models` instances of the model in worker threads.
+
+    Every worker claims its share of the waiting requests, but no more than
+    `claim_size`, at a time and parses them one by one, so that the queue is
+    locked less often. UDPipe has no batch call, so the requests aren't
+    parsed together. The share leaves as many requests to every idle worker,
+    so a burst of requests is parsed by all the models in parallel.
+    """
+
+    def __init__(self, model_path, socket_path, n_models=1, claim_size=None):
+        self.socket_path = socket_path
+        self.claim_size = claim_size or DEFAULT_CLAIM_SIZE
+        self._requests = queue.Queue()
+        self._idle = 0
+        self._idle_lock = threading.Lock()
+        self._models = [UDPipeModel(model_path) for _ in range(n_models)]
+        self._server = None
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        for i, model in enumerate(self._models):
+            threading.Thread(
+                target=self._work,
+                args=(model,),
+                name="parser-{}".format(i),
+                daemon=True,
+            ).start()
+
+        service = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                service._handle_connection(self.request)
+
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, Handler
+        )
+        self._server.daemon_threads = True
+        logging.info(
+            "Parsing service listens on {} with {} models".format(
+                self.socket_path, len(self._models)
+            )
+        )
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _handle_connection(self, sock):
+        while True:
+            try:
+                message = receive_message(sock)
+            except (ConnectionError, ValueError) as e:
+                logging.warning("Bad parsing request: {}".format(e))
+                return
+            if message is None:
+                return
+            request = _ParseRequest(
+                message.get("text", ""), message.get("in_format")
+            )
+            self._requests.put(request)
+            request.done.wait()
+            try:
+                send_message(sock, request.reply)
+            except OSError:
+                return
+
+    def _work(self, model):
+        while True:
+            with self._idle_lock:
+                self._idle += 1
+            request = self._requests.get()
+            with self._idle_lock:
+                self._idle -= 1
+                share = self._requests.qsize() // (self._idle + 1)
+            claimed = [request]
+            while len(claimed) < min(self.claim_size, share + 1):
+                try:
+                    claimed.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            for request in claimed:
+                try:
+                    request.reply = {
+                        "conllu": self._parse(model, request.text, request.in_format)
+                    }
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.exception("Failed to parse a text")
+                    request.reply = {"error": str(e)}
+                request.done.set()
+
+    @staticmethod
+    def _parse(model, text, in_format):
+        if in_format is None:
+            sentences = model.tokenize(text)
+        else:
+            sentences = model.read(text, in_format)
+        for sentence in sentences:
+            model.tag(sentence)
+            model.parse(sentence)
+        return model.write(sentences, "conllu")
+
+
+class UDPipeClient:
+    """UDPipeModel look-alike parsing texts with the service at `socket_path`.
+
+    The sentences are tagged and parsed by the service when they are
+    tokenized or read, so `tag` and `parse` do nothing. Every thread uses its
+    own connection to the service, and so does every forked process.
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def tokenize(self, text):
+        """Tokenize, tag and parse the text, return list of ufal.udpipe.Sentence-s."""
+        return self._read_conllu(self._request(text, None))
+
+    def read(self, text, in_format):
+        """Load text in the given format (conllu|horizontal|vertical).
+
+        Return list of tagged and parsed ufal.udpipe.Sentence-s.
+        """
+        if in_format == "conllu":
+            return self._read_conllu(text)
+        return self._read_conllu(self._request(text, in_format))
+
+    def tag(self, sentence):
+        """Do nothing, the sentences are tagged by the service."""
+
+    def parse(self, sentence):
+        """Do nothing, the sentences are parsed by the service."""
+
+    def write(self, sentences, out_format):
+        """Write ufal.udpipe.Sentence-s in the format (conllu|horizontal|vertical)."""
+        output_format = ufal.udpipe.OutputFormat.newOutputFormat(out_format)
+        output = "".join(
+            output_format.writeSentence(sentence) for sentence in sentences
+        )
+        return output + output_format.finishDocument()
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _request(self, text, in_format):
+        message = {"text": text, "in_format": in_format}
+        try:
+            reply = self._exchange(message)
+        except OSError:
+            # the service could have been restarted, reconnect once
+            self.close()
+            reply = self._exchange(message)
+        if reply is None:
+            self.close()
+            raise ConnectionError("Parsing service closed the connection")
+        if "error" in reply:
+            raise Exception(reply["error"])
+        return reply["conllu"]
+
+    def _exchange(self, message):
+        if getattr(self._local, "pid", None) != os.getpid():
+            # the connection was inherited from the parent that still uses it
+            self.close()
+            self._local.pid = os.getpid()
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        send_message(sock, message)
+        return receive_message(sock)
+
+    @staticmethod
+    def _read_conllu(conllu):
+        input_format = ufal.udpipe.InputFormat.newInputFormat("conllu")
+        input_format.setText(conllu)
+        error = ufal.udpipe.ProcessingError()
+        sentences = []
+        sentence = ufal.udpipe.Sentence()
+        while input_format.nextSentence(sentence, error):
+            sentences.append(sentence)
+            sentence = ufal.udpipe.Sentence()
+        if error.occurred():
+            raise Exception(error.message)
+        return sentences
+
+
+def load_udpipe(model_path, socket_path=None):
+    """Connect to the service at `socket_path` or load the model in process."""
+    if socket_path:
+        return UDPipeClient(socket_path)
+    return UDPipeModel(model_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve UDPipe parsing locally")
+    parser.add_argument("model_path", help="Path to the UDPipe model")
+    parser.add_argument(
+        "--socket",
+        help="Path to the Unix socket (default: /tmp/udpipe.sock)",
+        default="/tmp/udpipe.sock",
+    )
+    parser.add_argument(
+        "--models",
+        help="Number of model instances parsing in parallel (default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--claim-size",
+        help="Maximum number of requests a model claims at a time",
+        type=int,
+        default=DEFAULT_CLAIM_SIZE,
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
+    )
+    ParserService(
+        args.model_path, args.socket, n_models=args.models, claim_size=args.claim_size
+    ).serve_forever()
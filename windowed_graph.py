@@ -0,0 +1,427 @@
+"""Relation graph of the sentences of a sliding time window.
+
+Sentences are added with their timestamps and evicted once they get older
+than the window. The graph keeps counts of everything sentences contribute
+(weights, descriptions, labels, vector sums), so a sentence is evicted by
+subtracting its contribution, and nodes and edges nothing contributes to
+anymore are removed. The RelGraph `graph` returns is kept up to date the same
+way, and the inherited relations are found again only around the relations a
+sentence changes. Adding or evicting a sentence costs the same regardless of
+the window size.
+
+Unlike RelGraph, node vectors are means of the argument vectors instead of
+running averages, and an inherited relation is a copy of the heaviest relation
+it's inherited from instead of the first one found, since those depend on the
+order of the sentences. Merging and filtering can't be undone, so they are
+left to a copy of the graph.
+"""
+import argparse
+import copy
+import heapq
+import logging
+import time
+from collections import Counter
+from itertools import chain, count
+from pathlib import Path
+
+import gensim.downloader
+
+import profiling
+from relations import RelGraph, SentenceReltuples, node_name
+from udpipe_service import load_udpipe
+
+
+class _Node:
+    __slots__ = ("lemmas", "cluster", "labels", "description", "weight", "vector", "n")
+
+    def __init__(self, lemmas, cluster):
+        self.lemmas = lemmas
+        self.cluster = cluster
+        self.labels = Counter()
+        self.description = Counter()
+        self.weight = 0
+        self.vector = 0
+        # number of contributions, the node is removed when there are none
+        self.n = 0
+
+    def attributes(self):
+        return {
+            "lemmas": self.lemmas,
+            "description": set(self.description),
+            "label": " | ".join(sorted(self.labels)),
+            "weight": self.weight,
+            "vector": self.vector / self.n,
+            "feat_type": {self.cluster},
+        }
+
+
+class _Edge:
+    __slots__ = ("forms", "description", "feat_type", "weight", "n")
+
+    def __init__(self):
+        # (label, lemmas, deprel), the most frequent one in the window is shown
+        self.forms = Counter()
+        self.description = Counter()
+        self.feat_type = Counter()
+        self.weight = 0
+        self.n = 0
+
+    def attributes(self, source, target):
+        label, lemmas, deprel = min(
+            self.forms, key=lambda form: (-self.forms[form], form)
+        )
+        return {
+            "source": source,
+            "target": target,
+            "label": label,
+            "lemmas": lemmas,
+            "deprel": deprel,
+            "description": set(self.description),
+            "weight": self.weight,
+            "feat_type": set(self.feat_type),
+        }
+
+
+class WindowedRelGraph:
+    """Relation graph of the sentences of the last `window` seconds."""
+
+    def __init__(self, window, w2v_model, stopwords=(), additional_relations=False):
+        self.window = window
+        self._w2v_model = w2v_model
+        self._stopwords = set(stopwords)
+        self._additional_relations = additional_relations
+        self._nodes = {}
+        self._edges = {}
+        self._graph = RelGraph()
+        # (timestamp, order, sentence_reltuples, cluster, weight)
+        self._sentences = []
+        self._order = count()
+
+    @property
+    def sentences_number(self):
+        return len(self._sentences)
+
+    @property
+    def nodes_number(self):
+        return len(self._nodes)
+
+    @property
+    def edges_number(self):
+        return len(self._edges)
+
+    @profiling.profiled("window_add")
+    def add_conllu(self, conllu, udpipe_model, timestamp, cluster=0, weight=1):
+        """Extract relations from the sentences and add them to the window.
+
+        Return the number of added sentences.
+        """
+        sentences = udpipe_model.read(conllu, "conllu")
+        for sentence in sentences:
+            self.add_sentence_reltuples(
+                SentenceReltuples(
+                    sentence,
+                    self._w2v_model,
+                    additional_relations=self._additional_relations,
+                    stopwords=self._stopwords,
+                ),
+                timestamp,
+                cluster=cluster,
+                weight=weight,
+            )
+        return len(sentences)
+
+    def add_sentence_reltuples(
+        self, sentence_reltuples, timestamp, cluster=0, weight=1
+    ):
+        heapq.heappush(
+            self._sentences,
+            (timestamp, next(self._order), sentence_reltuples, cluster, weight),
+        )
+        self._apply(sentence_reltuples, cluster, weight, 1)
+
+    @profiling.profiled("window_expire")
+    def expire(self, now=None):
+        """Evict the sentences older than the window, return their number."""
+        if now is None:
+            now = time.time()
+        evicted = 0
+        while self._sentences and self._sentences[0][0] < now - self.window:
+            _, _, sentence_reltuples, cluster, weight = heapq.heappop(self._sentences)
+            self._apply(sentence_reltuples, cluster, weight, -1)
+            evicted += 1
+        profiling.count("sentences", evicted)
+        return evicted
+
+    def graph(self):
+        """RelGraph of the sentences in the window.
+
+        The graph is changed as sentences are added and expire, merge or
+        filter a copy of it.
+        """
+        return self._graph
+
+    def _apply(self, sentence_reltuples, cluster, weight, sign):
+        text = sentence_reltuples.text
+        edges = [_edge_key(reltuple, cluster) for reltuple in sentence_reltuples]
+        # the inherited relations the sentence may change, before and after it
+        inherited = self._inherited_candidates(edges)
+        for reltuple, (source, target, key) in zip(sentence_reltuples, edges):
+            self._apply_node(
+                source,
+                reltuple.left_arg_lemmas,
+                reltuple.left_arg,
+                reltuple.left_w2v,
+                text,
+                cluster,
+                weight,
+                sign,
+            )
+            self._apply_node(
+                target,
+                reltuple.right_arg_lemmas,
+                reltuple.right_arg,
+                reltuple.right_w2v,
+                text,
+                cluster,
+                weight,
+                sign,
+            )
+            edge = self._edges.get((source, target, key))
+            if edge is None:
+                edge = self._edges[(source, target, key)] = _Edge()
+            form = (reltuple.relation, reltuple.relation_lemmas, reltuple.right_deprel)
+            _update(edge.forms, form, sign)
+            _update(edge.description, text, sign)
+            _update(edge.feat_type, cluster, sign)
+            edge.weight += sign * weight
+            edge.n += sign
+            if edge.n == 0:
+                del self._edges[(source, target, key)]
+
+        graph = self._graph._graph
+        nodes = {node for source, target, _ in edges for node in (source, target)}
+        for node in nodes:
+            if node not in self._nodes:
+                continue
+            if node in graph:
+                graph.nodes[node].update(self._nodes[node].attributes())
+            else:
+                self._graph._add_node(**self._nodes[node].attributes())
+        for source, target, key in set(edges):
+            if graph.has_edge(source, target, key=key):
+                graph.remove_edge(source, target, key=key)
+            if (source, target, key) in self._edges:
+                self._graph._add_edge(
+                    **self._edges[(source, target, key)].attributes(source, target)
+                )
+        inherited |= self._inherited_candidates(edges)
+        for edge in inherited:
+            self._inherit(*edge)
+        for node in nodes:
+            if node not in self._nodes and node in graph:
+                graph.remove_node(node)
+
+    def _apply_node(self, name, lemmas, label, vector, text, cluster, weight, sign):
+        node = self._nodes.get(name)
+        if node is None:
+            node = self._nodes[name] = _Node(lemmas, cluster)
+        _update(node.labels, label, sign)
+        _update(node.description, text, sign)
+        node.weight += sign * weight
+        node.vector = node.vector + sign * vector
+        node.n += sign
+        if node.n == 0:
+            del self._nodes[name]
+
+    def _inherited_candidates(self, edges):
+        """Relations that may be inherited from or through the `edges`."""
+        candidates = set()
+        for source, target, key in edges:
+            if key == "_is_a_":
+                for node in self._is_a_closure(source, reverse=True):
+                    for edge in self._verb_edges(node):
+                        candidates |= self._inherited_copies(*edge)
+            elif key != "_relates_to_":
+                candidates |= self._inherited_copies(source, target, key)
+        return candidates
+
+    def _inherited_copies(self, source, target, key):
+        return {
+            (copy_source, copy_target, key)
+            for copy_source in self._is_a_closure(source)
+            for copy_target in self._is_a_closure(target)
+        }
+
+    def _inherit(self, source, target, key):
+        """Update the relation if it's inherited and not in the sentences.
+
+        It's a copy of the heaviest relation between the `_is_a_` predecessors
+        of the nodes, the nodes themselves included.
+        """
+        if (source, target, key) in self._edges:
+            return
+        graph = self._graph._graph
+        if graph.has_edge(source, target, key=key):
+            graph.remove_edge(source, target, key=key)
+        if source not in self._nodes or target not in self._nodes:
+            return
+        origins = [
+            (origin_source, origin_target, key)
+            for origin_source in self._is_a_closure(source, reverse=True)
+            for origin_target in self._is_a_closure(target, reverse=True)
+            if (origin_source, origin_target, key) in self._edges
+        ]
+        if origins:
+            origin = max(origins, key=lambda edge: (self._edges[edge].weight, edge))
+            self._graph._add_edge(**self._edges[origin].attributes(source, target))
+
+    def _is_a_closure(self, node, reverse=False):
+        """The node and its `_is_a_` successors, or predecessors if `reverse`."""
+        graph = self._graph._graph
+        closure = {node}
+        queue = [node]
+        while queue:
+            node = queue.pop()
+            if node not in graph:
+                continue
+            if reverse:
+                neighbours = (
+                    source
+                    for source, _, key in graph.in_edges(node, keys=True)
+                    if key == "_is_a_"
+                )
+            else:
+                neighbours = (
+                    target
+                    for _, target, key in graph.out_edges(node, keys=True)
+                    if key == "_is_a_"
+                )
+            for neighbour in neighbours:
+                if neighbour not in closure:
+                    closure.add(neighbour)
+                    queue.append(neighbour)
+        return closure
+
+    def _verb_edges(self, node):
+        """Relations of the node in the sentences other than the special ones."""
+        graph = self._graph._graph
+        if node not in graph:
+            return []
+        return [
+            edge
+            for edge in chain(
+                graph.out_edges(node, keys=True), graph.in_edges(node, keys=True)
+            )
+            if edge in self._edges and edge[2] not in ["_is_a_", "_relates_to_"]
+        ]
+
+
+def _edge_key(reltuple, cluster):
+    source = node_name(reltuple.left_arg_lemmas, cluster)
+    target = node_name(reltuple.right_arg_lemmas, cluster)
+    if reltuple.relation in ["_is_a_", "_relates_to_"]:
+        return source, target, reltuple.relation
+    return (
+        source,
+        target,
+        "{} + {}".format(reltuple.relation_lemmas, reltuple.right_deprel),
+    )
+
+
+def _update(counter, key, sign):
+    counter[key] += sign
+    if counter[key] == 0:
+        del counter[key]
+
+
+def update_dir_graph(graph, conllu_dir, udpipe_model, seen):
+    """Add the CoNLL-U files of the directory that aren't `seen` yet.
+
+    Files are timestamped by their modification time. Return the number of
+    added files.
+    """
+    paths = sorted(conllu_dir.glob("*.conllu"), key=lambda path: path.stat().st_mtime)
+    added = 0
+    for path in paths:
+        if path in seen:
+            continue
+        seen.add(path)
+        timestamp = path.stat().st_mtime
+        if timestamp < time.time() - graph.window:
+            continue
+        with path.open("r", encoding="utf8") as conllu_file:
+            graph.add_conllu(conllu_file.read(), udpipe_model, timestamp)
+        logging.info("Added {} to the window".format(path))
+        added += 1
+    return added
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        handlers=[logging.FileHandler("logs/server.log", "a", "utf-8")],
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(message)s",
+    )
+    parser = argparse.ArgumentParser(
+        description="Keep the graph of the CoNLL-U files of the last hours of a "
+        "directory up to date"
+    )
+    parser.add_argument("model_path", help="Path to the UDPipe model")
+    parser.add_argument("conllu_dir", help="Directory new CoNLL-U files appear in")
+    parser.add_argument("graph_path", help="Path to save the graph to")
+    parser.add_argument(
+        "--window-hours",
+        help="Size of the window (default: 48)",
+        type=float,
+        default=48,
+    )
+    parser.add_argument(
+        "--interval",
+        help="Seconds between updates of the graph (default: 600)",
+        type=float,
+        default=600,
+    )
+    parser.add_argument(
+        "--add", help="Include additional relations", action="store_true"
+    )
+    parser.add_argument(
+        "--entities-limit",
+        help="Filter the saved graph to only contain this many entities",
+        type=int,
+    )
+    parser.add_argument(
+        "--parser-socket",
+        help="Parse texts with the UDPipe service listening on this Unix socket "
+        "instead of loading the model",
+    )
+    args = parser.parse_args()
+    udpipe_model = load_udpipe(args.model_path, args.parser_socket)
+    with open("stopwords.txt", mode="r", encoding="utf-8") as file:
+        stopwords = list(file.read().split())
+    w2v_model = gensim.downloader.load("word2vec-ruscorpora-300")
+
+    windowed_graph = WindowedRelGraph(
+        args.window_hours * 3600,
+        w2v_model,
+        stopwords=stopwords,
+        additional_relations=args.add,
+    )
+    seen_paths = set()
+    while True:
+        added = update_dir_graph(
+            windowed_graph, Path(args.conllu_dir), udpipe_model, seen_paths
+        )
+        evicted = windowed_graph.expire()
+        if not added and not evicted:
+            time.sleep(args.interval)
+            continue
+        snapshot = copy.deepcopy(windowed_graph.graph())
+        snapshot.merge_relations()
+        snapshot.filter_nodes(args.entities_limit or float("inf"))
+        snapshot.save(args.graph_path)
+        logging.info(
+            "Window of {} sentences ({} evicted) saved to {}".format(
+                windowed_graph.sentences_number, evicted, args.graph_path
+            )
+        )
+        time.sleep(args.interval)